@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .db import get_pool
+from .task_extractor import SYSTEM_PROMPT
+
+log = logging.getLogger(__name__)
+
+# SYSTEM_PROMPT 一改，版本号就变，旧 key 自然失效；也可以用 env 强制指定
+PROMPT_VERSION = os.getenv("ANALYZE_PROMPT_VERSION") or hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+# L2 过期行：读时按 expires_at 过滤，后台 job 定期分批删除（多 worker 时用 advisory lock 保证只有一个在删）
+_PRUNE_LOCK_KEY = 0x11FEB0C8
+PRUNE_INTERVAL_S = float(os.getenv("ANALYZE_CACHE_PRUNE_INTERVAL_S", "3600"))
+PRUNE_BATCH_SIZE = int(os.getenv("ANALYZE_CACHE_PRUNE_BATCH_SIZE", "5000"))
+
+
+def cache_key(*, text: str, locale: str, source_hint: Optional[str], model: str, prompt_version: str = PROMPT_VERSION) -> str:
+    """
+    Content-addressed key for one analyze call.
+    `now` is intentionally not part of the key: due_at is copied verbatim from the text,
+    so the result does not depend on it.
+    """
+    raw = json.dumps([text, locale, source_hint, model, prompt_version], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnalyzeCache:
+    """
+    两级缓存：
+    - L1: 进程内 LRU + TTL
+    - L2: Postgres UNLOGGED 表 analyze_cache（多 worker 共享，可选）
+    """
+
+    def __init__(self, *, max_items: int = 2048, ttl_s: float = 86400.0, use_pg: bool = False):
+        self.max_items = max_items
+        self.ttl_s = ttl_s
+        self.use_pg = use_pg
+        self._lru: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.pg_hits = 0
+        self.misses = 0
+
+    # ---------- L1 ----------
+    def _get_local(self, key: str) -> Optional[Dict[str, Any]]:
+        item = self._lru.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            self._lru.pop(key, None)
+            return None
+        self._lru.move_to_end(key)
+        return value
+
+    def _put_local(self, key: str, value: Dict[str, Any]) -> None:
+        self._lru[key] = (time.monotonic() + self.ttl_s, value)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_items:
+            self._lru.popitem(last=False)
+
+    # ---------- public ----------
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._get_local(key)
+        if value is not None:
+            self.hits += 1
+            return copy.deepcopy(value)
+
+        if self.use_pg:
+            value = await self._get_pg(key)
+            if value is not None:
+                self.pg_hits += 1
+                self._put_local(key, value)
+                return copy.deepcopy(value)
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, value: Dict[str, Any]) -> None:
+        value = copy.deepcopy(value)
+        self._put_local(key, value)
+        if self.use_pg:
+            await self._put_pg(key, value)
+
+    async def invalidate(self, *, keep_prompt_version: Optional[str] = None) -> None:
+        """
+        Drop cached results.
+        - keep_prompt_version=None: 全部清空
+        - keep_prompt_version=PROMPT_VERSION: 只删除旧 prompt 版本的 L2 行（启动时调用）
+        """
+        if keep_prompt_version is None:
+            self._lru.clear()
+        if not self.use_pg:
+            return
+        try:
+            pool = get_pool()
+            async with pool.acquire() as conn:
+                if keep_prompt_version is None:
+                    await conn.execute("delete from analyze_cache")
+                else:
+                    await conn.execute(
+                        "delete from analyze_cache where prompt_version <> $1",
+                        keep_prompt_version,
+                    )
+        except Exception:
+            log.exception("analyze_cache invalidate failed")
+
+    async def prune_expired(self) -> int:
+        """Delete expired L2 rows, batch by batch; 0 if another worker holds the lock."""
+        if not self.use_pg:
+            return 0
+        deleted = 0
+        pool = get_pool()
+        async with pool.acquire() as conn:
+            if not await conn.fetchval("select pg_try_advisory_lock($1)", _PRUNE_LOCK_KEY):
+                return 0
+            try:
+                while True:
+                    # idx_analyze_cache_expires_at
+                    n = await conn.fetchval(
+                        """
+                        with d as (
+                          delete from analyze_cache
+                          where key in (
+                            select key from analyze_cache
+                            where expires_at < now()
+                            limit $1
+                          )
+                          returning 1
+                        )
+                        select count(*) from d
+                        """,
+                        PRUNE_BATCH_SIZE,
+                    )
+                    deleted += n
+                    if n < PRUNE_BATCH_SIZE:
+                        break
+                    await asyncio.sleep(0)
+            finally:
+                await conn.execute("select pg_advisory_unlock($1)", _PRUNE_LOCK_KEY)
+        if deleted:
+            log.info("analyze_cache: pruned %d expired rows", deleted)
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.pg_hits + self.misses
+        return {
+            "hits": self.hits,
+            "pg_hits": self.pg_hits,
+            "misses": self.misses,
+            "hit_ratio": ((self.hits + self.pg_hits) / total) if total else 0.0,
+            "size": len(self._lru),
+            "prompt_version": PROMPT_VERSION,
+        }
+
+    # ---------- L2 ----------
+    async def _get_pg(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            pool = get_pool()
+            async with pool.acquire() as conn:
+                row = await conn.fetchrow(
+                    """
+                    select result
+                    from analyze_cache
+                    where key = $1 and expires_at > now()
+                    """,
+                    key,
+                )
+        except Exception:
+            log.exception("analyze_cache pg get failed")
+            return None
+        if not row:
+            return None
+        try:
+            return json.loads(row["result"])
+        except Exception:
+            return None
+
+    async def _put_pg(self, key: str, value: Dict[str, Any]) -> None:
+        try:
+            pool = get_pool()
+            async with pool.acquire() as conn:
+                await conn.execute(
+                    """
+                    insert into analyze_cache (key, prompt_version, result, expires_at)
+                    values ($1, $2, $3, now() + make_interval(secs => $4))
+                    on conflict (key) do update set
+                      result = excluded.result,
+                      prompt_version = excluded.prompt_version,
+                      expires_at = excluded.expires_at
+                    """,
+                    key,
+                    PROMPT_VERSION,
+                    json.dumps(value, ensure_ascii=False),
+                    float(self.ttl_s),
+                )
+        except Exception:
+            log.exception("analyze_cache pg put failed")
+
+
+_cache: Optional[AnalyzeCache] = None
+
+
+def get_analyze_cache() -> AnalyzeCache:
+    global _cache
+    if _cache is None:
+        _cache = AnalyzeCache(
+            max_items=int(os.getenv("ANALYZE_CACHE_MAX_ITEMS", "2048")),
+            ttl_s=float(os.getenv("ANALYZE_CACHE_TTL_S", "86400")),
+            use_pg=os.getenv("ANALYZE_CACHE_PG", "0") == "1",
+        )
+    return _cache
+
+
+async def _prune_loop() -> None:
+    while True:
+        await asyncio.sleep(PRUNE_INTERVAL_S)
+        try:
+            await get_analyze_cache().prune_expired()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("analyze_cache prune failed")
+
+
+_task: Optional[asyncio.Task] = None
+
+
+async def init_analyze_cache() -> None:
+    global _task
+    cache = get_analyze_cache()
+    # SYSTEM_PROMPT 变更后，清掉 L2 里旧 prompt 版本的缓存
+    await cache.invalidate(keep_prompt_version=PROMPT_VERSION)
+    if not cache.use_pg or _task is not None:
+        return
+    _task = asyncio.create_task(_prune_loop())
+
+
+async def close_analyze_cache() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
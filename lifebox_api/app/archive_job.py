@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, List
+
+from .db import get_pool
+from . import queries
+
+log = logging.getLogger(__name__)
+
+# 多个 worker 都会启动这些 job；用 advisory lock 保证同一时间只有一个在跑
+_ADVISORY_LOCK_KEY = 0x11FEB0C5
+_BLOB_GC_LOCK_KEY = 0x11FEB0C7
+
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "0") == "1"
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_INTERVAL_S = float(os.getenv("ARCHIVE_INTERVAL_S", "3600"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+# blob GC 和归档分开调度：不归档时 delete_record 留下的 blob 也要回收
+BLOB_GC_ENABLED = os.getenv("BLOB_GC_ENABLED", "1") == "1"
+BLOB_GC_INTERVAL_S = float(os.getenv("BLOB_GC_INTERVAL_S", "3600"))
+BLOB_GC_MIN_AGE_S = float(os.getenv("BLOB_GC_MIN_AGE_S", "86400"))
+
+
+async def run_once() -> int:
+    """
+    One archival pass: move `done` records not updated for ARCHIVE_AFTER_DAYS into
+    inbox_records_archive, batch by batch (each batch is its own short transaction).
+    Returns the number of archived records; 0 if another worker holds the lock.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)
+    moved = 0
+
+    pool = get_pool()
+    async with pool.acquire() as conn:
+        if not await conn.fetchval("select pg_try_advisory_lock($1)", _ADVISORY_LOCK_KEY):
+            return 0
+        try:
+            while True:
+                async with conn.transaction():
+                    n = await queries.fetchval(conn, "archive_batch", cutoff, ARCHIVE_BATCH_SIZE)
+                moved += n
+                if n < ARCHIVE_BATCH_SIZE:
+                    break
+                await asyncio.sleep(0)
+        finally:
+            await conn.execute("select pg_advisory_unlock($1)", _ADVISORY_LOCK_KEY)
+
+    if moved:
+        log.info("archive_job: archived %d records", moved)
+    return moved
+
+
+async def gc_blobs_once() -> int:
+    """Drop blobs no live or archived record references; 0 if another worker holds the lock."""
+    pool = get_pool()
+    async with pool.acquire() as conn:
+        if not await conn.fetchval("select pg_try_advisory_lock($1)", _BLOB_GC_LOCK_KEY):
+            return 0
+        try:
+            freed = await queries.fetchval(conn, "blobs_gc", BLOB_GC_MIN_AGE_S)
+        finally:
+            await conn.execute("select pg_advisory_unlock($1)", _BLOB_GC_LOCK_KEY)
+
+    if freed:
+        log.info("archive_job: freed %d blobs", freed)
+    return freed
+
+
+async def _loop(run: Callable[[], Awaitable[int]], interval_s: float, name: str) -> None:
+    while True:
+        try:
+            await run()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("%s failed", name)
+        await asyncio.sleep(interval_s)
+
+
+_tasks: List[asyncio.Task] = []
+
+
+async def init_archive_job() -> None:
+    if _tasks:
+        return
+    if ARCHIVE_ENABLED:
+        _tasks.append(asyncio.create_task(_loop(run_once, ARCHIVE_INTERVAL_S, "archive_job")))
+    if BLOB_GC_ENABLED:
+        _tasks.append(asyncio.create_task(_loop(gc_blobs_once, BLOB_GC_INTERVAL_S, "blob_gc")))
+
+
+async def close_archive_job() -> None:
+    for task in _tasks:
+        task.cancel()
+    for task in _tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _tasks.clear()
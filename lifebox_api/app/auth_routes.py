@@ -10,6 +10,7 @@ from google.oauth2 import id_token as google_id_token
 from google.auth.transport import requests as google_requests
 
 from .db import get_pool
+from . import queries
 from .auth_utils import create_access_token, CurrentUser, get_current_user
 from .schemas_auth import GoogleAuthRequest, AuthResponse, MeResponse, UserOut, GroupBrief, UpdateMeRequest
 
@@ -43,19 +44,7 @@ def _verify_password(password: str, password_hash: str) -> bool:
 
 
 async def _get_user_groups(conn, user_id: UUID) -> List[GroupBrief]:
-    rows = await conn.fetch(
-        """
-        select g.id::text as id,
-               g.name,
-               g.group_type,
-               gm.role
-        from group_memberships gm
-        join groups g on g.id = gm.group_id
-        where gm.user_id = $1
-        order by g.created_at desc
-        """,
-        user_id,
-    )
+    rows = await queries.fetch(conn, "user_groups", user_id)
     return [GroupBrief(**dict(r)) for r in rows]
 
 
@@ -321,20 +310,7 @@ async def me(current: CurrentUser = Depends(get_current_user)):
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
-        rows = await conn.fetch(
-            """
-            select g.id::text as id,
-                   g.name,
-                   g.group_type,
-                   gm.role
-            from group_memberships gm
-            join groups g on g.id = gm.group_id
-            where gm.user_id = $1
-            order by g.created_at desc
-            """,
-            current.user_id,
-        )
-        groups = [GroupBrief(**dict(r)) for r in rows]
+        groups = await _get_user_groups(conn, current.user_id)
 
     token = create_access_token(user_id=current.user_id, email=user.get("email"), display_name=user.get("display_name"))
     return MeResponse(
@@ -3,7 +3,7 @@ from __future__ import annotations
 from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Optional
 
-from .db import get_pool
+from .db import get_pool, get_read_pool, publish_write
 from .auth_utils import CurrentUser, get_current_user
 
 from .billing_models import Platform, PlanOut, SubscriptionOut, EntitlementOut, VerifyRequest, WebhookIn
@@ -16,11 +16,16 @@ def _svc() -> BillingService:
     return BillingService(get_pool())
 
 
+def _read_svc(user_id=None) -> BillingService:
+    # 只读查询：可以走 replica（见 db.get_read_pool）
+    return BillingService(get_read_pool(user_id))
+
+
 @router.get("/plans", response_model=list[PlanOut])
 async def list_plans(
     platform: Optional[Platform] = Query(default=None),
 ):
-    return await _svc().list_plans(platform)
+    return await _read_svc().list_plans(platform)
 
 
 @router.get("/subscription", response_model=SubscriptionOut)
@@ -30,7 +35,7 @@ async def get_subscription(current: CurrentUser = Depends(get_current_user)):
 
 @router.get("/entitlements", response_model=list[EntitlementOut])
 async def get_entitlements(current: CurrentUser = Depends(get_current_user)):
-    return await _svc().list_entitlements(current.user_id)
+    return await _read_svc(current.user_id).list_entitlements(current.user_id)
 
 
 @router.post("/verify", response_model=SubscriptionOut)
@@ -39,6 +44,8 @@ async def verify(req: VerifyRequest, current: CurrentUser = Depends(get_current_
         return await _svc().verify_and_update(user_id=current.user_id, req=req, source="client")
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await publish_write(current.user_id)
 
 
 # -----------------------------
@@ -1,32 +1,51 @@
 from __future__ import annotations
+import base64
+import hashlib
 import json
 import logging
+import os
 
 from altair import Dict
-from fastapi import APIRouter, Depends, HTTPException, Query
-from typing import Optional, List, Any
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from typing import Optional, List, Any, FrozenSet, Tuple, get_args
 from uuid import UUID, uuid4
 
-from .db import get_pool
+from .db import get_listener, get_pool, get_read_pool, write_conn
+from . import jsonutil, queries
+from .membership_cache import get_membership_cache
 from .auth_utils import CurrentUser, get_current_user
-from .schemas_cloud import CloudSaveRequest, CloudSaveResponse, CloudListItem, CloudDetail
+from .schemas_cloud import (
+    CloudSaveRequest,
+    CloudSaveResponse,
+    CloudBulkSaveRequest,
+    CloudBulkSaveResponse,
+    CloudListItem,
+    CloudListItemExpanded,
+    CloudDetail,
+    CloudCalendarItem,
+    CloudSyncItem,
+    CloudSyncResponse,
+    CloudPatchRequest,
+    CloudPatchResponse,
+    CloudBulkStatusRequest,
+    CloudBulkStatusResponse,
+    CloudSummaryScope,
+    CloudSummaryResponse,
+    Risk,
+    Status,
+)
+from .task_extractor import resolve_due_at
+from .jsonutil import FastJSONResponse
+from .record_events import CLOSED, MEMBERSHIP, OVERFLOW, get_record_events
 
 router = APIRouter(prefix="/api/cloud", tags=["cloud"])
 
 
-async def _assert_group_member(*, group_id: UUID, user_id: UUID) -> None:
-    pool = get_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            select 1
-            from group_memberships
-            where group_id = $1 and user_id = $2
-            """,
-            group_id,
-            user_id,
-        )
-    if not row:
+async def _assert_group_member(*, group_id: UUID, user_id: UUID, conn=None) -> None:
+    role = await get_membership_cache().get_role(group_id=group_id, user_id=user_id, conn=conn)
+    if role is None:
         raise HTTPException(status_code=403, detail="Not a group member")
     
 def _build_normalized(req: CloudSaveRequest) -> Dict[str, Any]:
@@ -65,6 +84,103 @@ def _build_normalized(req: CloudSaveRequest) -> Dict[str, Any]:
     return n
 
 
+# inbox_records 的写入列（顺序与 _record_row 返回的 tuple 一致）
+_INSERT_COLS = (
+    "id",
+    "owner_user_id",
+    "group_id",
+    "client_id",
+    "locale",
+    "source_hint",
+    "raw_text_hash",
+    "model",
+    "model_raw_hash",
+    "title",
+    "source",
+    "assignee",
+    "due_at",
+    "amount",
+    "currency",
+    "phones",
+    "urls",
+    "risk",
+    "status",
+    "suggested_actions",
+    "normalized",
+    "color_value",
+    "due_ts",
+    "due_precision",
+)
+
+_INSERT_COLS_SQL = ", ".join(_INSERT_COLS)
+
+BULK_MAX_ITEMS = int(os.getenv("CLOUD_BULK_MAX_ITEMS", "1000"))
+
+
+# raw_text / model_raw 放在 inbox_blobs（V19）：按 sha256 去重，lz4 TOAST 压缩，行里只存 hash
+# 写入时 upsert 会刷新 last_used_at，inbox_blobs_gc() 不会删掉正在被引用的 blob
+_UPSERT_BLOBS = """
+    insert into inbox_blobs (hash, body)
+    select * from unnest($1::bytea[], $2::text[])
+    order by 1
+    on conflict (hash) do update set last_used_at = now()
+"""
+
+
+def _blob_hash(body: Optional[str]) -> Optional[bytes]:
+    if body is None:
+        return None
+    return hashlib.sha256(body.encode("utf-8")).digest()
+
+
+def _blobs(reqs: List[CloudSaveRequest]) -> Tuple[List[bytes], List[str]]:
+    """
+    -> (hashes, bodies)，同一批内去重（on conflict do update 不允许同一行出现两次）
+    """
+    seen: Dict[bytes, str] = {}
+    for req in reqs:
+        for body in (req.raw_text, req.model_raw):
+            if body is not None:
+                seen.setdefault(_blob_hash(body), body)
+    return list(seen.keys()), list(seen.values())
+
+
+def _record_row(req: CloudSaveRequest, *, record_id: UUID, owner_user_id: UUID) -> Tuple[Any, ...]:
+    """
+    CloudSaveRequest -> inbox_records 的一行（按 _INSERT_COLS 顺序）
+    """
+    n = _build_normalized(req)
+
+    resolved = resolve_due_at(n.get("due_at"), now=req.now, locale=req.locale)
+
+    return (
+        record_id,
+        owner_user_id,
+        req.group_id,
+        req.client_id,
+        req.locale,
+        req.source_hint,
+        _blob_hash(req.raw_text),
+        req.model,
+        _blob_hash(req.model_raw),
+        n.get("title") or "Untitled",
+        n.get("source"),
+        n.get("assignee"),
+        n.get("due_at"),
+        n.get("amount"),
+        n.get("currency"),
+        n.get("phones") or [],
+        n.get("urls") or [],
+        n.get("risk") or "low",
+        n.get("status") or "pending",
+        n.get("suggested_actions") or [],
+        n,
+        n.get("colorValue"),
+        resolved.at if resolved else None,
+        resolved.precision if resolved else None,
+    )
+
+
 @router.post("/records", response_model=CloudSaveResponse)
 async def save_record(
     req: CloudSaveRequest,
@@ -75,188 +191,1158 @@ async def save_record(
     if req.group_id is not None:
         await _assert_group_member(group_id=req.group_id, user_id=user.user_id)
 
-    n = _build_normalized(req)
-    client_id = req.client_id
-
-    title = n.get("title") or "Untitled"
-    source = n.get("source")
-    assignee = n.get("assignee")
-    due_at = n.get("due_at")
-    amount = n.get("amount")
-    currency = n.get("currency")
-    phones = n.get("phones") or []
-    urls = n.get("urls") or []
-    risk = n.get("risk") or "low"
-    status = n.get("status") or "pending"
-    suggested_actions = n.get("suggested_actions") or []
-    color_value = n.get("colorValue")
-
-    normalized_text = json.dumps(n, ensure_ascii=False)
+    row = _record_row(req, record_id=uuid4(), owner_user_id=user.user_id)
+    hashes, bodies = _blobs([req])
+    placeholders = ",".join(f"${i}" for i in range(3, len(_INSERT_COLS) + 3))
 
-    pool = get_pool()
-    async with pool.acquire() as conn:
+    # 写完后 DB_READ_YOUR_WRITES_S 秒内该用户的读都走主库（read-your-writes，所有 worker）
+    async with write_conn(user.user_id) as conn:
+        try:
+            # (owner_user_id, client_id) 唯一：并发重试也只会插入一次
+            async with queries.timed("record_insert"):
+                # blob upsert 和记录 insert 放在同一条语句里，仍然一次往返
+                inserted = await conn.fetchval(
+                    f"""
+                    with blobs as ({_UPSERT_BLOBS})
+                    insert into inbox_records ({_INSERT_COLS_SQL})
+                    values ({placeholders})
+                    on conflict (owner_user_id, client_id) do nothing
+                    returning id::text
+                    """,
+                    hashes,
+                    bodies,
+                    *row,
+                )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"DB insert failed: {e}")
+
+        if inserted:
+            return CloudSaveResponse(id=inserted, existed=False)
+
+        existed = await queries.fetchval(conn, "record_id_by_client_id", user.user_id, req.client_id)
+
+    return CloudSaveResponse(id=existed, existed=True)
+
+
+@router.post("/records/bulk", response_model=CloudBulkSaveResponse)
+async def save_records_bulk(
+    req: CloudBulkSaveRequest,
+    user: CurrentUser = Depends(get_current_user),
+):
+    """
+    批量上传（首次开启云同步时上传整个本地 inbox）
+    - COPY 进临时表，再一条 insert ... on conflict do nothing 写入
+    - 按请求顺序返回每条的 id / existed（client_id 已存在则 existed=true）
+    """
+    if len(req.items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Too many items (max {BULK_MAX_ITEMS})")
 
-        if client_id:
-            existed = await conn.fetchrow(
+    group_ids = {item.group_id for item in req.items if item.group_id is not None}
+    rows = [_record_row(item, record_id=uuid4(), owner_user_id=user.user_id) for item in req.items]
+    client_ids = list({item.client_id for item in req.items if item.client_id})
+
+    async with write_conn(user.user_id) as conn:
+        if group_ids:
+            member_of = await conn.fetch(
                 """
-                select id::text as id
-                from inbox_records
-                where owner_user_id = $1 and client_id = $2
-                limit 1
+                select group_id
+                from group_memberships
+                where user_id = $1 and group_id = any($2::uuid[])
                 """,
                 user.user_id,
-                client_id,
+                list(group_ids),
             )
-            if existed:
-                return CloudSaveResponse(id=existed["id"], existed=True)
-            
-        record_id = uuid4()
-        try:
+            if len(member_of) != len(group_ids):
+                raise HTTPException(status_code=403, detail="Not a group member")
 
-            await conn.execute(
-                """
-                insert into inbox_records (
-                  id,
-                  owner_user_id,
-                  group_id,
-                  client_id,
-                  locale,
-                  source_hint,
-                  raw_text,
-                  model,
-                  model_raw,
-                  title,
-                  source,
-                  assignee,
-                  due_at,
-                  amount,
-                  currency,
-                  phones,
-                  urls,
-                  risk,
-                  status,
-                  suggested_actions,
-                  normalized,
-                  color_value
-                ) values (
-                  $1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11,$12,$13,$14,$15,$16,$17,$18,$19,$20,$21,$22
+        try:
+            async with conn.transaction():
+                hashes, bodies = _blobs(req.items)
+                if hashes:
+                    await conn.execute(_UPSERT_BLOBS, hashes, bodies)
+                await conn.execute(
+                    """
+                    create temp table inbox_records_bulk
+                    (like inbox_records including defaults)
+                    on commit drop
+                    """
                 )
-                """,
-                record_id,
-                user.user_id,
-                req.group_id,
-                client_id,
-                req.locale,
-                req.source_hint,
-                req.raw_text,
-                req.model,
-                req.model_raw,
-                title,
-                source,
-                assignee,
-                due_at,
-                amount,
-                currency,
-                phones,
-                urls,
-                risk,
-                status,
-                suggested_actions,
-                normalized_text,
-                color_value
-            )
+                await conn.copy_records_to_table(
+                    "inbox_records_bulk",
+                    records=rows,
+                    columns=list(_INSERT_COLS),
+                )
+                async with queries.timed("records_bulk_insert"):
+                    inserted = await conn.fetch(
+                        f"""
+                        insert into inbox_records ({_INSERT_COLS_SQL})
+                        select {_INSERT_COLS_SQL} from inbox_records_bulk
+                        on conflict (owner_user_id, client_id) do nothing
+                        returning id
+                        """
+                    )
+                existing = {}
+                if client_ids:
+                    existing = {
+                        r["client_id"]: r["id"]
+                        for r in await queries.fetch(conn, "record_ids_by_client_ids", user.user_id, client_ids)
+                    }
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"DB insert failed: {e}")
 
-    return CloudSaveResponse(id=str(record_id), existed=False)
+    created = {r["id"] for r in inserted}
+    results: List[CloudSaveResponse] = []
+    for item, row in zip(req.items, rows):
+        record_id = row[0]
+        if record_id in created:
+            results.append(CloudSaveResponse(id=str(record_id), existed=False))
+        else:
+            # 没插入 = client_id 冲突（库里已有 / 已归档，或同一批里前面已有同 client_id）
+            results.append(CloudSaveResponse(id=existing[item.client_id], existed=True))
+
+    return CloudBulkSaveResponse(
+        items=results,
+        created=sum(1 for r in results if not r.existed),
+        existed=sum(1 for r in results if r.existed),
+    )
+
+
+# =============================
+# List (keyset pagination)
+# =============================
+# 排序固定为 (created_at desc, id desc)；cursor = 上一页最后一行的 (created_at, id)，
+# base64 编码后对前台不透明。下一页 cursor 放在响应头 X-Next-Cursor（没有下一页则不返回）。
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+_LIST_COLS = """
+    id::text as id,
+    id as _id,
+    client_id,
+    created_at::text as created_at,
+    created_at as _created_at,
+    locale,
+    title,
+    risk,
+    status,
+    due_at,
+    source_hint,
+    group_id::text as group_id
+"""
+
+
+def _encode_cursor(created_at: datetime, record_id: UUID) -> str:
+    raw = json.dumps({"t": created_at.isoformat(), "id": str(record_id)})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        d = json.loads(raw)
+        return datetime.fromisoformat(d["t"]), UUID(d["id"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+_LIST_FIELDS = tuple(CloudListItem.model_fields)
+_CALENDAR_FIELDS = tuple(CloudCalendarItem.model_fields)
+
+
+def _items(rows: List[Any], fields: Tuple[str, ...] = _LIST_FIELDS) -> List[Dict[str, Any]]:
+    """
+    Record -> 与 response_model 同样字段的 dict（缺的字段为 null，_ 开头的辅助列丢掉）。
+    列表是热路径：行已是最终形状，直接序列化，不再逐行过一遍 pydantic。
+    """
+    return [{f: r.get(f) for f in fields} for r in rows]
+
+
+# include=normalized,author：详情 / 创建者信息随列表一起返回（同一个 keyset 查询，免去逐条 GET /records/{id}）
+INCLUDE_OPTIONS = ("normalized", "author")
+
+
+def _parse_include(include: Optional[str]) -> FrozenSet[str]:
+    parts = frozenset(p.strip() for p in (include or "").split(",") if p.strip())
+    bad = parts - set(INCLUDE_OPTIONS)
+    if bad:
+        raise HTTPException(status_code=400, detail=f"Unknown include: {', '.join(sorted(bad))}")
+    return parts
+
+
+def _list_cols(include: FrozenSet[str]) -> str:
+    cols = _LIST_COLS
+    if "normalized" in include:
+        cols += ", normalized"
+    if "author" in include:
+        cols += ", owner_user_id as _owner"
+    return cols
+
+
+def _join_author(q: str, include: FrozenSet[str], order_by: str) -> str:
+    """
+    只对分页后的（最多 limit+1）行 join users，再按原顺序排
+    """
+    if "author" not in include:
+        return q
+    return f"""
+    select t.*, u.display_name as _author_name, u.avatar_url as _author_avatar
+    from ({q}) t
+    left join users u on u.id = t._owner
+    order by {order_by}
+    """
+
+
+def _expanded_items(rows: List[Any], include: FrozenSet[str]) -> List[Dict[str, Any]]:
+    items = _items(rows, _LIST_FIELDS + (("normalized",) if "normalized" in include else ()))
+    if "author" in include:
+        for item, r in zip(items, rows):
+            owner = r["_owner"]
+            item["author"] = {
+                "id": str(owner) if owner else None,
+                "display_name": r["_author_name"],
+                "avatar_url": r["_author_avatar"],
+            }
+    return items
+
+
+def _json(content: Any, response: Response) -> FastJSONResponse:
+    # 直接返回 Response 时，注入的 response 上设置的 header（ETag / X-Next-Cursor）要手动带上
+    return FastJSONResponse(content, headers=dict(response.headers))
 
 
-@router.get("/records/getall", response_model=List[CloudListItem])
+def _page(rows: List[Any], limit: int, response: Response, include: FrozenSet[str] = frozenset()) -> FastJSONResponse:
+    """
+    rows 多取了一行（limit + 1）用来判断是否还有下一页。
+    """
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if has_more:
+        last = rows[-1]
+        response.headers[NEXT_CURSOR_HEADER] = _encode_cursor(last["_created_at"], last["_id"])
+    return _json(_expanded_items(rows, include), response)
+
+
+# =============================
+# Conditional GET (ETag / If-None-Match)
+# =============================
+# ETag 由 inbox_scope_versions（V18，写入时触发器 +1）计算：版本没变就直接 304，不查 inbox_records
+
+def _list_etag(kind: str, *parts: Any) -> str:
+    h = hashlib.sha1(json.dumps([kind, *parts], default=str).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{kind}.{h}"'
+
+
+def _record_etag(record_id: UUID, group_id: Optional[UUID], owner_user_id: Optional[UUID], version: int) -> str:
+    # 详情的 ETag 里带上 scope，下次请求不查记录也能知道该比较哪个版本号
+    if group_id is not None:
+        return f'W/"r.{record_id}.g.{group_id}.{version}"'
+    return f'W/"r.{record_id}.p.{owner_user_id}.{version}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+def _parse_record_etag(if_none_match: Optional[str], record_id: UUID) -> Optional[Tuple[bool, UUID, str]]:
+    """
+    If-None-Match 里找本记录的 ETag -> (is_group, scope_id, etag)
+    """
+    if not if_none_match:
+        return None
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        parts = tag[3:-1].split(".") if tag.startswith('W/"r.') else []
+        if len(parts) != 5 or parts[1] != str(record_id) or parts[2] not in ("g", "p"):
+            continue
+        try:
+            return parts[2] == "g", UUID(parts[3]), tag
+        except ValueError:
+            continue
+    return None
+
+
+@router.get("/records/getall", response_model=List[CloudListItemExpanded])
 async def list_records(
+    response: Response,
     user: CurrentUser = Depends(get_current_user),
     group_id: Optional[UUID] = Query(default=None),
     limit: int = Query(default=50, ge=1, le=200),
+    cursor: Optional[str] = Query(default=None),
+    include: Optional[str] = Query(default=None),
+    if_none_match: Optional[str] = Header(default=None),
 ):
+    inc = _parse_include(include)
     if group_id is not None:
         await _assert_group_member(group_id=group_id, user_id=user.user_id)
-        q = """
-        select id::text as id,
-               client_id,
-               created_at::text as created_at,
-               locale,
-               title,
-               risk,
-               status,
-               due_at,
-               source_hint,
-               group_id::text as group_id
+        where = "group_id = $1"
+        args: List[Any] = [group_id, limit + 1]
+    else:
+        where = "owner_user_id = $1 and group_id is null"
+        args = [user.user_id, limit + 1]
+
+    if cursor:
+        ts, rid = _decode_cursor(cursor)
+        where += " and (created_at, id) < ($3, $4)"
+        args += [ts, rid]
+
+    # idx_inbox_records_{group,owner}_created（归档表上有对应索引）：index scan 直接从 cursor 位置开始，
+    # 深翻页也是常数成本；热表 / 归档各取 limit+1 行再合并
+    cols = _list_cols(inc)
+    q = f"""
+    select * from (
+      (
+        select {cols}
         from inbox_records
-        where group_id = $1
-        order by created_at desc
+        where {where}
+        order by created_at desc, id desc
+        limit $2
+      )
+      union all
+      (
+        select {cols}
+        from inbox_records_archived
+        where {where}
+        order by created_at desc, id desc
+        limit $2
+      )
+    ) t
+    order by _created_at desc, _id desc
+    limit $2
+    """
+    q = _join_author(q, inc, "t._created_at desc, t._id desc")
+
+    pool = get_read_pool(user.user_id)
+    async with pool.acquire() as conn:
+        # 版本号先于数据读：并发写入时最多让下一次请求多拉一次，不会 304 掉新数据
+        is_group = group_id is not None
+        version = await queries.fetchval(conn, "scope_version", is_group, args[0]) or 0
+        etag = _list_etag("l", is_group, args[0], version, limit, cursor, sorted(inc))
+        if _etag_matches(if_none_match, etag):
+            return _not_modified(etag)
+
+        async with queries.timed("records_page"):
+            rows = await conn.fetch(q, *args)
+
+    response.headers["ETag"] = etag
+    return _page(rows, limit, response, inc)
+
+
+@router.get("/records/all", response_model=List[CloudListItemExpanded])
+async def list_records_all(
+    response: Response,
+    user: CurrentUser = Depends(get_current_user),
+    limit: int = Query(default=50, ge=1, le=200),
+    cursor: Optional[str] = Query(default=None),
+    include: Optional[str] = Query(default=None),
+    if_none_match: Optional[str] = Header(default=None),
+):
+    """
+    聚合拉取：
+    - 个人记录（owner_user_id = me and group_id is null）
+    - 我所属所有 group 的记录（group_id in my memberships）
+    各部分（含归档表）各自走索引取 limit+1 行，再合并排序（避免 OR 条件导致全表扫描）
+    """
+    inc = _parse_include(include)
+    cols = _list_cols(inc)
+    keyset = ""
+    args: List[Any] = [user.user_id, limit + 1]
+    if cursor:
+        ts, rid = _decode_cursor(cursor)
+        keyset = "and (created_at, id) < ($3, $4)"
+        args += [ts, rid]
+
+    branches = []
+    for src in ("inbox_records", "inbox_records_archived"):
+        branches += [
+            f"""
+      (
+        select {cols}
+        from {src}
+        where owner_user_id = $1 and group_id is null {keyset}
+        order by created_at desc, id desc
+        limit $2
+      )""",
+            f"""
+      (
+        select {cols}
+        from {src}
+        where group_id in (
+          select group_id
+          from group_memberships
+          where user_id = $1
+        ) {keyset}
+        order by created_at desc, id desc
         limit $2
+      )""",
+        ]
+    union = "\n      union all".join(branches)
+    q = f"""
+    select * from ({union}
+    ) t
+    order by _created_at desc, _id desc
+    limit $2
+    """
+    q = _join_author(q, inc, "t._created_at desc, t._id desc")
+
+    pool = get_read_pool(user.user_id)
+    async with pool.acquire() as conn:
+        # 个人 + 所有 group 的版本号（含 group 列表本身：加入 / 退出 group 也会换 ETag）
+        versions = sorted(
+            (str(r["scope_id"]), r["is_group"], r["version"])
+            for r in await queries.fetch(conn, "user_scope_versions", user.user_id)
+        )
+        etag = _list_etag("a", versions, limit, cursor, sorted(inc))
+        if _etag_matches(if_none_match, etag):
+            return _not_modified(etag)
+
+        async with queries.timed("records_all"):
+            rows = await conn.fetch(q, *args)
+
+    response.headers["ETag"] = etag
+    return _page(rows, limit, response, inc)
+
+
+# =============================
+# Search
+# =============================
+# pg_trgm GIN 索引：inbox_records 上的 title + notes（V19），inbox_blobs 上的 raw_text
+# 排序 (rank desc, id desc)，cursor = 上一页最后一行的 (rank, id)，同样放在 X-Next-Cursor
+
+SEARCH_MAX_TERMS = 5
+
+# title + notes 部分（inbox_records 上的 trigram 索引）；raw_text 在 inbox_blobs 上单独有索引
+_SEARCH_HEAD = "inbox_search_text(title, normalized, null)"
+
+
+def _like_pattern(term: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _encode_search_cursor(rank: float, record_id: UUID) -> str:
+    raw = json.dumps({"r": rank, "id": str(record_id)})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_search_cursor(cursor: str) -> Tuple[float, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        d = json.loads(raw)
+        return float(d["r"]), UUID(d["id"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/records/search", response_model=List[CloudListItemExpanded])
+async def search_records(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    user: CurrentUser = Depends(get_current_user),
+    group_id: Optional[UUID] = Query(default=None),
+    limit: int = Query(default=20, ge=1, le=100),
+    cursor: Optional[str] = Query(default=None),
+    include: Optional[str] = Query(default=None),
+):
+    """
+    搜索 title / notes / raw_text（空格分隔的多个词 = AND）
+    - group_id 为空：个人记录 + 我所属所有 group
+    - 排序：title 命中 > notes 命中 > raw_text 命中，同档按 word_similarity
+    """
+    inc = _parse_include(include)
+    terms = [t.lower() for t in q.split() if t][:SEARCH_MAX_TERMS]
+    if not terms:
+        raise HTTPException(status_code=400, detail="Empty query")
+
+    if group_id is not None:
+        await _assert_group_member(group_id=group_id, user_id=user.user_id)
+        scope = "group_id = $1"
+        args: List[Any] = [group_id]
+    else:
+        scope = """
+          (
+            (owner_user_id = $1 and group_id is null)
+            or group_id in (select group_id from group_memberships where user_id = $1)
+          )
         """
-        args = [group_id, limit]
+        args = [user.user_id]
+
+    args += [" ".join(terms), limit + 1]
+
+    # 每个词一个 like 条件：每个都能单独用 trigram 索引
+    match, title_hit, notes_hit = [], [], []
+    for t in terms:
+        args.append(_like_pattern(t))
+        p = f"${len(args)}"
+        match.append(f"_doc like {p}")
+        title_hit.append(f"lower(title) like {p}")
+        notes_hit.append(f"lower(coalesce(normalized->>'notes', '')) like {p}")
+
+    keyset = ""
+    if cursor:
+        rank, rid = _decode_search_cursor(cursor)
+        args += [rank, rid]
+        keyset = f"where (_rank, _id) < (${len(args) - 1}::float8, ${len(args)})"
+
+    # 候选：第一个词命中 title/notes（inbox_records / 归档表上的索引）或 raw_text（inbox_blobs 上的索引）；
+    # 再对候选拼出完整文档，检查所有词并打分。归档的记录同样能搜到（只是不在热表里）
+    candidates = "\n        union all".join(
+        f"""
+        select r.id, r.client_id, r.created_at, r.locale, r.title, r.risk, r.status, r.due_at,
+               r.source_hint, r.group_id, r.owner_user_id, r.normalized,
+               inbox_search_text(r.title, r.normalized, coalesce(b.body, r.raw_text)) as _doc
+        from {src} r
+        left join inbox_blobs b on b.hash = r.raw_text_hash
+        where r.id in (
+          select id from {src}
+          where {scope} and {_SEARCH_HEAD} like $4
+          union
+          select id from {src}
+          where {scope} and raw_text_hash in (
+            select hash from inbox_blobs where lower(body) like $4
+          )
+        )"""
+        for src in ("inbox_records", "inbox_records_archived")
+    )
+    sql = f"""
+    select * from (
+      select {_list_cols(inc)},
+             (
+               case when {" and ".join(title_hit)} then 2 else 0 end
+               + case when {" and ".join(notes_hit)} then 1 else 0 end
+               + word_similarity($2, _doc)
+             )::float8 as _rank
+      from ({candidates}
+      ) r
+      where {" and ".join(match)}
+    ) t
+    {keyset}
+    order by _rank desc, _id desc
+    limit $3
+    """
+    sql = _join_author(sql, inc, "t._rank desc, t._id desc")
+
+    pool = get_pool()
+    async with pool.acquire() as conn:
+        async with queries.timed("records_search"):
+            rows = await conn.fetch(sql, *args)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if has_more:
+        last = rows[-1]
+        response.headers[NEXT_CURSOR_HEADER] = _encode_search_cursor(last["_rank"], last["_id"])
+    return _json(_expanded_items(rows, inc), response)
+
+
+# =============================
+# Delta sync
+# =============================
+# cursor = (xid, id)：已下发所有 (change_xid, id) <= cursor 的变更。
+# 只下发 xid < 当前快照 xmin 的变更（这些事务都已结束），所以不会因为提交顺序漏掉变更。
+
+_NIL_UUID = UUID(int=0)
+
+
+def _encode_sync_cursor(xid: int, record_id: UUID) -> str:
+    raw = json.dumps({"x": str(xid), "id": str(record_id)})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_sync_cursor(cursor: str) -> Tuple[int, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        d = json.loads(raw)
+        return int(d["x"]), UUID(d["id"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/sync", response_model=CloudSyncResponse)
+async def sync_records(
+    user: CurrentUser = Depends(get_current_user),
+    since: Optional[str] = Query(default=None),
+    limit: int = Query(default=200, ge=1, le=1000),
+):
+    """
+    增量同步（个人 + 我所属所有 group）
+    - since 为空：从头开始（首次同步）
+    - changes：since 之后新建 / 更新的记录；deleted：since 之后删除的 record id
+    - has_more=true 时用返回的 cursor 继续拉
+    """
+    after_xid, after_id = _decode_sync_cursor(since) if since else (0, _NIL_UUID)
+
+    pool = get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            hi = int(await conn.fetchval("select pg_snapshot_xmin(pg_current_snapshot())::text"))
+            group_ids = [r["group_id"] for r in await queries.fetch(conn, "user_group_ids", user.user_id)]
+
+            # 归档表也要扫：归档不留墓碑，首次同步的设备要从那里拿到这些记录（change_xid 保持归档前的值）
+            window = "(change_xid, id) > ($2::text::xid8, $3) and change_xid < $4::text::xid8"
+            union = "\n                      union all".join(
+                f"""
+                      (
+                        select {_LIST_COLS}, updated_at::text as updated_at, version, change_xid::text as _xid
+                        from {src}
+                        where {scope} and {window}
+                        order by change_xid, id
+                        limit $5
+                      )"""
+                for src in ("inbox_records", "inbox_records_archived")
+                for scope in ("owner_user_id = $1 and group_id is null", "group_id = any($6::uuid[])")
+            )
+            async with queries.timed("sync_changes"):
+                changed = await conn.fetch(
+                    f"""
+                    select * from ({union}
+                    ) t
+                    """,
+                    user.user_id,
+                    str(after_xid),
+                    after_id,
+                    str(hi),
+                    limit + 1,
+                    group_ids,
+                )
+
+            window = "(deleted_xid, record_id) > ($2::text::xid8, $3) and deleted_xid < $4::text::xid8"
+            async with queries.timed("sync_tombstones"):
+                deleted = await conn.fetch(
+                    f"""
+                    select * from (
+                      (
+                        select record_id, deleted_xid::text as _xid
+                        from inbox_tombstones
+                        where owner_user_id = $1 and group_id is null and {window}
+                        order by deleted_xid, record_id
+                        limit $5
+                      )
+                      union all
+                      (
+                        select record_id, deleted_xid::text as _xid
+                        from inbox_tombstones
+                        where group_id = any($6::uuid[]) and {window}
+                        order by deleted_xid, record_id
+                        limit $5
+                      )
+                    ) t
+                    """,
+                    user.user_id,
+                    str(after_xid),
+                    after_id,
+                    str(hi),
+                    limit + 1,
+                    group_ids,
+                )
+
+    # 合并成一个按 (xid, id) 排序的变更流，截到 limit
+    events = [(int(r["_xid"]), r["_id"], r) for r in changed]
+    events += [(int(r["_xid"]), r["record_id"], None) for r in deleted]
+    events.sort(key=lambda e: (e[0], e[1]))
+
+    has_more = len(events) > limit
+    events = events[:limit]
+
+    changes: List[CloudSyncItem] = []
+    deleted_ids: List[str] = []
+    for _, rid, row in events:
+        if row is None:
+            deleted_ids.append(str(rid))
+        else:
+            changes.append(CloudSyncItem(**dict(row)))
+
+    if has_more:
+        last_xid, last_id, _ = events[-1]
+        cursor = _encode_sync_cursor(last_xid, last_id)
     else:
-        q = """
-        select id::text as id,
-               client_id,
-               created_at::text as created_at,
-               locale,
-               title,
-               risk,
-               status,
-               due_at,
-               source_hint,
-               null::text as group_id
-        from inbox_records
-        where owner_user_id = $1 and group_id is null
-        order by created_at desc
-        limit $2
+        # 这一轮已全部下发：下次从快照 xmin 开始
+        cursor = _encode_sync_cursor(hi, _NIL_UUID)
+
+    return CloudSyncResponse(
+        changes=changes,
+        deleted=deleted_ids,
+        cursor=cursor,
+        has_more=has_more,
+        group_ids=[str(g) for g in group_ids],
+    )
+
+
+# =============================
+# Live stream (SSE)
+# =============================
+# 事件只是“某条记录变了”的提示，内容仍以 /sync 为准：
+# 客户端连上（收到 ready）后先 /sync 一次，之后收到事件再拉详情或 /sync；
+# 断线 / resync 时同样回到 /sync，所以漏掉的事件不会丢数据。
+
+STREAM_KEEPALIVE_S = float(os.getenv("CLOUD_STREAM_KEEPALIVE_S", "15"))
+
+_STREAM_EVENTS = {"insert": "created", "update": "updated", "delete": "deleted"}
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {jsonutil.dumps(data).decode('utf-8')}\n\n"
+
+
+def _resync(reason: str, group_id: Optional[str] = None, personal: bool = False) -> str:
+    scope = "group" if group_id else ("personal" if personal else "all")
+    return _sse("resync", {"reason": reason, "scope": scope, "group_id": group_id})
+
+
+async def _user_group_ids(user_id: UUID) -> List[UUID]:
+    pool = get_pool()
+    async with pool.acquire() as conn:
+        rows = await queries.fetch(conn, "user_group_ids", user_id)
+    return [r["group_id"] for r in rows]
+
+
+@router.get("/stream")
+async def stream_records(user: CurrentUser = Depends(get_current_user)):
+    """
+    SSE：个人 + 我所属所有 group 的记录变更
+    - event: ready     已订阅，客户端此时做一次 /sync
+    - event: created / updated / deleted   {"id", "group_id", "version"}
+    - event: resync    {"reason", "scope", "group_id"}：批量写入 / 成员变化 / 消费太慢，按 scope 重新 /sync
+    - 每 CLOUD_STREAM_KEEPALIVE_S 秒一个注释行保活
+    事件来自 V21 触发器的 pg_notify，每个 worker 一条 LISTEN 连接（db.PgListener）在进程内分发。
+    不在整个流期间占用 pool 连接。
+    """
+    if not get_listener().connected:
+        raise HTTPException(status_code=503, detail="Event stream unavailable")
+
+    hub = get_record_events()
+    # 先订阅再查 group：查询期间的变更不会漏
+    sub = hub.subscribe(user.user_id)
+    try:
+        hub.set_groups(sub, await _user_group_ids(user.user_id))
+    except BaseException:
+        hub.unsubscribe(sub)
+        raise
+
+    async def _stream():
+        try:
+            yield _sse("ready", {"group_ids": [str(g) for s, g in sub.scopes if s]})
+            while True:
+                ev = await sub.get(STREAM_KEEPALIVE_S)
+                if ev is None:
+                    yield ": keepalive\n\n"
+                elif ev is CLOSED:
+                    return
+                elif ev is OVERFLOW:
+                    yield _resync("overflow")
+                elif ev is MEMBERSHIP:
+                    hub.set_groups(sub, await _user_group_ids(user.user_id))
+                    yield _resync("membership")
+                elif ev["op"] == "resync":
+                    yield _resync("bulk", ev.get("group_id"), personal=not ev.get("group_id"))
+                else:
+                    yield _sse(
+                        _STREAM_EVENTS.get(ev["op"], ev["op"]),
+                        {"id": ev["id"], "group_id": ev.get("group_id"), "version": ev.get("version")},
+                    )
+        finally:
+            hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# 日历一次最多查多少天（月视图 + 前后补齐的周）
+CALENDAR_MAX_DAYS = 62
+
+
+@router.get("/records/calendar", response_model=List[CloudCalendarItem])
+async def list_records_calendar(
+    user: CurrentUser = Depends(get_current_user),
+    from_: datetime = Query(..., alias="from"),
+    to: datetime = Query(...),
+    group_id: Optional[UUID] = Query(default=None),
+    limit: int = Query(default=500, ge=1, le=2000),
+):
+    """
+    日历视图：按 due_ts 范围查 [from, to)
+    - group_id 指定：只查该 group
+    - 不指定：个人记录 + 我所属所有 group（与 /records/all 同范围）
+    - 走 (owner_user_id, due_ts) / (group_id, due_ts) 索引的 range scan（热表和归档表各一次）
+    """
+    if to <= from_:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    if to - from_ > timedelta(days=CALENDAR_MAX_DAYS):
+        raise HTTPException(status_code=400, detail=f"Range too large (max {CALENDAR_MAX_DAYS} days)")
+
+    cols = """
+        id::text as id,
+        client_id,
+        created_at::text as created_at,
+        locale,
+        title,
+        risk,
+        status,
+        due_at,
+        source_hint,
+        group_id::text as group_id,
+        due_ts,
+        due_precision
+    """
+
+    if group_id is not None:
+        await _assert_group_member(group_id=group_id, user_id=user.user_id)
+        q = f"""
+        select * from (
+          select {cols}
+          from inbox_records
+          where group_id = $1 and due_ts >= $2 and due_ts < $3
+          union all
+          select {cols}
+          from inbox_records_archived
+          where group_id = $1 and due_ts >= $2 and due_ts < $3
+        ) t
+        order by due_ts asc
+        limit $4
+        """
+        args = [group_id, from_, to, limit]
+    else:
+        q = f"""
+        select * from (
+          select {cols}
+          from inbox_records
+          where owner_user_id = $1 and group_id is null
+            and due_ts >= $2 and due_ts < $3
+          union all
+          select {cols}
+          from inbox_records
+          where group_id in (select group_id from group_memberships where user_id = $1)
+            and due_ts >= $2 and due_ts < $3
+          union all
+          select {cols}
+          from inbox_records_archived
+          where owner_user_id = $1 and group_id is null
+            and due_ts >= $2 and due_ts < $3
+          union all
+          select {cols}
+          from inbox_records_archived
+          where group_id in (select group_id from group_memberships where user_id = $1)
+            and due_ts >= $2 and due_ts < $3
+        ) t
+        order by due_ts asc
+        limit $4
         """
-        args = [user.user_id, limit]
+        args = [user.user_id, from_, to, limit]
+
+    pool = get_pool()
+    async with pool.acquire() as conn:
+        async with queries.timed("records_calendar"):
+            rows = await conn.fetch(q, *args)
+
+    out = _items(rows, _CALENDAR_FIELDS)
+    for d in out:
+        d["due_ts"] = d["due_ts"].isoformat()
+    return FastJSONResponse(out)
+
+
+# =============================
+# Summary
+# =============================
+@router.get("/summary", response_model=CloudSummaryResponse)
+async def summary(
+    user: CurrentUser = Depends(get_current_user),
+    now: Optional[str] = Query(default=None),
+):
+    """
+    首页 / 角标用的计数（个人 + 每个所属 group）
+    - 按 risk / status 计数、金额合计：来自 inbox_summary（写入时增量维护，不扫表）
+    - overdue / due_7d：pending 部分索引上的范围 count
+    - now：前台当前时间（ISO，带时区），默认服务器当前时间
+    """
+    now_dt = datetime.now(timezone.utc)
+    if now:
+        try:
+            now_dt = datetime.fromisoformat(now)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid now")
+        if now_dt.tzinfo is None:
+            now_dt = now_dt.replace(tzinfo=timezone.utc)
 
     pool = get_pool()
     async with pool.acquire() as conn:
-        rows = await conn.fetch(q, *args)
+        group_ids = [r["group_id"] for r in await queries.fetch(conn, "user_group_ids", user.user_id)]
+        counters = await queries.fetch(conn, "summary_counters", user.user_id)
+        due = await queries.fetch(conn, "summary_due", user.user_id, now_dt)
+
+    personal = CloudSummaryScope()
+    groups = {gid: CloudSummaryScope(group_id=str(gid)) for gid in group_ids}
 
-    return [CloudListItem(**dict(r)) for r in rows]
+    for r in counters:
+        sc = groups.get(r["scope_id"]) if r["is_group"] else personal
+        if sc is None:
+            continue
+        n, risk, status, cur = r["n"], r["risk"], r["status"], r["currency"]
+        sc.total += n
+        sc.by_status[status] = sc.by_status.get(status, 0) + n
+        sc.by_risk[risk] = sc.by_risk.get(risk, 0) + n
+        if status == "pending":
+            sc.pending_by_risk[risk] = sc.pending_by_risk.get(risk, 0) + n
+        if cur and r["amount_sum"]:
+            sc.amounts[cur] = sc.amounts.get(cur, 0.0) + r["amount_sum"]
+            if status == "pending":
+                sc.pending_amounts[cur] = sc.pending_amounts.get(cur, 0.0) + r["amount_sum"]
+
+    for r in due:
+        sc = groups.get(r["group_id"]) if r["group_id"] is not None else personal
+        if sc is None:
+            continue
+        sc.overdue = r["overdue"]
+        sc.due_7d = r["due_7d"]
+
+    return CloudSummaryResponse(personal=personal, groups=list(groups.values()))
+
+
+# =============================
+# Update
+# =============================
+# 权限条件直接放进 where：一条 update 完成鉴权 + 写入（$1 = user_id）
+_CAN_WRITE = """
+    (
+      (group_id is null and owner_user_id = $1)
+      or group_id in (select group_id from group_memberships where user_id = $1)
+    )
+"""
+
+BULK_STATUS_MAX_IDS = int(os.getenv("CLOUD_BULK_STATUS_MAX_IDS", "1000"))
+
+
+@router.post("/records/status", response_model=CloudBulkStatusResponse)
+async def set_records_status(
+    req: CloudBulkStatusRequest,
+    user: CurrentUser = Depends(get_current_user),
+):
+    """
+    批量改状态（默认标记为 done），一条 update
+    - 没有权限 / 不存在 / 已经是目标状态的 id 会被跳过（已归档的会先搬回再改）
+    """
+    if len(req.ids) > BULK_STATUS_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"Too many ids (max {BULK_STATUS_MAX_IDS})")
+
+    async with write_conn(user.user_id) as conn:
+        # 已归档的先搬回，否则会被静默跳过
+        await queries.fetchval(conn, "records_rehydrate_many", req.ids, user.user_id)
+        async with queries.timed("records_set_status"):
+            rows = await conn.fetch(
+                f"""
+                update inbox_records
+                set status = $3,
+                    normalized = jsonb_set(normalized, '{{status}}', to_jsonb($3::text))
+                where id = any($2::uuid[])
+                  and status <> $3
+                  and {_CAN_WRITE}
+                returning id::text as id, version, updated_at::text as updated_at
+                """,
+                user.user_id,
+                req.ids,
+                req.status,
+            )
+
+    return CloudBulkStatusResponse(items=[CloudPatchResponse(**dict(r)) for r in rows])
+
+
+# PATCH 里有 typed 列的字段 -> normalized 里对应的 key
+_PATCH_TYPED_KEYS = (
+    ("title", "title"),
+    ("due_at", "due_at"),
+    ("amount", "amount"),
+    ("currency", "currency"),
+    ("risk", "risk"),
+    ("status", "status"),
+    ("color_value", "colorValue"),
+)
+_PATCH_TYPES = {
+    "title": str,
+    "due_at": str,
+    "amount": (int, float),
+    "currency": str,
+    "risk": str,
+    "status": str,
+    "color_value": int,
+}
+
+
+@router.patch("/records/{record_id}", response_model=CloudPatchResponse)
+async def patch_record(
+    record_id: UUID,
+    req: CloudPatchRequest,
+    user: CurrentUser = Depends(get_current_user),
+):
+    """
+    部分更新一条 inbox_records（不重写 raw_text / model_raw）
+    - typed 列 + normalized 同步更新；normalized 用 jsonb || 原地合并
+    - version 做 compare-and-swap：不一致返回 409（detail 带当前 version）
+    """
+    fields = req.model_fields_set - {"version", "now", "normalized"}
+
+    # normalized 的改动：先放客户端传的 normalized，再用 typed 字段覆盖，保持两边一致
+    n_patch: Dict[str, Any] = dict(req.normalized or {})
+    sets: List[str] = []
+    args: List[Any] = [user.user_id, record_id, req.version]
+
+    def _set(col: str, value: Any) -> None:
+        args.append(value)
+        sets.append(f"{col} = ${len(args)}")
+
+    # 有 typed 列的 key 只在 normalized 里传时也要写列（status / due_ts 等被 summary / 归档 / 日历用到）
+    # 同时传了顶层字段则以顶层为准
+    typed: Dict[str, Any] = {}
+    for field, key in _PATCH_TYPED_KEYS:
+        if field in fields:
+            typed[field] = getattr(req, field)
+        elif key in n_patch:
+            typed[field] = n_patch[key]
+    for field, value in typed.items():
+        if value is not None and not isinstance(value, _PATCH_TYPES[field]):
+            raise HTTPException(status_code=400, detail=f"Invalid {field}")
+    for field, allowed in (("risk", get_args(Risk)), ("status", get_args(Status))):
+        if typed.get(field) is not None and typed[field] not in allowed:
+            raise HTTPException(status_code=400, detail=f"Invalid {field}")
+
+    if "title" in typed:
+        _set("title", typed["title"] or "Untitled")
+        n_patch["title"] = typed["title"] or "Untitled"
+    if "summary" in fields:
+        n_patch["notes"] = req.summary
+    if "due_at" in typed:
+        _set("due_at", typed["due_at"])
+        n_patch["due_at"] = typed["due_at"]
+    if "amount" in typed:
+        _set("amount", typed["amount"])
+        n_patch["amount"] = typed["amount"]
+    if "currency" in typed:
+        _set("currency", typed["currency"])
+        n_patch["currency"] = typed["currency"]
+    if "risk" in typed:
+        _set("risk", typed["risk"] or "low")
+        n_patch["risk"] = typed["risk"] or "low"
+    if "status" in typed:
+        _set("status", typed["status"] or "pending")
+        n_patch["status"] = typed["status"] or "pending"
+    if "color_value" in typed:
+        _set("color_value", typed["color_value"])
+        n_patch["colorValue"] = typed["color_value"]
+
+    if n_patch:
+        args.append(n_patch)
+        sets.append(f"normalized = normalized || ${len(args)}::jsonb")
+
+    if not sets:
+        raise HTTPException(status_code=400, detail="Nothing to update")
+
+    async with write_conn(user.user_id) as conn:
+        if "due_at" in typed:
+            # 和保存时一样按记录的 locale 解析（“明日”要落在用户当地的日期上）
+            locale = await queries.fetchval(conn, "record_locale", record_id)
+            resolved = resolve_due_at(typed["due_at"], now=req.now, locale=locale)
+            _set("due_ts", resolved.at if resolved else None)
+            _set("due_precision", resolved.precision if resolved else None)
+
+        sql = f"""
+        update inbox_records
+        set {", ".join(sets)}
+        where id = $2 and version = $3 and {_CAN_WRITE}
+        returning id::text as id, version, updated_at::text as updated_at
+        """
+
+        async with queries.timed("record_patch"):
+            row = await conn.fetchrow(sql, *args)
+        if row:
+            return CloudPatchResponse(**dict(row))
+
+        # 没更新到：区分 404 / 403 / 409（已归档的先搬回再试一次）
+        cur = await queries.fetchrow(conn, "record_access", record_id, user.user_id)
+        if not cur and await _rehydrate(conn, record_id, user.user_id):
+            async with queries.timed("record_patch"):
+                row = await conn.fetchrow(sql, *args)
+            if row:
+                return CloudPatchResponse(**dict(row))
+            cur = await queries.fetchrow(conn, "record_access", record_id, user.user_id)
+
+    if not cur:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not cur["can_write"]:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    raise HTTPException(
+        status_code=409,
+        detail={"message": "Version conflict", "version": cur["version"]},
+    )
+
+
+async def _rehydrate(conn, record_id: UUID, user_id: UUID) -> bool:
+    """
+    record_id 在归档表里（archive_job 移走的冷数据）时，权限检查后搬回 inbox_records。
+    返回 True = 已搬回，调用方重新执行原操作即可；False = 归档里也没有。
+    """
+    a = await queries.fetchrow(conn, "archived_access", record_id, user_id)
+    if not a:
+        return False
+    if not a["can_access"]:
+        if a["group_id"] is not None:
+            raise HTTPException(status_code=403, detail="Not a group member")
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if not await queries.fetchval(conn, "record_rehydrate", record_id):
+        raise HTTPException(status_code=409, detail="Archived record conflicts with an existing client_id")
+    return True
 
 
 @router.get("/records/{record_id}", response_model=CloudDetail)
 async def get_record(
     record_id: UUID,
+    response: Response,
     user: CurrentUser = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(default=None),
 ):
-    pool = get_pool()
+    pool = get_read_pool(user.user_id)
     async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            select id::text as id,
-                   client_id,
-                   created_at::text as created_at,
-                   raw_text,
-                   locale,
-                   source_hint,
-                   owner_user_id,
-                   group_id,
-                   normalized
-            from inbox_records
-            where id = $1
-            """,
-            record_id,
-        )
+        # If-None-Match 是本记录之前的 ETag：只比较该 scope 的版本号
+        cached = _parse_record_etag(if_none_match, record_id)
+        if cached is not None:
+            is_group, scope_id, etag = cached
+            allowed = scope_id == user.user_id
+            if is_group:
+                # 不传 replica 连接：未命中时在主库查（结果会进缓存）
+                allowed = await get_membership_cache().get_role(
+                    group_id=scope_id, user_id=user.user_id
+                ) is not None
+            if allowed:
+                version = await queries.fetchval(conn, "scope_version", is_group, scope_id) or 0
+                if etag.endswith(f'.{version}"'):
+                    return _not_modified(etag)
+
+        # 详情 + 权限（个人记录本人 / group 成员）一条查询
+        row = await queries.fetchrow(conn, "record_detail", record_id, user.user_id)
+
+    if not row:
+        # replica 上没有：可能还没同步到，也可能已归档（回迁要写），回主库再查
+        async with get_pool().acquire() as conn:
+            if pool is not get_pool():
+                row = await queries.fetchrow(conn, "record_detail", record_id, user.user_id)
+            if not row and await _rehydrate(conn, record_id, user.user_id):
+                row = await queries.fetchrow(conn, "record_detail", record_id, user.user_id)
 
     if not row:
         raise HTTPException(status_code=404, detail="Not found")
+    if not row["can_read"]:
+        if row["group_id"] is not None:
+            raise HTTPException(status_code=403, detail="Not a group member")
+        raise HTTPException(status_code=403, detail="Forbidden")
 
-    owner_user_id = row["owner_user_id"]
     group_id = row["group_id"]
-
-    if group_id is not None:
-        await _assert_group_member(group_id=group_id, user_id=user.user_id)
-    else:
-        if owner_user_id != user.user_id:
-            raise HTTPException(status_code=403, detail="Forbidden")
+    response.headers["ETag"] = _record_etag(record_id, group_id, row["owner_user_id"], row["scope_version"] or 0)
 
     return CloudDetail(
         id=row["id"],
@@ -266,6 +1352,7 @@ async def get_record(
         source_hint=row["source_hint"],
         group_id=str(group_id) if group_id else None,
         normalized=row["normalized"],
+        version=row["version"],
     )
     
 @router.delete("/records/{record_id}")
@@ -278,78 +1365,22 @@ async def delete_record(
     - group record：需要是 group member
     - personal record：需要是 owner_user
     """
-    pool = get_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            select owner_user_id, group_id
-            from inbox_records
-            where id = $1
-            """,
-            record_id,
-        )
-
-        if not row:
-            raise HTTPException(status_code=404, detail="Not found")
+    async with write_conn(user.user_id) as conn:
+        # ✅ 权限判断折进 delete 的 where（与 get_record 保持一致）
+        r = await queries.execute(conn, "record_delete", record_id, user.user_id)
 
-        owner_user_id = row["owner_user_id"]
-        group_id = row["group_id"]
+        if r == "DELETE 0" and await _rehydrate(conn, record_id, user.user_id):
+            # 已归档：搬回后再删（这样会正常留下墓碑）
+            r = await queries.execute(conn, "record_delete", record_id, user.user_id)
 
-        # ✅ 权限判断（与 get_record 保持一致）
-        if group_id is not None:
-            await _assert_group_member(group_id=group_id, user_id=user.user_id)
-        else:
-            if owner_user_id != user.user_id:
-                raise HTTPException(status_code=403, detail="Forbidden")
-
-        # ✅ 执行删除
-        r = await conn.execute(
-            """
-            delete from inbox_records
-            where id = $1
-            """,
-            record_id,
-        )
+        if r == "DELETE 0":
+            # 没删到：区分 404 / 403
+            cur = await queries.fetchrow(conn, "record_access", record_id, user.user_id)
+            if not cur:
+                raise HTTPException(status_code=404, detail="Not found")
+            if cur["group_id"] is not None:
+                raise HTTPException(status_code=403, detail="Not a group member")
+            raise HTTPException(status_code=403, detail="Forbidden")
 
     # asyncpg 返回 "DELETE n"
     return {"ok": True, "result": r}
-    
-@router.get("/records/all", response_model=List[CloudListItem])
-async def list_records_all(
-    user: CurrentUser = Depends(get_current_user),
-    limit: int = Query(default=50, ge=1, le=200),
-):
-    """
-    聚合拉取：
-    - 个人记录（owner_user_id = me and group_id is null）
-    - 我所属所有 group 的记录（group_id in my memberships）
-    """
-    q = """
-    select id::text as id,
-           created_at::text as created_at,
-           title,
-           risk,
-           status,
-           due_at,
-           source_hint,
-           group_id::text as group_id
-    from inbox_records
-    where
-      (owner_user_id = $1 and group_id is null)
-      or
-      (group_id in (
-        select group_id
-        from group_memberships
-        where user_id = $1
-      ))
-    order by created_at desc
-    limit $2
-    """
-
-    pool = get_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(q, user.user_id, limit)
-
-    return [CloudListItem(**dict(r)) for r in rows]
-
-
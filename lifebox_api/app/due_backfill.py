@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from typing import Optional
+from uuid import UUID
+
+from .db import get_pool
+from . import queries
+from .task_extractor import locale_tz, resolve_due_at
+
+log = logging.getLogger(__name__)
+
+# 多个 worker 都会启动这个 job；用 advisory lock 保证同一时间只有一个在跑
+_ADVISORY_LOCK_KEY = 0x11FEB0C6
+
+DUE_BACKFILL_ENABLED = os.getenv("DUE_BACKFILL_ENABLED", "1") == "1"
+DUE_BACKFILL_INTERVAL_S = float(os.getenv("DUE_BACKFILL_INTERVAL_S", "3600"))
+DUE_BACKFILL_BATCH_SIZE = int(os.getenv("DUE_BACKFILL_BATCH_SIZE", "500"))
+
+_MIN_ID = UUID(int=0)
+
+
+async def run_once() -> int:
+    """
+    One pass over records that have due_at but no due_ts (saved before V11, or rehydrated from an
+    old archive row): resolve due_at relative to the record's created_at in its locale's timezone,
+    batch by batch (each batch is its own short transaction, keyset by id so unresolvable rows
+    are visited once per pass).
+    Returns the number of filled records; 0 if another worker holds the lock.
+    """
+    filled = 0
+    last_id = _MIN_ID
+
+    pool = get_pool()
+    async with pool.acquire() as conn:
+        if not await conn.fetchval("select pg_try_advisory_lock($1)", _ADVISORY_LOCK_KEY):
+            return 0
+        try:
+            while True:
+                rows = await queries.fetch(conn, "due_backfill_candidates", last_id, DUE_BACKFILL_BATCH_SIZE)
+                if not rows:
+                    break
+                last_id = rows[-1]["id"]
+
+                ids, due_ats, due_tss, precisions = [], [], [], []
+                for r in rows:
+                    resolved = resolve_due_at(
+                        r["due_at"],
+                        now=r["created_at"].astimezone(locale_tz(r["locale"])),
+                        locale=r["locale"],
+                    )
+                    if resolved is None:
+                        continue
+                    ids.append(r["id"])
+                    due_ats.append(r["due_at"])
+                    due_tss.append(resolved.at)
+                    precisions.append(resolved.precision)
+
+                if ids:
+                    async with conn.transaction():
+                        filled += await queries.fetchval(conn, "due_backfill_apply", ids, due_ats, due_tss, precisions)
+                if len(rows) < DUE_BACKFILL_BATCH_SIZE:
+                    break
+                await asyncio.sleep(0)
+        finally:
+            await conn.execute("select pg_advisory_unlock($1)", _ADVISORY_LOCK_KEY)
+
+    if filled:
+        log.info("due_backfill: filled due_ts for %d records", filled)
+    return filled
+
+
+async def _loop() -> None:
+    while True:
+        try:
+            await run_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("due_backfill failed")
+        await asyncio.sleep(DUE_BACKFILL_INTERVAL_S)
+
+
+_task: Optional[asyncio.Task] = None
+
+
+async def init_due_backfill() -> None:
+    global _task
+    if not DUE_BACKFILL_ENABLED or _task is not None:
+        return
+    _task = asyncio.create_task(_loop())
+
+
+async def close_due_backfill() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
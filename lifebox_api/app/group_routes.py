@@ -8,7 +8,9 @@ from uuid import UUID, uuid4
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, Field
 
-from .db import get_pool
+from .db import get_read_pool, write_conn
+from . import queries
+from .membership_cache import get_membership_cache
 from .auth_utils import CurrentUser, get_current_user
 from .schemas_groups import (
     CreateGroupRequest,
@@ -32,29 +34,16 @@ def _hash_token(token: str) -> str:
 
 
 async def _assert_group_member(conn, *, group_id: UUID, user_id: UUID) -> str:
-    row = await conn.fetchrow(
-        """
-        select role
-        from group_memberships
-        where group_id = $1 and user_id = $2
-        """,
-        group_id,
-        user_id,
-    )
-    if not row:
+    # conn 为 None 或主库连接（缓存未命中时查库，结果会进缓存，不能用 replica）
+    role = await get_membership_cache().get_role(group_id=group_id, user_id=user_id, conn=conn)
+    if role is None:
         raise HTTPException(status_code=403, detail="Not a group member")
-    return row["role"]
+    return role
 
 
 async def _assert_group_owner(conn, *, group_id: UUID, user_id: UUID) -> None:
-    row = await conn.fetchrow(
-        """
-        select owner_user_id
-        from groups
-        where id = $1
-        """,
-        group_id,
-    )
+    # owner 专属操作（改名 / 删 group / 转让 / 踢人）少且不可逆：不信缓存，每次查库
+    row = await queries.fetchrow(conn, "group_owner", group_id)
     if not row:
         raise HTTPException(status_code=404, detail="Group not found")
 
@@ -63,14 +52,7 @@ async def _assert_group_owner(conn, *, group_id: UUID, user_id: UUID) -> None:
 
 
 async def _get_group_row(conn, *, group_id: UUID):
-    g = await conn.fetchrow(
-        """
-        select id::text as id, name, group_type, owner_user_id::text as owner_user_id
-        from groups
-        where id = $1
-        """,
-        group_id,
-    )
+    g = await queries.fetchrow(conn, "group_row", group_id)
     if not g:
         raise HTTPException(status_code=404, detail="Group not found")
     return g
@@ -100,8 +82,7 @@ async def create_group(
     user: CurrentUser = Depends(get_current_user),
 ):
     gid = uuid4()
-    pool = get_pool()
-    async with pool.acquire() as conn:
+    async with write_conn(user.user_id) as conn:
         async with conn.transaction():
             await conn.execute(
                 """
@@ -133,47 +114,20 @@ async def create_group(
 
 @router.get("/groups", response_model=list[GroupOut])
 async def list_groups(user: CurrentUser = Depends(get_current_user)):
-    pool = get_pool()
+    pool = get_read_pool(user.user_id)
     async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            """
-            select g.id::text as id, g.name, g.group_type, g.owner_user_id::text as owner_user_id
-            from group_memberships gm
-            join groups g on g.id = gm.group_id
-            where gm.user_id = $1
-            order by g.created_at desc
-            """,
-            user.user_id,
-        )
+        rows = await queries.fetch(conn, "user_groups", user.user_id)
     return [GroupOut(**dict(r)) for r in rows]
 
 
 @router.get("/groups/{group_id}", response_model=GroupDetail)
 async def group_detail(group_id: UUID, user: CurrentUser = Depends(get_current_user)):
-    pool = get_pool()
-    async with pool.acquire() as conn:
-        await _assert_group_member(conn, group_id=group_id, user_id=user.user_id)
-
-        g = await conn.fetchrow(
-            """
-            select id::text as id, name, group_type, owner_user_id::text as owner_user_id
-            from groups
-            where id = $1
-            """,
-            group_id,
-        )
-        if not g:
-            raise HTTPException(status_code=404, detail="Group not found")
+    await _assert_group_member(None, group_id=group_id, user_id=user.user_id)
 
-        members = await conn.fetch(
-            """
-            select user_id::text as user_id, role
-            from group_memberships
-            where group_id = $1
-            order by joined_at asc
-            """,
-            group_id,
-        )
+    pool = get_read_pool(user.user_id)
+    async with pool.acquire() as conn:
+        g = await _get_group_row(conn, group_id=group_id)
+        members = await queries.fetch(conn, "group_members", group_id)
 
     return GroupDetail(
         id=g["id"],
@@ -195,8 +149,7 @@ async def create_invite(
     expires_at = datetime.now(timezone.utc) + timedelta(hours=req.expires_hours)
     invite_id = uuid4()
 
-    pool = get_pool()
-    async with pool.acquire() as conn:
+    async with write_conn(user.user_id) as conn:
         role = await _assert_group_member(conn, group_id=group_id, user_id=user.user_id)
         if role not in ("owner", "admin"):
             raise HTTPException(status_code=403, detail="Insufficient role")
@@ -222,8 +175,7 @@ async def create_invite(
 async def accept_invite(req: AcceptInviteRequest, user: CurrentUser = Depends(get_current_user)):
     token_hash = _hash_token(req.token)
     now = datetime.now(timezone.utc)
-    pool = get_pool()
-    async with pool.acquire() as conn:
+    async with write_conn(user.user_id) as conn:
         async with conn.transaction():
             inv = await conn.fetchrow(
                 """
@@ -254,6 +206,7 @@ async def accept_invite(req: AcceptInviteRequest, user: CurrentUser = Depends(ge
                 group_id,
                 user.user_id,
             )
+            await get_membership_cache().notify(conn, group_id=group_id, user_id=user.user_id)
 
             await conn.execute(
                 """
@@ -284,8 +237,7 @@ async def patch_group(
     - 你 UI 里是 owner 才能改：这里也按 owner-only
     - 如果你想 owner/admin 都能改，把 _assert_group_owner 换成 role check 即可
     """
-    pool = get_pool()
-    async with pool.acquire() as conn:
+    async with write_conn(user.user_id) as conn:
         await _assert_group_owner(conn, group_id=group_id, user_id=user.user_id)
 
         await conn.execute(
@@ -309,17 +261,18 @@ async def delete_group(group_id: UUID, user: CurrentUser = Depends(get_current_u
     删除 group（仅 owner）
     - groups ON DELETE CASCADE 会把 memberships、invites 都删掉（你表里 memberships / invites 都引用 groups 并 cascade）
     """
-    pool = get_pool()
-    async with pool.acquire() as conn:
+    async with write_conn(user.user_id) as conn:
         await _assert_group_owner(conn, group_id=group_id, user_id=user.user_id)
 
-        r = await conn.execute(
-            """
-            delete from groups
-            where id = $1
-            """,
-            group_id,
-        )
+        async with conn.transaction():
+            r = await conn.execute(
+                """
+                delete from groups
+                where id = $1
+                """,
+                group_id,
+            )
+            await get_membership_cache().notify(conn, group_id=group_id)
 
     # asyncpg execute 返回 "DELETE n"
     return {"ok": True, "result": r}
@@ -335,15 +288,11 @@ async def remove_member(
     移除成员（仅 owner）
     - 禁止移除 owner（必须先 transfer_owner）
     """
-    pool = get_pool()
-    async with pool.acquire() as conn:
+    async with write_conn(user.user_id) as conn:
         async with conn.transaction():
             await _assert_group_owner(conn, group_id=group_id, user_id=user.user_id)
 
-            g = await conn.fetchrow(
-                "select owner_user_id from groups where id = $1",
-                group_id,
-            )
+            g = await queries.fetchrow(conn, "group_owner", group_id)
             if not g:
                 raise HTTPException(status_code=404, detail="Group not found")
 
@@ -369,6 +318,7 @@ async def remove_member(
                 group_id,
                 member_user_id,
             )
+            await get_membership_cache().notify(conn, group_id=group_id, user_id=member_user_id)
 
     return {"ok": True}
 
@@ -385,8 +335,7 @@ async def transfer_owner(
     - 更新 groups.owner_user_id
     - 同步 memberships：new_owner.role=owner；old_owner.role=member
     """
-    pool = get_pool()
-    async with pool.acquire() as conn:
+    async with write_conn(user.user_id) as conn:
         async with conn.transaction():
             await _assert_group_owner(conn, group_id=group_id, user_id=user.user_id)
 
@@ -436,6 +385,8 @@ async def transfer_owner(
                 group_id,
                 user.user_id,
             )
+            await get_membership_cache().notify(conn, group_id=group_id, user_id=req.new_owner_user_id)
+            await get_membership_cache().notify(conn, group_id=group_id, user_id=user.user_id)
 
             g = await _get_group_row(conn, group_id=group_id)
 
@@ -457,15 +408,11 @@ async def patch_member_role(
     if req.role == "owner":
         raise HTTPException(status_code=400, detail="Use transfer-owner to set owner role")
 
-    pool = get_pool()
-    async with pool.acquire() as conn:
+    async with write_conn(user.user_id) as conn:
         async with conn.transaction():
             await _assert_group_owner(conn, group_id=group_id, user_id=user.user_id)
 
-            g = await conn.fetchrow(
-                "select owner_user_id from groups where id = $1",
-                group_id,
-            )
+            g = await queries.fetchrow(conn, "group_owner", group_id)
             if not g:
                 raise HTTPException(status_code=404, detail="Group not found")
 
@@ -493,5 +440,6 @@ async def patch_member_role(
                 member_user_id,
                 req.role,
             )
+            await get_membership_cache().notify(conn, group_id=group_id, user_id=member_user_id)
 
     return {"ok": True}
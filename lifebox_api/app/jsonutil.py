@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+# orjson 是可选依赖：装了就用（序列化快数倍），没装退回标准库 json
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    Default response class: orjson when available.
+    Endpoints on hot read paths return this directly with plain dicts,
+    skipping the response_model validation + re-serialization pass.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from .db import get_pool
+from . import queries
+
+log = logging.getLogger(__name__)
+
+# 每次 Ollama 调用的 token / 耗时先攒在内存里，后台定时一次 COPY 进 ollama_calls（V22），不占请求路径
+TELEMETRY_ENABLED = os.getenv("OLLAMA_TELEMETRY", "1") == "1"
+FLUSH_INTERVAL_S = float(os.getenv("OLLAMA_TELEMETRY_FLUSH_S", "5"))
+BATCH_SIZE = int(os.getenv("OLLAMA_TELEMETRY_BATCH_SIZE", "500"))
+# DB 写不进去时最多攒这么多，超出丢最旧的
+MAX_BUFFER = int(os.getenv("OLLAMA_TELEMETRY_MAX_BUFFER", "10000"))
+RETENTION_DAYS = int(os.getenv("OLLAMA_TELEMETRY_RETENTION_DAYS", "30"))
+# load_duration 超过该值视为冷加载（模型从磁盘载入）
+COLD_LOAD_MS = float(os.getenv("OLLAMA_COLD_LOAD_MS", "1000"))
+
+_COLUMNS = (
+    "created_at",
+    "model",
+    "locale",
+    "mode",
+    "stream",
+    "input_chars",
+    "num_ctx",
+    "prompt_eval_count",
+    "eval_count",
+    "load_duration_ns",
+    "prompt_eval_duration_ns",
+    "eval_duration_ns",
+    "total_duration_ns",
+    "prompt_tokens_est",
+    "num_predict",
+)
+
+_buffer: List[Tuple[Any, ...]] = []
+# 后台 flush 和 summary() 里的 flush 不能同时拿同一批
+_flush_lock = asyncio.Lock()
+
+
+def record(
+    stats: Dict[str, Any],
+    *,
+    model: str,
+    locale: Optional[str],
+    mode: Optional[str],
+    stream: bool,
+    input_chars: int,
+) -> None:
+    """ollama_chat / ollama_chat_stream 的 on_stats 回调里调用（同步，只追加到 buffer）"""
+    if not TELEMETRY_ENABLED:
+        return
+    _buffer.append((
+        datetime.now(timezone.utc),
+        model,
+        locale,
+        mode,
+        stream,
+        input_chars,
+        stats.get("num_ctx"),
+        stats.get("prompt_eval_count"),
+        stats.get("eval_count"),
+        stats.get("load_duration"),
+        stats.get("prompt_eval_duration"),
+        stats.get("eval_duration"),
+        stats.get("total_duration"),
+        stats.get("prompt_tokens_est"),
+        stats.get("num_predict"),
+    ))
+    if len(_buffer) > MAX_BUFFER:
+        del _buffer[: len(_buffer) - MAX_BUFFER]
+
+
+async def flush() -> int:
+    """Write buffered rows; on failure they stay in the buffer for the next round."""
+    n = 0
+    async with _flush_lock:
+        while _buffer:
+            # 先从 buffer 取走：COPY 期间新追加 / 超限裁掉的行不会和这一批错位
+            batch = _buffer[:BATCH_SIZE]
+            del _buffer[: len(batch)]
+            try:
+                pool = get_pool()
+                async with pool.acquire() as conn:
+                    async with queries.timed("ollama_calls_copy"):
+                        await conn.copy_records_to_table("ollama_calls", records=batch, columns=list(_COLUMNS))
+            except BaseException:
+                _buffer[:0] = batch
+                raise
+            n += len(batch)
+    return n
+
+
+async def _loop() -> None:
+    last_prune = 0.0
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL_S)
+        try:
+            await flush()
+            if time.monotonic() - last_prune >= 3600:
+                async with get_pool().acquire() as conn:
+                    await queries.execute(conn, "ollama_calls_prune", RETENTION_DAYS)
+                last_prune = time.monotonic()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("llm_telemetry flush failed")
+
+
+async def summary(*, hours: int) -> List[Dict[str, Any]]:
+    """Per-model aggregates over the last `hours` (unflushed calls are included first)."""
+    try:
+        await flush()
+    except Exception:
+        log.exception("llm_telemetry flush failed")
+    pool = get_pool()
+    async with pool.acquire() as conn:
+        rows = await queries.fetch(conn, "ollama_calls_summary", hours, COLD_LOAD_MS)
+    return [dict(r) for r in rows]
+
+
+_task: Optional[asyncio.Task] = None
+
+
+async def init_llm_telemetry() -> None:
+    global _task
+    if not TELEMETRY_ENABLED or _task is not None:
+        return
+    _task = asyncio.create_task(_loop())
+
+
+async def close_llm_telemetry() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    try:
+        await flush()
+    except Exception:
+        log.exception("llm_telemetry final flush failed")
@@ -8,15 +8,38 @@ env = os.getenv("ENV", "dev")
 load_dotenv(f".env.{env}")
 
 
-from fastapi import FastAPI
-from pydantic import BaseModel
-from typing import Optional
+import asyncio
+import json
+import time
 
-from .ollama_client import ollama_chat
-from .task_extractor import SYSTEM_PROMPT, build_user_prompt, normalize_to_schema
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+from starlette.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Literal, Optional
+
+from .ollama_client import ollama_chat, ollama_chat_stream, init_ollama, close_ollama
+from .task_extractor import (
+    SYSTEM_PROMPT,
+    build_user_prompt,
+    normalize_to_schema,
+    analyze_heuristic,
+    quick_fields,
+    extract_partial_fields,
+)
+from .analyze_cache import cache_key, get_analyze_cache, init_analyze_cache, close_analyze_cache
+
+from .jsonutil import FastJSONResponse
 
 # DB Pool
-from .db import init_db, close_db
+from .db import init_db, close_db, init_listener, close_listener
+from .queries import query_stats
+from . import metrics
+from .membership_cache import init_membership_cache, close_membership_cache, get_membership_cache
+from .record_events import init_record_events, close_record_events
+from .archive_job import init_archive_job, close_archive_job
+from .due_backfill import init_due_backfill, close_due_backfill
+from . import llm_telemetry
 
 # routers
 from .auth_routes import router as auth_router
@@ -25,18 +48,121 @@ from .cloud_routes import router as cloud_router
 from .billing_routes import router as billing_router
 from .legal_routes import router as legal_router
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
+
+# -----------------------------
+# Compression (br if brotli-asgi is installed, else gzip)
+# -----------------------------
+# 流式接口（SSE / NDJSON）不压缩：压缩器会攒数据，客户端就收不到逐条推送了
+COMPRESS_MIN_BYTES = int(os.getenv("HTTP_COMPRESS_MIN_BYTES", "1024"))
+UNCOMPRESSED_PATHS = {"/api/ai/analyze/stream", "/api/ai/analyze/batch", "/api/cloud/stream"}
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # pragma: no cover
+    BrotliMiddleware = None
+
+
+class _CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        if BrotliMiddleware is not None:
+            self.compressed = BrotliMiddleware(app, minimum_size=minimum_size, gzip_fallback=True)
+        else:
+            self.compressed = GZipMiddleware(app, minimum_size=minimum_size)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] not in UNCOMPRESSED_PATHS:
+            await self.compressed(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+app.add_middleware(_CompressionMiddleware, minimum_size=COMPRESS_MIN_BYTES)
+
 
 # -----------------------------
-# App lifecycle: init/close DB
+# Metrics (Prometheus text format at GET /metrics, no external collector needed)
+# -----------------------------
+class _MetricsMiddleware:
+    """
+    Per-route latency histogram, measured until response headers are sent
+    (SSE / NDJSON streams would otherwise count their whole lifetime).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        t0 = time.perf_counter()
+        observed = False
+
+        def _observe(status: int) -> None:
+            nonlocal observed
+            if observed:
+                return
+            observed = True
+            route = metrics.route_label(scope) or "<unmatched>"
+            metrics.http_request_seconds.observe(time.perf_counter() - t0, scope["method"], route, str(status))
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                _observe(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        except Exception:
+            _observe(500)
+            raise
+
+
+# 最后添加 = 最外层：计时包含压缩
+app.add_middleware(_MetricsMiddleware)
+
+
+@metrics.REGISTRY.collector
+def _cache_metrics():
+    caches = {
+        "analyze": get_analyze_cache().stats(),
+        "membership": get_membership_cache().stats(),
+    }
+    hits = {name: st["hits"] + st.get("pg_hits", 0) for name, st in caches.items()}
+    yield ("lifebox_cache_hits_total", "counter", "Cache hits (analyze: L1 + L2).", [({"cache": n}, v) for n, v in hits.items()])
+    yield ("lifebox_cache_misses_total", "counter", "Cache misses.", [({"cache": n}, st["misses"]) for n, st in caches.items()])
+    yield ("lifebox_cache_hit_ratio", "gauge", "Hits / lookups since start.", [({"cache": n}, st["hit_ratio"]) for n, st in caches.items()])
+    yield ("lifebox_cache_items", "gauge", "Entries held in process.", [({"cache": n}, st["size"]) for n, st in caches.items()])
+
+# -----------------------------
+# App lifecycle: init/close DB + LISTEN connection + membership cache / record events + Ollama client
 # -----------------------------
 @app.on_event("startup")
 async def _startup():
     await init_db()
+    await init_listener()
+    await init_membership_cache()
+    await init_record_events()
+    await init_ollama()
+    await llm_telemetry.init_llm_telemetry()
+    await init_archive_job()
+    await init_due_backfill()
+    await init_analyze_cache()
 
 
 @app.on_event("shutdown")
 async def _shutdown():
+    await close_analyze_cache()
+    await close_due_backfill()
+    await close_archive_job()
+    await llm_telemetry.close_llm_telemetry()
+    await close_ollama()
+    await close_record_events()
+    await close_membership_cache()
+    await close_listener()
     await close_db()
 
 # -----------------------------
@@ -49,12 +175,29 @@ app.include_router(billing_router)
 app.include_router(cloud_router)
 app.include_router(legal_router)
 
+# llm: 总是调用模型 / fast: 只用正则+关键词 / hybrid: 启发式置信度不够时才调用模型
+AnalyzeMode = Literal["llm", "hybrid", "fast"]
+
+HYBRID_MIN_CONFIDENCE = float(os.getenv("ANALYZE_HYBRID_MIN_CONFIDENCE", "0.8"))
+
+
 class AnalyzeRequest(BaseModel):
     text: str
     locale: str = "ja-JP"
     source_hint: Optional[str] = None
     now: Optional[str] = None
     model: str = "qwen2.5:3b-instruct"
+    mode: AnalyzeMode = "llm"
+
+
+# 批量分析：单次最多条数 / 服务端并发上限（请求里的 concurrency 不能超过它）
+BATCH_MAX_ITEMS = int(os.getenv("ANALYZE_BATCH_MAX_ITEMS", "100"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("ANALYZE_BATCH_MAX_CONCURRENCY", "8"))
+
+
+class AnalyzeBatchRequest(BaseModel):
+    items: List[AnalyzeRequest] = Field(..., min_length=1)
+    concurrency: int = Field(default=4, ge=1)
 
 
 @app.get("/health")
@@ -62,8 +205,70 @@ async def health():
     return {"ok": True}
 
 
-@app.post("/api/ai/analyze")
-async def analyze(req: AnalyzeRequest):
+@app.get("/api/ai/cache/stats")
+async def analyze_cache_stats():
+    return get_analyze_cache().stats()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/api/ai/telemetry")
+async def analyze_telemetry(hours: int = Query(default=24, ge=1, le=24 * 30)):
+    """
+    Ollama 调用统计（按 model）：
+    - prompt_tokens_per_s / eval_tokens_per_s：prompt 处理 / 生成速度
+    - avg_prompt_eval_ms / avg_eval_ms / prompt_time_share：时间花在 prompt 还是生成
+    - cold_load_ratio：load_duration >= OLLAMA_COLD_LOAD_MS 的比例（模型被换出后重新加载）
+    - ctx_full_ratio：估算的 prompt token（system + user，与前缀缓存无关）+ num_predict 超过 num_ctx 的比例（输入可能被截断）
+    """
+    return {"hours": hours, "models": await llm_telemetry.summary(hours=hours)}
+
+
+@app.get("/api/db/query-stats")
+async def db_query_stats():
+    # 按 total_ms 降序：排在前面的就是最吃 DB 时间的查询
+    return query_stats.snapshot()
+
+
+def _try_heuristic(req: AnalyzeRequest) -> Optional[Dict[str, Any]]:
+    """
+    fast 模式总是返回启发式结果；hybrid 模式只有置信度达标才返回，否则 None（走 LLM）。
+    """
+    if req.mode == "llm":
+        return None
+    result = analyze_heuristic(input_text=req.text, source_hint=req.source_hint, locale=req.locale)
+    if req.mode == "fast" or result["confidence"] >= HYBRID_MIN_CONFIDENCE:
+        return result
+    return None
+
+
+def _telemetry(req: AnalyzeRequest, *, stream: bool):
+    def _on_stats(stats: Dict[str, Any]) -> None:
+        llm_telemetry.record(
+            stats,
+            model=req.model,
+            locale=req.locale,
+            mode=req.mode,
+            stream=stream,
+            input_chars=len(req.text),
+        )
+    return _on_stats
+
+
+async def _analyze_one(req: AnalyzeRequest) -> Dict[str, Any]:
+    heuristic = _try_heuristic(req)
+    if heuristic is not None:
+        return heuristic
+
+    cache = get_analyze_cache()
+    key = cache_key(text=req.text, locale=req.locale, source_hint=req.source_hint, model=req.model)
+    cached = await cache.get(key)
+    if cached is not None:
+        return cached
+
     user_prompt = build_user_prompt(
         text=req.text,
         locale=req.locale,
@@ -75,6 +280,7 @@ async def analyze(req: AnalyzeRequest):
         model=req.model,
         system=SYSTEM_PROMPT,
         user=user_prompt,
+        on_stats=_telemetry(req, stream=False),
     )
 
     result = normalize_to_schema(
@@ -83,4 +289,114 @@ async def analyze(req: AnalyzeRequest):
         source_hint=req.source_hint,
         locale=req.locale,
     )
+    await cache.put(key, result)
     return result
+
+
+@app.post("/api/ai/analyze")
+async def analyze(req: AnalyzeRequest):
+    return await _analyze_one(req)
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/ai/analyze/stream")
+async def analyze_stream(req: AnalyzeRequest):
+    """
+    SSE 版 analyze（Ollama stream=true）
+    - event: quick   正则能立刻算出的字段（due_at / amount / currency / phones / urls）
+    - event: field   LLM 生成中的 title / risk / notes，一旦可解析就推送
+    - event: result  最终结果（与 /api/ai/analyze 相同）
+    - event: error   失败
+    """
+    cache = get_analyze_cache()
+    key = cache_key(text=req.text, locale=req.locale, source_hint=req.source_hint, model=req.model)
+
+    async def _stream():
+        yield _sse("quick", quick_fields(req.text))
+
+        heuristic = _try_heuristic(req)
+        if heuristic is not None:
+            yield _sse("result", heuristic)
+            return
+
+        cached = await cache.get(key)
+        if cached is not None:
+            yield _sse("result", cached)
+            return
+
+        user_prompt = build_user_prompt(
+            text=req.text,
+            locale=req.locale,
+            source_hint=req.source_hint,
+            now=req.now,
+        )
+
+        buf = ""
+        sent: Dict[str, str] = {}
+        try:
+            async for delta in ollama_chat_stream(
+                model=req.model,
+                system=SYSTEM_PROMPT,
+                user=user_prompt,
+                on_stats=_telemetry(req, stream=True),
+            ):
+                buf += delta
+                for k, v in extract_partial_fields(buf).items():
+                    if k not in sent:
+                        sent[k] = v
+                        yield _sse("field", {k: v})
+        except Exception as e:
+            yield _sse("error", {"error": str(e)})
+            return
+
+        result = normalize_to_schema(
+            model_output_text=buf,
+            input_text=req.text,
+            source_hint=req.source_hint,
+            locale=req.locale,
+        )
+        await cache.put(key, result)
+        yield _sse("result", result)
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/api/ai/analyze/batch")
+async def analyze_batch(req: AnalyzeBatchRequest):
+    """
+    批量分析（NDJSON 流式返回）
+    - 每条完成后立刻输出一行：{"index": i, "ok": true, "result": {...}}
+    - 单条失败不影响其它条：{"index": i, "ok": false, "error": "..."}
+    - 输出顺序 = 完成顺序，前台用 index 对应回原请求
+    """
+    if len(req.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Too many items (max {BATCH_MAX_ITEMS})")
+
+    sem = asyncio.Semaphore(min(req.concurrency, BATCH_MAX_CONCURRENCY))
+
+    async def _run(i: int, item: AnalyzeRequest) -> Dict[str, Any]:
+        async with sem:
+            try:
+                return {"index": i, "ok": True, "result": await _analyze_one(item)}
+            except Exception as e:
+                return {"index": i, "ok": False, "error": str(e)}
+
+    async def _stream():
+        tasks = [asyncio.create_task(_run(i, item)) for i, item in enumerate(req.items)]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                line = await fut
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+        finally:
+            # 客户端中途断开时，取消还没跑完的
+            for t in tasks:
+                t.cancel()
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
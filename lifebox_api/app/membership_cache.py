@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from uuid import UUID
+
+from .db import get_listener, get_pool
+from . import queries
+
+log = logging.getLogger(__name__)
+
+# group_routes 里改 membership / role 的地方会 pg_notify 这个 channel，各 worker 收到后清掉本地缓存
+NOTIFY_CHANNEL = "group_membership_changed"
+
+
+class MembershipCache:
+    """
+    (user_id, group_id) -> role 的进程内 TTL 缓存
+    - 只缓存“是成员”的结果；非成员每次都查库（刚接受邀请的人不会被旧结果挡住）
+    - 写入方在同一事务里 notify，提交后所有 worker（包括自己）都会收到并失效
+    - LISTEN 连接（db.PgListener，与其它 channel 共用）断开期间收不到失效通知：断开时清空、断开期间不写缓存，
+      重连后再清一次（断开期间别的 worker 改的 role 不会残留）
+    """
+
+    def __init__(self, *, max_items: int = 10000, ttl_s: float = 60.0):
+        self.max_items = max_items
+        self.ttl_s = ttl_s
+        self._roles: "OrderedDict[Tuple[UUID, UUID], Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._listening = True
+
+    # ---------- lookup ----------
+    def peek_role(self, user_id: UUID, group_id: UUID) -> Optional[str]:
+        key = (user_id, group_id)
+        item = self._roles.get(key)
+        if item is None:
+            return None
+        expires_at, role = item
+        if expires_at <= time.monotonic():
+            self._roles.pop(key, None)
+            return None
+        self._roles.move_to_end(key)
+        return role
+
+    def _put_local(self, user_id: UUID, group_id: UUID, role: str) -> None:
+        key = (user_id, group_id)
+        self._roles[key] = (time.monotonic() + self.ttl_s, role)
+        self._roles.move_to_end(key)
+        while len(self._roles) > self.max_items:
+            self._roles.popitem(last=False)
+
+    async def get_role(self, *, group_id: UUID, user_id: UUID, conn=None) -> Optional[str]:
+        """
+        Returns the member's role, or None if not a member.
+        `conn`: reuse the caller's connection on a miss instead of acquiring another one. Must be a
+        primary connection: a lagging replica could put a just-revoked role back into the cache.
+        """
+        role = self.peek_role(user_id, group_id)
+        if role is not None:
+            self.hits += 1
+            return role
+
+        self.misses += 1
+        if conn is not None:
+            role = await queries.fetchval(conn, "membership_role", group_id, user_id)
+        else:
+            async with get_pool().acquire() as c:
+                role = await queries.fetchval(c, "membership_role", group_id, user_id)
+
+        if role is not None and self._listening:
+            self._put_local(user_id, group_id, role)
+        return role
+
+    # ---------- invalidation ----------
+    def invalidate_local(self, *, group_id: UUID, user_id: Optional[UUID] = None) -> None:
+        if user_id is not None:
+            self._roles.pop((user_id, group_id), None)
+            return
+        for key in [k for k in self._roles if k[1] == group_id]:
+            self._roles.pop(key, None)
+
+    async def notify(self, conn, *, group_id: UUID, user_id: Optional[UUID] = None) -> None:
+        """
+        Call inside the transaction that changes group_memberships / groups.
+        Drops the local entry now; pg_notify is delivered to every worker on commit.
+        """
+        self.invalidate_local(group_id=group_id, user_id=user_id)
+        payload = str(group_id) if user_id is None else f"{group_id}:{user_id}"
+        await conn.execute("select pg_notify($1, $2)", NOTIFY_CHANNEL, payload)
+
+    def _on_notify(self, channel: str, payload: str) -> None:
+        try:
+            gid, _, uid = payload.partition(":")
+            self.invalidate_local(group_id=UUID(gid), user_id=UUID(uid) if uid else None)
+        except ValueError:
+            log.warning("membership_cache: bad notify payload %r", payload)
+
+    def _on_listen_lost(self) -> None:
+        log.warning("membership_cache: LISTEN connection lost, clearing cache")
+        self._listening = False
+        self._roles.clear()
+
+    def _on_listen_restored(self) -> None:
+        self._roles.clear()
+        self._listening = True
+
+    def clear(self) -> None:
+        self._roles.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+            "size": len(self._roles),
+        }
+
+
+_cache: Optional[MembershipCache] = None
+
+
+def get_membership_cache() -> MembershipCache:
+    global _cache
+    if _cache is None:
+        _cache = MembershipCache(
+            max_items=int(os.getenv("MEMBERSHIP_CACHE_MAX_ITEMS", "10000")),
+            ttl_s=float(os.getenv("MEMBERSHIP_CACHE_TTL_S", "60")),
+        )
+    return _cache
+
+
+async def init_membership_cache() -> None:
+    cache = get_membership_cache()
+    listener = get_listener()
+    listener.on_lost(cache._on_listen_lost)
+    listener.on_restored(cache._on_listen_restored)
+    await listener.listen(NOTIFY_CHANNEL, cache._on_notify)
+
+
+async def close_membership_cache() -> None:
+    if _cache is not None:
+        _cache.clear()
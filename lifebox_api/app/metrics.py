@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import bisect
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# =============================
+# Prometheus text exposition, in-process
+# =============================
+# 不依赖 prometheus_client：计数器 / 直方图都在本进程内累计，GET /metrics 直接输出文本格式（0.0.4）。
+# 多 worker 时每个 worker 各自一份（按实例抓取即可）。
+# 池大小、缓存命中等“现成状态”不重复记账，用 collector 在输出时现取。
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelKey = Tuple[str, ...]
+
+# 默认延迟桶（秒）：覆盖从 ~1ms 的 SQL 到 ~20s 的 LLM 调用
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, *labelvalues: str, value: float = 1.0) -> None:
+        self._values[labelvalues] = self._values.get(labelvalues, 0.0) + value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, v in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_num(v)}"
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        s = self._values.get(labelvalues)
+        if s is None:
+            s = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+        s[bisect.bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, s in sorted(self._values.items()):
+            cumulative = 0
+            for i, upper in enumerate(self.buckets + (float("inf"),)):
+                cumulative += s[i]
+                le = 'le="' + _num(upper) + '"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_num(s[-1])}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+
+
+# collector：输出时调用，返回 (name, type, help, [(labels dict, value), ...])
+Sample = Tuple[Dict[str, str], float]
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[object] = []
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        m = Counter(name, help, labelnames)
+        self._metrics.append(m)
+        return m
+
+    def histogram(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        m = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(m)
+        return m
+
+    def collector(self, fn: Collector) -> Collector:
+        """Register a callback that reports current state (gauges / counters kept elsewhere)."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.extend(m.render())  # type: ignore[attr-defined]
+        for fn in self._collectors:
+            for name, kind, help, samples in fn():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_num(value)}")
+        lines.append("")
+        return "\n".join(lines)
+
+
+REGISTRY = Registry()
+
+
+# =============================
+# Shared metrics
+# =============================
+http_request_seconds = REGISTRY.histogram(
+    "lifebox_http_request_duration_seconds",
+    "Time until response headers are sent, by route template.",
+    ("method", "route", "status"),
+)
+
+db_pool_acquire_seconds = REGISTRY.histogram(
+    "lifebox_db_pool_acquire_seconds",
+    "Time spent waiting for a pooled DB connection.",
+    ("pool",),
+)
+
+ollama_request_seconds = REGISTRY.histogram(
+    "lifebox_ollama_request_duration_seconds",
+    "Ollama call latency per backend (streams: until the last chunk).",
+    ("backend", "endpoint", "outcome"),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 12.0, 20.0, 30.0, 60.0),
+)
+
+ollama_errors = REGISTRY.counter(
+    "lifebox_ollama_errors_total",
+    "Failed Ollama attempts per backend (transport = unreachable / timeout).",
+    ("backend", "kind"),
+)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+def route_label(scope: Dict[str, object]) -> Optional[str]:
+    """Route template ("/api/cloud/records/{record_id}") so ids don't explode label cardinality."""
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    return path if isinstance(path, str) else None
@@ -1,29 +1,297 @@
 from __future__ import annotations
 
+import json
+import os
+import time
 import httpx
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from . import metrics
 
 
 class OllamaError(RuntimeError):
     pass
 
 
-async def ollama_chat(
-    *,
-    base_url: str = "http://localhost:11434",
-    model: str = "qwen2.5:3b-instruct",
-    system: str,
-    user: str,
-    timeout_s: float = 20.0,
-) -> str:
+class _Backend:
     """
-    Calls Ollama /api/chat and returns assistant content as string.
-    Raises OllamaError on non-2xx.
+    One Ollama base URL + its live load / health state.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.in_flight = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def healthy(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+
+class OllamaPool:
+    """
+    Long-lived httpx client (keep-alive pooled) shared by all analyze calls.
+    - 请求发给 in_flight 最少的 healthy backend
+    - 连接失败 / 5xx 的 backend 会被暂时摘除（指数退避），成功一次即恢复
+    """
+
+    def __init__(
+        self,
+        base_urls: List[str],
+        *,
+        timeout_s: float = 20.0,
+        connect_timeout_s: float = 3.0,
+        max_connections: int = 32,
+        max_keepalive: int = 16,
+        eject_base_s: float = 5.0,
+        eject_max_s: float = 60.0,
+    ):
+        if not base_urls:
+            raise ValueError("OllamaPool needs at least one base url")
+        self.backends = [_Backend(u) for u in base_urls]
+        self.eject_base_s = eject_base_s
+        self.eject_max_s = eject_max_s
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout_s, connect=connect_timeout_s),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=60.0,
+            ),
+        )
+
+    def _pick(self, exclude: List[_Backend]) -> Optional[_Backend]:
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b not in exclude]
+        if not candidates:
+            return None
+        healthy = [b for b in candidates if b.healthy(now)]
+        if healthy:
+            return min(healthy, key=lambda b: b.in_flight)
+        # 全部被摘除时：选最早恢复的那个试一下，总比直接失败好
+        return min(candidates, key=lambda b: b.ejected_until)
+
+    def _mark_ok(self, b: _Backend) -> None:
+        b.failures = 0
+        b.ejected_until = 0.0
+
+    def _mark_failed(self, b: _Backend) -> None:
+        b.failures += 1
+        backoff = min(self.eject_base_s * (2 ** (b.failures - 1)), self.eject_max_s)
+        b.ejected_until = time.monotonic() + backoff
+
+    def _observe(self, b: _Backend, path: str, t0: float, error: Optional[str]) -> None:
+        metrics.ollama_request_seconds.observe(
+            time.perf_counter() - t0, b.base_url, path, "error" if error else "ok"
+        )
+        if error:
+            metrics.ollama_errors.inc(b.base_url, error)
+
+    async def post_json(self, path: str, payload: Dict[str, Any], *, timeout_s: Optional[float] = None) -> Dict[str, Any]:
+        """
+        POST to the least-loaded healthy backend; on transport error / 5xx,
+        eject it and retry once on each remaining backend.
+        Raises OllamaError when every backend failed or on non-retryable 4xx.
+        """
+        tried: List[_Backend] = []
+        last_err: Optional[str] = None
+        timeout = httpx.Timeout(timeout_s, connect=3.0) if timeout_s is not None else None
+
+        while True:
+            b = self._pick(tried)
+            if b is None:
+                raise OllamaError(last_err or "No Ollama backend available")
+            tried.append(b)
+
+            b.in_flight += 1
+            t0 = time.perf_counter()
+            try:
+                kwargs: Dict[str, Any] = {"json": payload}
+                if timeout is not None:
+                    kwargs["timeout"] = timeout
+                r = await self.client.post(f"{b.base_url}{path}", **kwargs)
+            except httpx.TransportError as e:
+                self._observe(b, path, t0, "transport")
+                self._mark_failed(b)
+                last_err = f"Ollama {b.base_url} unreachable: {e!r}"
+                continue
+            finally:
+                b.in_flight -= 1
+
+            if r.status_code // 100 == 5:
+                self._observe(b, path, t0, "http_5xx")
+                self._mark_failed(b)
+                last_err = f"Ollama HTTP {r.status_code}: {r.text[:500]}"
+                continue
+            if r.status_code // 100 != 2:
+                self._observe(b, path, t0, "http_4xx")
+                raise OllamaError(f"Ollama HTTP {r.status_code}: {r.text[:500]}")
+
+            self._observe(b, path, t0, None)
+            self._mark_ok(b)
+            return r.json()
+
+    async def stream_json(self, path: str, payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        POST and yield each NDJSON line of the response as a dict.
+        Failover to another backend only happens before the first line is received;
+        once streaming has started, errors are raised as OllamaError.
+        """
+        tried: List[_Backend] = []
+        last_err: Optional[str] = None
+
+        while True:
+            b = self._pick(tried)
+            if b is None:
+                raise OllamaError(last_err or "No Ollama backend available")
+            tried.append(b)
+
+            b.in_flight += 1
+            started = False
+            t0 = time.perf_counter()
+            try:
+                async with self.client.stream("POST", f"{b.base_url}{path}", json=payload) as r:
+                    if r.status_code // 100 != 2:
+                        body = (await r.aread()).decode("utf-8", "replace")
+                        if r.status_code // 100 == 5:
+                            self._observe(b, path, t0, "http_5xx")
+                            self._mark_failed(b)
+                            last_err = f"Ollama HTTP {r.status_code}: {body[:500]}"
+                            continue
+                        self._observe(b, path, t0, "http_4xx")
+                        raise OllamaError(f"Ollama HTTP {r.status_code}: {body[:500]}")
+
+                    done = False
+                    async for line in r.aiter_lines():
+                        if not line.strip():
+                            continue
+                        started = True
+                        chunk = json.loads(line)
+                        if chunk.get("done") and not done:
+                            # 调用方拿到 done 块通常直接 return，生成器不会再走到循环后面：在这里记成功 / 耗时
+                            done = True
+                            self._observe(b, path, t0, None)
+                            self._mark_ok(b)
+                        yield chunk
+                if not done:
+                    self._observe(b, path, t0, None)
+                    self._mark_ok(b)
+                return
+            except httpx.TransportError as e:
+                self._observe(b, path, t0, "transport")
+                self._mark_failed(b)
+                last_err = f"Ollama {b.base_url} unreachable: {e!r}"
+                if started:
+                    raise OllamaError(last_err)
+                continue
+            finally:
+                b.in_flight -= 1
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+_pool: Optional[OllamaPool] = None
+
+
+@metrics.REGISTRY.collector
+def _backend_metrics():
+    backends = _pool.backends if _pool is not None else []
+    now = time.monotonic()
+    yield (
+        "lifebox_ollama_in_flight",
+        "gauge",
+        "Ollama requests in flight per backend.",
+        [({"backend": b.base_url}, b.in_flight) for b in backends],
+    )
+    yield (
+        "lifebox_ollama_backend_healthy",
+        "gauge",
+        "0 while the backend is ejected after failures.",
+        [({"backend": b.base_url}, int(b.healthy(now))) for b in backends],
+    )
+
+
+def _base_urls_from_env() -> List[str]:
+    # OLLAMA_HOSTS=http://gpu1:11434,http://gpu2:11434 ；兼容旧的单个 OLLAMA_HOST
+    raw = os.getenv("OLLAMA_HOSTS") or os.getenv("OLLAMA_HOST") or "http://localhost:11434"
+    return [u.strip() for u in raw.split(",") if u.strip()]
+
+
+async def init_ollama() -> None:
+    global _pool
+    if _pool is not None:
+        return
+    _pool = OllamaPool(
+        _base_urls_from_env(),
+        timeout_s=float(os.getenv("OLLAMA_TIMEOUT_S", "20")),
+        max_connections=int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32")),
+        max_keepalive=int(os.getenv("OLLAMA_MAX_KEEPALIVE", "16")),
+    )
+
+
+async def close_ollama() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.aclose()
+        _pool = None
+
+
+def get_ollama() -> OllamaPool:
+    if _pool is None:
+        raise RuntimeError("Ollama pool is not initialized. Call init_ollama() on startup.")
+    return _pool
+
+
+# 上下文窗口（token）；输入被截断的比例见 GET /api/ai/telemetry 的 ctx_full_ratio
+NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "512"))
+NUM_PREDICT = 220
+
+# 最终响应（stream 时是 done=true 的那一块）里的计数 / 耗时（duration 单位 ns）
+STAT_KEYS = (
+    "total_duration",
+    "load_duration",
+    "prompt_eval_count",
+    "prompt_eval_duration",
+    "eval_count",
+    "eval_duration",
+)
+
+StatsCallback = Callable[[Dict[str, Any]], None]
+
+
+# chat 模板每条 message 的固定开销（role 标记等）
+_TEMPLATE_TOKENS_PER_MESSAGE = 4
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, str]]) -> int:
     """
-    url = f"{base_url.rstrip('/')}/api/chat"
-    payload: Dict[str, Any] = {
+    Rough token count of the whole prompt, independent of Ollama's prompt cache
+    (prompt_eval_count leaves out a reused prefix, so it can't tell whether num_ctx was hit).
+    Non-ASCII (CJK) chars count ~1 token each, ASCII ~4 chars per token.
+    """
+    n = 0
+    for m in messages:
+        content = m.get("content") or ""
+        ascii_chars = sum(1 for c in content if c < "\x80")
+        n += (len(content) - ascii_chars) + (ascii_chars + 3) // 4 + _TEMPLATE_TOKENS_PER_MESSAGE
+    return n
+
+
+def _report_stats(on_stats: Optional[StatsCallback], data: Dict[str, Any], payload: Dict[str, Any]) -> None:
+    if on_stats is None:
+        return
+    stats: Dict[str, Any] = {k: data.get(k) for k in STAT_KEYS}
+    stats["num_ctx"] = NUM_CTX
+    stats["num_predict"] = NUM_PREDICT
+    stats["prompt_tokens_est"] = estimate_prompt_tokens(payload["messages"])
+    on_stats(stats)
+
+
+def _chat_payload(*, model: str, system: str, user: str, stream: bool) -> Dict[str, Any]:
+    return {
         "model": model,
-        "stream": False,
+        "stream": stream,
         "messages": [
             {"role": "system", "content": system},
             {"role": "user", "content": user},
@@ -32,22 +300,58 @@ async def ollama_chat(
         "options": {
             "temperature": 0.0,
             "top_p": 0.1,
-            "num_predict": 220,
-            "num_ctx": 512,
+            "num_predict": NUM_PREDICT,
+            "num_ctx": NUM_CTX,
             "repeat_penalty": 1.05,
         },
     }
 
-    timeout = httpx.Timeout(timeout_s, connect=3.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        r = await client.post(url, json=payload)
-        if r.status_code // 100 != 2:
-            raise OllamaError(f"Ollama HTTP {r.status_code}: {r.text[:500]}")
 
-        data = r.json()
-        # Ollama chat response shape: { message: { role, content }, ... }
-        msg = (data or {}).get("message") or {}
+async def ollama_chat(
+    *,
+    model: str = "qwen2.5:3b-instruct",
+    system: str,
+    user: str,
+    timeout_s: Optional[float] = None,
+    on_stats: Optional[StatsCallback] = None,
+) -> str:
+    """
+    Calls Ollama /api/chat (via the shared pool) and returns assistant content as string.
+    `on_stats` receives the token counts / durations of the call (see STAT_KEYS).
+    Raises OllamaError on non-2xx.
+    """
+    payload = _chat_payload(model=model, system=system, user=user, stream=False)
+
+    data = await get_ollama().post_json("/api/chat", payload, timeout_s=timeout_s)
+    # Ollama chat response shape: { message: { role, content }, ... }
+    msg = (data or {}).get("message") or {}
+    content = msg.get("content")
+    if not isinstance(content, str):
+        raise OllamaError(f"Unexpected Ollama response: {data}")
+    _report_stats(on_stats, data, payload)
+    return content
+
+
+async def ollama_chat_stream(
+    *,
+    model: str = "qwen2.5:3b-instruct",
+    system: str,
+    user: str,
+    on_stats: Optional[StatsCallback] = None,
+) -> AsyncIterator[str]:
+    """
+    Calls Ollama /api/chat with stream=true and yields assistant content deltas.
+    `on_stats` is called with the final chunk's counts / durations.
+    """
+    payload = _chat_payload(model=model, system=system, user=user, stream=True)
+
+    async for chunk in get_ollama().stream_json("/api/chat", payload):
+        if chunk.get("error"):
+            raise OllamaError(f"Ollama stream error: {chunk['error']}")
+        msg = chunk.get("message") or {}
         content = msg.get("content")
-        if not isinstance(content, str):
-            raise OllamaError(f"Unexpected Ollama response: {data}")
-        return content
+        if isinstance(content, str) and content:
+            yield content
+        if chunk.get("done"):
+            _report_stats(on_stats, chunk, payload)
+            return
@@ -0,0 +1,358 @@
+from __future__ import annotations
+
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+# 慢查询阈值（毫秒），超过则打 warning
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+
+
+# =============================
+# Named statements
+# =============================
+# 被多个 router 共用、或在热路径上的 SQL 统一放这里，按名字调用。
+# asyncpg 按 SQL 文本在每条连接上缓存 prepared statement（db.init_db 的 statement_cache_size），
+# 所以同一个名字在每条连接上只 prepare 一次。
+# 权限判断尽量折进数据查询本身（can_read / can_write 列），少一次往返。
+
+# $uid 可读写的记录：个人记录本人 / group 记录的成员
+_CAN_ACCESS = """
+    (
+      (r.group_id is null and r.owner_user_id = $2)
+      or exists (
+        select 1 from group_memberships gm
+        where gm.group_id = r.group_id and gm.user_id = $2
+      )
+    )
+"""
+
+STATEMENTS: Dict[str, str] = {
+    # ---------- groups ----------
+    # 当前用户所在的 group（auth: login / me，groups: list_groups 共用）
+    "user_groups": """
+        select g.id::text as id,
+               g.name,
+               g.group_type,
+               g.owner_user_id::text as owner_user_id,
+               gm.role
+        from group_memberships gm
+        join groups g on g.id = gm.group_id
+        where gm.user_id = $1
+        order by g.created_at desc
+    """,
+    "user_group_ids": """
+        select group_id
+        from group_memberships
+        where user_id = $1
+    """,
+    "membership_role": """
+        select role
+        from group_memberships
+        where group_id = $1 and user_id = $2
+    """,
+    "group_row": """
+        select id::text as id, name, group_type, owner_user_id::text as owner_user_id
+        from groups
+        where id = $1
+    """,
+    "group_owner": """
+        select owner_user_id
+        from groups
+        where id = $1
+    """,
+    "group_members": """
+        select user_id::text as user_id, role
+        from group_memberships
+        where group_id = $1
+        order by joined_at asc
+    """,
+
+    # ---------- inbox_records ----------
+    # 详情 + 权限一次查完：不存在 -> 无行；无权限 -> can_read = false
+    # raw_text 只有详情才从 inbox_blobs 取
+    "record_detail": f"""
+        select r.id::text as id,
+               r.client_id,
+               r.created_at::text as created_at,
+               coalesce(b.body, r.raw_text) as raw_text,
+               r.locale,
+               r.source_hint,
+               r.group_id,
+               r.normalized,
+               r.version,
+               r.owner_user_id,
+               (
+                 select v.version from inbox_scope_versions v
+                 where v.scope_id = coalesce(r.group_id, r.owner_user_id)
+                   and v.is_group = (r.group_id is not null)
+               ) as scope_version,
+               {_CAN_ACCESS} as can_read
+        from inbox_records r
+        left join inbox_blobs b on b.hash = r.raw_text_hash
+        where r.id = $1
+    """,
+    "record_delete": f"""
+        delete from inbox_records r
+        where r.id = $1 and {_CAN_ACCESS}
+    """,
+    # 归档表里的也算（V23：同一 client_id 不会在热表里再建一条）
+    "record_id_by_client_id": """
+        select id::text
+        from inbox_records
+        where owner_user_id = $1 and client_id = $2
+        union all
+        select id::text
+        from inbox_records_archive
+        where owner_user_id = $1 and client_id = $2
+        limit 1
+    """,
+    "record_ids_by_client_ids": """
+        select client_id, id::text as id
+        from inbox_records
+        where owner_user_id = $1 and client_id = any($2::text[])
+        union all
+        select client_id, id::text
+        from inbox_records_archive
+        where owner_user_id = $1 and client_id = any($2::text[])
+    """,
+    # ---------- archive（V20） ----------
+    "archived_access": f"""
+        select r.group_id, {_CAN_ACCESS} as can_access
+        from inbox_records_archive r
+        where r.id = $1
+    """,
+    "record_rehydrate": """
+        select inbox_rehydrate($1)
+    """,
+    # 批量操作前把有权限的已归档 id 搬回（$1 = ids，$2 = user）
+    "records_rehydrate_many": f"""
+        select count(*) filter (where inbox_rehydrate(r.id))
+        from inbox_records_archive r
+        where r.id = any($1::uuid[]) and {_CAN_ACCESS}
+    """,
+    "archive_batch": """
+        select inbox_archive_batch($1, $2)
+    """,
+    "blobs_gc": """
+        select inbox_blobs_gc(make_interval(secs => $1))
+    """,
+    # due_ts 回填（V24）：$1 = 上一批最后的 id（keyset），$2 = 批大小
+    "due_backfill_candidates": """
+        select id, due_at, created_at, locale
+        from inbox_records
+        where due_at is not null and due_ts is null and id > $1
+        order by id
+        limit $2
+    """,
+    "due_backfill_apply": """
+        select inbox_due_backfill($1::uuid[], $2::text[], $3::timestamptz[], $4::text[])
+    """,
+
+    # ---------- change versions（ETag） ----------
+    "scope_version": """
+        select version
+        from inbox_scope_versions
+        where scope_id = $2 and is_group = $1
+    """,
+    # 个人 + 每个所属 group 的版本号（没有写入过的 scope 为 0）
+    "user_scope_versions": """
+        select false as is_group,
+               $1::uuid as scope_id,
+               coalesce(
+                 (select version from inbox_scope_versions where scope_id = $1 and not is_group),
+                 0
+               ) as version
+        union all
+        select true, gm.group_id, coalesce(v.version, 0)
+        from group_memberships gm
+        left join inbox_scope_versions v on v.scope_id = gm.group_id and v.is_group
+        where gm.user_id = $1
+    """,
+
+    # ---------- summary ----------
+    # 个人 + 所属 group 的计数（inbox_summary 由触发器维护）
+    "summary_counters": """
+        select is_group, scope_id, risk, status, currency, n, amount_sum::float8 as amount_sum
+        from inbox_summary
+        where n <> 0
+          and (
+            (not is_group and scope_id = $1)
+            or (is_group and scope_id in (select group_id from group_memberships where user_id = $1))
+          )
+    """,
+    # pending 且 due_ts < $2 + 7 天：overdue / due_7d（day 精度的当天不算 overdue）
+    "summary_due": """
+        select group_id,
+               count(*) filter (
+                 where due_ts < $2 and (due_precision = 'minute' or due_ts <= $2 - interval '1 day')
+               ) as overdue,
+               count(*) filter (
+                 where not (due_ts < $2 and (due_precision = 'minute' or due_ts <= $2 - interval '1 day'))
+               ) as due_7d
+        from (
+          (
+            select group_id, due_ts, due_precision
+            from inbox_records
+            where owner_user_id = $1 and group_id is null
+              and status = 'pending' and due_ts is not null and due_ts < $2 + interval '7 days'
+          )
+          union all
+          (
+            select group_id, due_ts, due_precision
+            from inbox_records
+            where group_id in (select group_id from group_memberships where user_id = $1)
+              and status = 'pending' and due_ts is not null and due_ts < $2 + interval '7 days'
+          )
+        ) t
+        group by group_id
+    """,
+    # ---------- ollama telemetry（V22） ----------
+    # $1 = 统计最近多少小时，$2 = 冷加载阈值（ms）
+    # prompt_eval_count 不含 Ollama 复用的 prompt 前缀缓存，所以 tokens/s 只反映实际计算的部分
+    "ollama_calls_summary": """
+        select model,
+               count(*) as calls,
+               count(*) filter (where stream) as stream_calls,
+               avg(input_chars)::float8 as avg_input_chars,
+               avg(prompt_eval_count)::float8 as avg_prompt_tokens,
+               avg(eval_count)::float8 as avg_eval_tokens,
+               percentile_cont(0.95) within group (order by prompt_eval_count)::float8 as p95_prompt_tokens,
+               (sum(prompt_eval_count)::float8 * 1e9 / nullif(sum(prompt_eval_duration_ns), 0)) as prompt_tokens_per_s,
+               (sum(eval_count)::float8 * 1e9 / nullif(sum(eval_duration_ns), 0)) as eval_tokens_per_s,
+               (avg(prompt_eval_duration_ns) / 1e6)::float8 as avg_prompt_eval_ms,
+               (avg(eval_duration_ns) / 1e6)::float8 as avg_eval_ms,
+               (avg(load_duration_ns) / 1e6)::float8 as avg_load_ms,
+               (avg(total_duration_ns) / 1e6)::float8 as avg_total_ms,
+               (sum(prompt_eval_duration_ns)::float8
+                 / nullif(sum(prompt_eval_duration_ns) + sum(eval_duration_ns), 0)) as prompt_time_share,
+               (count(*) filter (where load_duration_ns >= $2 * 1e6))::float8 / count(*) as cold_load_ratio,
+               avg(prompt_tokens_est)::float8 as avg_prompt_tokens_est,
+               -- 估算的整个 prompt + num_predict 超过上下文窗口：输入很可能被截断
+               -- （不用 prompt_eval_count：命中前缀缓存时它只算新增部分；V25 之前的行没有估算值，不计入）
+               (count(*) filter (
+                 where prompt_tokens_est + num_predict > num_ctx
+               ))::float8 / nullif(count(prompt_tokens_est), 0) as ctx_full_ratio,
+               max(num_ctx) as num_ctx
+        from ollama_calls
+        where created_at >= now() - make_interval(hours => $1)
+        group by model
+        order by calls desc
+    """,
+    "ollama_calls_prune": """
+        delete from ollama_calls
+        where created_at < now() - make_interval(days => $1)
+    """,
+
+    # PATCH 改 due_at 时按记录的 locale 解析（已归档的从 payload 取）
+    "record_locale": """
+        select locale from inbox_records where id = $1
+        union all
+        select payload->>'locale' from inbox_records_archive where id = $1
+        limit 1
+    """,
+    # 写失败后区分 404 / 403 / 409
+    "record_access": f"""
+        select r.version, r.group_id, {_CAN_ACCESS} as can_write
+        from inbox_records r
+        where r.id = $1
+    """,
+}
+
+
+# =============================
+# Per-query timing
+# =============================
+class QueryStats:
+    """
+    name -> count / total / max latency（进程内累计）
+    """
+
+    def __init__(self) -> None:
+        self._stats: Dict[str, List[float]] = {}
+
+    def record(self, name: str, elapsed_s: float) -> None:
+        s = self._stats.get(name)
+        if s is None:
+            s = self._stats[name] = [0, 0.0, 0.0]
+        s[0] += 1
+        s[1] += elapsed_s
+        if elapsed_s > s[2]:
+            s[2] = elapsed_s
+        if elapsed_s * 1000 >= SLOW_QUERY_MS:
+            log.warning("slow query %s: %.1f ms", name, elapsed_s * 1000)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        out: Dict[str, Dict[str, Any]] = {}
+        for name, (count, total, mx) in sorted(self._stats.items(), key=lambda kv: -kv[1][1]):
+            out[name] = {
+                "count": count,
+                "total_ms": round(total * 1000, 3),
+                "avg_ms": round(total * 1000 / count, 3) if count else 0.0,
+                "max_ms": round(mx * 1000, 3),
+            }
+        return out
+
+    def reset(self) -> None:
+        self._stats.clear()
+
+
+query_stats = QueryStats()
+
+
+@metrics.REGISTRY.collector
+def _query_metrics():
+    stats = sorted(query_stats._stats.items())
+    yield ("lifebox_db_query_total", "counter", "Queries run, by statement name.", [({"query": n}, s[0]) for n, s in stats])
+    yield (
+        "lifebox_db_query_seconds_total",
+        "counter",
+        "Total query time, by statement name.",
+        [({"query": n}, s[1]) for n, s in stats],
+    )
+    yield ("lifebox_db_query_max_seconds", "gauge", "Slowest single run, by statement name.", [({"query": n}, s[2]) for n, s in stats])
+
+
+async def _run(conn, method: str, name: str, args: Any) -> Any:
+    sql = STATEMENTS[name]
+    t0 = time.perf_counter()
+    try:
+        return await getattr(conn, method)(sql, *args)
+    finally:
+        query_stats.record(name, time.perf_counter() - t0)
+
+
+async def fetch(conn, name: str, *args: Any) -> List[Any]:
+    return await _run(conn, "fetch", name, args)
+
+
+async def fetchrow(conn, name: str, *args: Any) -> Optional[Any]:
+    return await _run(conn, "fetchrow", name, args)
+
+
+async def fetchval(conn, name: str, *args: Any) -> Any:
+    return await _run(conn, "fetchval", name, args)
+
+
+async def execute(conn, name: str, *args: Any) -> str:
+    return await _run(conn, "execute", name, args)
+
+
+@asynccontextmanager
+async def timed(name: str) -> AsyncIterator[None]:
+    """
+    动态拼接的 SQL（列表 / 日历 / sync 等）不进 STATEMENTS，用这个按名字计时：
+        async with queries.timed("records_page"):
+            rows = await conn.fetch(sql, ...)
+    """
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        query_stats.record(name, time.perf_counter() - t0)
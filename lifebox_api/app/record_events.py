@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+from uuid import UUID
+
+from .db import get_listener
+from . import jsonutil, metrics
+from .membership_cache import NOTIFY_CHANNEL as MEMBERSHIP_CHANNEL
+
+log = logging.getLogger(__name__)
+
+# V21 的触发器在 inbox_records 增删改时 pg_notify 这个 channel
+NOTIFY_CHANNEL = "inbox_record_changed"
+
+STREAM_QUEUE_SIZE = int(os.getenv("CLOUD_STREAM_QUEUE_SIZE", "256"))
+
+# (is_group, scope_id)，与 inbox_scope_versions 的主键一致
+Scope = Tuple[bool, UUID]
+
+# 内部消息：不直接发给客户端
+CLOSED = {"op": "closed"}
+MEMBERSHIP = {"op": "membership"}
+OVERFLOW = {"op": "overflow"}
+
+
+class Subscription:
+    """
+    一个 /stream 连接：订阅的 scope + 有界队列。
+    消费跟不上时不阻塞 LISTEN 回调，直接丢弃后续事件，并让客户端 resync。
+    """
+
+    def __init__(self, user_id: UUID, maxsize: int):
+        self.user_id = user_id
+        self.scopes: Set[Scope] = set()
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=maxsize)
+        self._overflowed = False
+        self._closed = False
+
+    def close(self) -> None:
+        self._closed = True
+        if not self._queue.full():
+            self._queue.put_nowait(CLOSED)
+
+    def push(self, item: Dict[str, Any]) -> None:
+        if self._overflowed:
+            return
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._overflowed = True
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Next event, or None after `timeout` seconds of silence (caller sends a keepalive)."""
+        if self._closed:
+            return CLOSED
+        if self._overflowed:
+            self._overflowed = False
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            return OVERFLOW
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class RecordEventHub:
+    """
+    每个 worker 一个：共用 db.PgListener 的 LISTEN 连接，按 scope 分发给本进程的 /stream 订阅者。
+    - inbox_record_changed：记录增删改 -> 该 scope 的订阅者
+    - group_membership_changed：成员变化 -> 相关用户的订阅者重新加载 group 列表
+    - LISTEN 连接断开：关闭所有订阅（客户端重连后先走 /sync 补齐）
+    """
+
+    def __init__(self, *, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._by_scope: Dict[Scope, Set[Subscription]] = {}
+        self._by_user: Dict[UUID, Set[Subscription]] = {}
+
+    # ---------- subscriptions ----------
+    def subscribe(self, user_id: UUID) -> Subscription:
+        sub = Subscription(user_id, self.queue_size)
+        self._by_user.setdefault(user_id, set()).add(sub)
+        self.set_groups(sub, ())
+        return sub
+
+    def set_groups(self, sub: Subscription, group_ids: Iterable[UUID]) -> None:
+        """Personal scope + the given groups; replaces the previous set."""
+        scopes: Set[Scope] = {(False, sub.user_id)}
+        scopes.update((True, gid) for gid in group_ids)
+        for scope in sub.scopes - scopes:
+            self._discard(scope, sub)
+        for scope in scopes - sub.scopes:
+            self._by_scope.setdefault(scope, set()).add(sub)
+        sub.scopes = scopes
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        for scope in sub.scopes:
+            self._discard(scope, sub)
+        sub.scopes = set()
+        subs = self._by_user.get(sub.user_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._by_user[sub.user_id]
+
+    def _discard(self, scope: Scope, sub: Subscription) -> None:
+        subs = self._by_scope.get(scope)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._by_scope[scope]
+
+    def subscriber_count(self) -> int:
+        return sum(len(s) for s in self._by_user.values())
+
+    # ---------- LISTEN callbacks ----------
+    def _on_record(self, channel: str, payload: str) -> None:
+        try:
+            event = jsonutil.loads(payload)
+            if event.get("group_id"):
+                scope: Scope = (True, UUID(event["group_id"]))
+            else:
+                scope = (False, UUID(event["owner_user_id"]))
+        except (ValueError, KeyError, TypeError):
+            log.warning("record_events: bad notify payload %r", payload)
+            return
+        for sub in tuple(self._by_scope.get(scope, ())):
+            sub.push(event)
+
+    def _on_membership(self, channel: str, payload: str) -> None:
+        try:
+            gid, _, uid = payload.partition(":")
+            group_id = UUID(gid)
+            user_id = UUID(uid) if uid else None
+        except ValueError:
+            return
+        if user_id is not None:
+            targets = set(self._by_user.get(user_id, ()))
+        else:
+            # 整个 group 变化（如删除 group）
+            targets = set(self._by_scope.get((True, group_id), ()))
+        for sub in targets:
+            sub.push(MEMBERSHIP)
+
+    def _on_listen_lost(self) -> None:
+        for subs in tuple(self._by_user.values()):
+            for sub in tuple(subs):
+                sub.close()
+
+
+_hub: Optional[RecordEventHub] = None
+
+
+def get_record_events() -> RecordEventHub:
+    global _hub
+    if _hub is None:
+        _hub = RecordEventHub(queue_size=STREAM_QUEUE_SIZE)
+    return _hub
+
+
+@metrics.REGISTRY.collector
+def _stream_metrics():
+    n = _hub.subscriber_count() if _hub is not None else 0
+    yield ("lifebox_cloud_stream_subscribers", "gauge", "Open /api/cloud/stream connections.", [({}, n)])
+
+
+async def init_record_events() -> None:
+    hub = get_record_events()
+    listener = get_listener()
+    listener.on_lost(hub._on_listen_lost)
+    await listener.listen(NOTIFY_CHANNEL, hub._on_record)
+    await listener.listen(MEMBERSHIP_CHANNEL, hub._on_membership)
+
+
+async def close_record_events() -> None:
+    if _hub is not None:
+        _hub._on_listen_lost()
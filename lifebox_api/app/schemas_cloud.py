@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from pydantic import BaseModel, Field
-from typing import Any, Dict, Optional, Literal
+from typing import Any, Dict, List, Optional, Literal
 from uuid import UUID
 
 Risk = Literal["high", "mid", "low"]
@@ -26,6 +26,7 @@ class CloudSaveRequest(BaseModel):
     risk: Optional[Literal["high", "mid", "low"]] = None
     status: Optional[Literal["pending", "done"]] = None
     color_value: Optional[int] = None
+    now: Optional[str] = None                # 前台当前时间（ISO，带时区），用于把 due_at 解析成 due_ts
 
     # ---------- AI related (可选) ----------
     model: Optional[str] = None
@@ -39,6 +40,48 @@ class CloudSaveResponse(BaseModel):
     existed: bool = False  
 
 
+class CloudBulkSaveRequest(BaseModel):
+    items: List[CloudSaveRequest] = Field(..., min_length=1)
+
+
+class CloudBulkSaveResponse(BaseModel):
+    items: List[CloudSaveResponse]           # 与请求 items 顺序一致
+    created: int
+    existed: int
+
+
+class CloudPatchRequest(BaseModel):
+    """
+    部分更新：只改传了的字段（显式传 null 表示清空，如 due_at=null）
+    """
+    version: int                             # 客户端持有的版本号；不一致则 409
+    title: Optional[str] = None
+    summary: Optional[str] = None            # 写入 normalized.notes
+    due_at: Optional[str] = None
+    amount: Optional[float] = None
+    currency: Optional[str] = None
+    risk: Optional[Risk] = None
+    status: Optional[Status] = None
+    color_value: Optional[int] = None
+    now: Optional[str] = None                # 改 due_at 时用于解析 due_ts（ISO，带时区）
+    normalized: Optional[Dict[str, Any]] = None   # 浅合并进 normalized（jsonb ||）
+
+
+class CloudPatchResponse(BaseModel):
+    id: str
+    version: int
+    updated_at: str
+
+
+class CloudBulkStatusRequest(BaseModel):
+    ids: List[UUID] = Field(..., min_length=1)
+    status: Status = "done"
+
+
+class CloudBulkStatusResponse(BaseModel):
+    items: List[CloudPatchResponse]          # 实际被改的记录（已是目标状态 / 无权限的不返回）
+
+
 class CloudListItem(BaseModel):
     id: str
     client_id: Optional[str] = None
@@ -53,6 +96,23 @@ class CloudListItem(BaseModel):
     colorValue: Optional[str] = None
 
 
+class CloudAuthor(BaseModel):
+    id: Optional[str] = None
+    display_name: Optional[str] = None
+    avatar_url: Optional[str] = None
+
+
+class CloudListItemExpanded(CloudListItem):
+    # 只有 include= 里请求了才会出现在响应里
+    normalized: Optional[Dict[str, Any]] = None      # include=normalized
+    author: Optional[CloudAuthor] = None             # include=author（记录创建者）
+
+
+class CloudCalendarItem(CloudListItem):
+    due_ts: str
+    due_precision: Optional[str] = None
+
+
 class CloudDetail(BaseModel):
     id: str
     created_at: str
@@ -61,3 +121,35 @@ class CloudDetail(BaseModel):
     source_hint: Optional[str] = None
     group_id: Optional[str] = None
     normalized: dict[str, Any]
+    version: Optional[int] = None
+
+
+class CloudSyncItem(CloudListItem):
+    locale: Optional[str] = None             # CloudSaveRequest 允许不传 locale
+    updated_at: str
+    version: int                             # PATCH 时作为 version 传回
+
+
+class CloudSyncResponse(BaseModel):
+    changes: List[CloudSyncItem]             # 新建 / 更新（按变更顺序）
+    deleted: List[str]                       # 墓碑：已删除的 record id
+    cursor: str                              # 下次 sync 传 since=cursor
+    has_more: bool = False                   # true：立刻用 cursor 再拉一页
+    group_ids: List[str]                     # 当前所属 group；与本地不一致时（加入/退出）需要全量重拉
+
+
+class CloudSummaryScope(BaseModel):
+    group_id: Optional[str] = None           # null = 个人记录
+    total: int = 0
+    by_status: Dict[str, int] = Field(default_factory=dict)
+    by_risk: Dict[str, int] = Field(default_factory=dict)           # 全部记录
+    pending_by_risk: Dict[str, int] = Field(default_factory=dict)   # 未完成（角标用）
+    overdue: int = 0                         # pending 且已过期
+    due_7d: int = 0                          # pending 且 7 天内到期（不含 overdue）
+    amounts: Dict[str, float] = Field(default_factory=dict)         # currency -> 合计（全部）
+    pending_amounts: Dict[str, float] = Field(default_factory=dict)
+
+
+class CloudSummaryResponse(BaseModel):
+    personal: CloudSummaryScope
+    groups: List[CloudSummaryScope]
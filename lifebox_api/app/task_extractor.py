@@ -2,7 +2,9 @@ from __future__ import annotations
 
 import json
 import re
-from typing import Any, Dict, List, Optional
+from collections import deque
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
 
 # -----------------------------
@@ -120,76 +122,291 @@ CURRENCY_SIGNS = {
 }
 
 
+KEYWORD_CATEGORIES: Dict[str, List[str]] = {
+    "high_risk": HIGH_RISK_WORDS,
+    "mid_risk": MID_RISK_WORDS,
+    "reply": REPLY_HINTS,
+    "school": SCHOOL_HINTS,
+    "appointment": APPOINTMENT_HINTS,
+    "payment": PAYMENT_HINTS,
+    "work": WORK_HINTS,
+}
+
+# category -> [(start offset in text.lower(), keyword), ...]
+KeywordHits = Dict[str, List[Tuple[int, str]]]
+
+
 # -----------------------------
-# Regex extraction (fast + stable)
+# Keyword automaton (Aho-Corasick, one pass for all packs)
 # -----------------------------
 
-URL_RE = re.compile(r"https?://[^\s)>\]]+")
-PHONE_RE = re.compile(r"(?:\+?\d{1,3}[- ]?)?(?:\d{2,4}[- ]?\d{2,4}[- ]?\d{3,4})")
+class _KeywordAutomaton:
+    """
+    Aho-Corasick over every keyword pack, compiled once at import.
+    goto + failure links are folded into a full transition table (only for characters
+    that appear in some keyword), so scanning is one dict lookup per character.
+    Matching is case-insensitive (same as the old `w.lower() in text.lower()`).
+    """
 
-# ✅ IMPORTANT: support fullwidth digits and fullwidth slash "／"
-# Also remove \b boundary which can fail with Japanese/Unicode OCR.
-DATE_PATTERNS = [
-    # YYYY/MM/DD or YYYY-MM-DD (half/fullwidth digits, / or ／)
-    r"(?:[0-9０-９]{4})[\/／-](?:[0-9０-９]{1,2})[\/／-](?:[0-9０-９]{1,2})",
+    def __init__(self, categories: Dict[str, List[str]]):
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[List[Tuple[str, str]]] = [[]]
+
+        for cat, words in categories.items():
+            for w in words:
+                state = 0
+                for ch in w.lower():
+                    nxt = goto[state].get(ch)
+                    if nxt is None:
+                        goto.append({})
+                        outputs.append([])
+                        nxt = len(goto) - 1
+                        goto[state][ch] = nxt
+                    state = nxt
+                if (cat, w.lower()) not in outputs[state]:
+                    outputs[state].append((cat, w.lower()))
+
+        # BFS: failure links, merged outputs, full transitions
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [dict() for _ in goto]
+        delta[0] = dict(goto[0])
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            f = fail[state]
+            outputs[state] = outputs[state] + outputs[f]
+            trans = dict(delta[f])
+            trans.update(goto[state])
+            delta[state] = trans
+            for ch, nxt in goto[state].items():
+                fail[nxt] = delta[f].get(ch, 0) if state else 0
+                queue.append(nxt)
+
+        self._delta = delta
+        self._outputs = [tuple(o) for o in outputs]
+
+    def scan(self, text: str) -> KeywordHits:
+        hits: KeywordHits = {}
+        if not text:
+            return hits
+        delta = self._delta
+        outputs = self._outputs
+        state = 0
+        for i, ch in enumerate(text.lower()):
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                for cat, w in outputs[state]:
+                    hits.setdefault(cat, []).append((i - len(w) + 1, w))
+        return hits
+
+
+_KEYWORDS = _KeywordAutomaton(KEYWORD_CATEGORIES)
+
+
+def classify_keywords(text: str) -> KeywordHits:
+    """
+    Every keyword-pack hit (with positions) in one pass.
+    Compute once per message and pass to infer_title / infer_risk / infer_suggested_actions /
+    heuristic_confidence via `hits=`.
+    """
+    return _KEYWORDS.scan(text or "")
 
-    # M/D, M/Dまで (half/fullwidth digits, / or ／)
-    r"(?:[0-9０-９]{1,2})[\/／-](?:[0-9０-９]{1,2})(?:まで|迄)?",
 
-    # 1月20日 (usually halfwidth digits)
-    r"(?:\d{1,2})月(?:\d{1,2})日(?:まで|迄)?",
+# -----------------------------
+# Entity scanner (one pass, typed spans)
+# -----------------------------
 
-    # 20日まで (day only; weak but keep)
-    r"(?:\d{1,2})日(?:まで|迄)?",
+# One compiled tokenizer for every entity we extract. Width-insensitive by construction:
+# `\d` already matches fullwidth digits, and separators / signs accept both forms
+# (／ － ： ， ． ￥ ＄ ＵＳＤ), so "１，２００円" / "１２：３０" / "２０２５／０１／２０" match without
+# normalizing (and re-mapping offsets of) the whole text first. Spans are slices of the original text.
+#
+# At each position, alternatives are tried in order: amount > phone > date > time (digit-led), then
+# url > amount > date > time > currency sign (sign / keyword-led).
+# Alternation fragments, shared by both compiled scanners (the order inside each one is the precedence).
+_DIGIT_AMOUNTS = r"""
+          (?P<amt_man_yen>(?P<v_man_yen>\d+(?:[.．]\d+)?)\s*万\s*円)
+        | (?P<amt_man>(?P<v_man>\d+(?:[.．]\d+)?)\s*万\b)
+        | (?P<amt_yen>(?P<v_yen>\d{1,3}(?:[,，]\d{3})+|\d+)\s*円)
+"""
 
-    # Relative
-    r"明後日",
-    r"明日",
-    r"今日",
-    r"来週[月火水木金土日]曜",
-    r"今週[月火水木金土日]曜",
-]
+_DIGIT_PHONE = r"""
+          (?P<phone>(?=(?:[+＋\-－ ]?\d){10})(?:[+＋]?\d{1,3}[-－ ]?)?\d{2,4}[-－ ]?\d{2,4}[-－ ]?\d{3,4})
+"""
 
-TIME_PATTERNS = [
-    r"\b\d{1,2}:\d{2}\b",
-    r"\b\d{1,2}時(?:\d{1,2}分)?\b",
-    r"\b午前\d{1,2}時(?:\d{1,2}分)?\b",
-    r"\b午後\d{1,2}時(?:\d{1,2}分)?\b",
-]
+_DIGIT_DATES_TIMES = r"""
+          (?P<date_ymd>\d{4}[/／\-－]\d{1,2}[/／\-－]\d{1,2})
+        | (?P<date_md>\d{1,2}[/／\-－]\d{1,2}(?:まで|迄)?)
+        | (?P<date_jmd>\d{1,2}月\d{1,2}日(?:まで|迄)?)
+        | (?P<date_d>\d{1,2}日(?:まで|迄)?)
+        | (?P<time_hm>\b\d{1,2}[:：]\d{2}\b)
+        | (?P<time_h>\b\d{1,2}時(?:\d{1,2}分)?\b)
+"""
+
+_SIGN_LED = r"""
+          (?P<url>https?://[^\s)>\]]+)
+
+        | (?P<amt_yen_sign>[¥￥]\s*(?P<v_yen_sign>\d{1,3}(?:[,，]\d{3})+|\d+))
+        | (?P<amt_usd_sign>[$＄]\s*(?P<v_usd_sign>\d+(?:[.．]\d+)?))
+        | (?P<amt_usd>\b(?i:usd|ｕｓｄ)\s*(?P<v_usd>\d+(?:[.．]\d+)?)\b)
+
+        | (?P<date_rel>明後日|明日|今日|(?:来週|今週)[月火水木金土日]曜)
+
+        | (?P<time_am>\b午前\d{1,2}時(?:\d{1,2}分)?\b)
+        | (?P<time_pm>\b午後\d{1,2}時(?:\d{1,2}分)?\b)
+
+        | (?P<cur_jpy>円|[¥￥]|JPY|ＪＰＹ)
+        | (?P<cur_usd>[$＄]|USD|ＵＳＤ)
+        | (?P<cur_cny>元|人民币|RMB|ＲＭＢ|CNY|ＣＮＹ)
+"""
+
+
+def _entity_pattern(*digit_led: str) -> "re.Pattern[str]":
+    return re.compile(
+        # digit-led entities (the lookahead lets non-candidate positions fail after one check),
+        # then everything that starts with a sign / keyword
+        r"(?=[\d+＋])(?:" + "|".join(digit_led) + r")"
+        r"|(?=[h¥￥$＄uUｕＵ明今来午円JＪRＲCＣ元人])(?:" + _SIGN_LED + r")",
+        re.VERBOSE,
+    )
+
+
+_ENTITY_RE = _entity_pattern(_DIGIT_AMOUNTS, _DIGIT_PHONE, _DIGIT_DATES_TIMES)
+
+# same alternation without phones: used to rescan a rejected (< 10 digits) phone match
+_ENTITY_NO_PHONE_RE = _entity_pattern(_DIGIT_AMOUNTS, _DIGIT_DATES_TIMES)
+
+_GROUP_KIND: Dict[str, Tuple[str, int]] = {
+    "url": ("url", 0),
+    "amt_man_yen": ("amount", 0),
+    "amt_man": ("amount", 1),
+    "amt_yen": ("amount", 2),
+    "amt_yen_sign": ("amount", 3),
+    "amt_usd_sign": ("amount", 4),
+    "amt_usd": ("amount", 5),
+    "phone": ("phone", 0),
+    "date_ymd": ("date", 0),
+    "date_md": ("date", 1),
+    "date_jmd": ("date", 2),
+    "date_d": ("date", 3),
+    "date_rel": ("date", 4),
+    "time_hm": ("time", 0),
+    "time_h": ("time", 1),
+    "time_am": ("time", 2),
+    "time_pm": ("time", 3),
+    "cur_jpy": ("currency", 0),
+    "cur_usd": ("currency", 1),
+    "cur_cny": ("currency", 2),
+}
+
+_AMOUNT_CURRENCY = {
+    "amt_man_yen": "JPY",
+    "amt_man": None,
+    "amt_yen": "JPY",
+    "amt_yen_sign": "JPY",
+    "amt_usd_sign": "USD",
+    "amt_usd": "USD",
+}
+
+_SIGN_CURRENCY = {"cur_jpy": "JPY", "cur_usd": "USD", "cur_cny": "CNY"}
+
+# old detect_currency precedence (CURRENCY_SIGNS order)
+_CURRENCY_ORDER = list(CURRENCY_SIGNS.keys())
+
+_NUM_SEP = str.maketrans({",": None, "，": None, "．": "."})
+
+
+class EntitySpan(NamedTuple):
+    kind: str                       # url / amount / phone / date / time / currency
+    start: int                      # offsets in the original text
+    end: int
+    text: str                       # original slice (verbatim)
+    rank: int = 0                   # precedence inside the kind (lower = stronger)
+    value: Optional[float] = None   # amount only
+    currency: Optional[str] = None  # amount (when a sign is attached) / currency
+
+
+def _span_from_match(m: "re.Match[str]") -> EntitySpan:
+    name = m.lastgroup
+    kind, rank = _GROUP_KIND[name]
+    start, end = m.span(name)
+
+    value: Optional[float] = None
+    currency: Optional[str] = None
+    if kind == "amount":
+        # float() accepts fullwidth digits; only separators need folding
+        raw = m.group("v_" + name[len("amt_"):]).translate(_NUM_SEP)
+        value = float(raw) * (10000 if name.startswith("amt_man") else 1)
+        currency = _AMOUNT_CURRENCY[name]
+    elif kind == "currency":
+        currency = _SIGN_CURRENCY[name]
+
+    return EntitySpan(kind, start, end, m.group(name), rank, value, currency)
+
+
+def scan_entities(text: str) -> List[EntitySpan]:
+    """
+    Single pass over the text; returns typed spans (date / time / amount / phone / url /
+    currency) in text order. Compute once and pass to the extract_* helpers via `spans=`.
+    """
+    if not text:
+        return []
+    spans: List[EntitySpan] = []
+    for m in _ENTITY_RE.finditer(text):
+        if m.lastgroup == "phone" and sum(c.isdigit() for c in m.group(0)) < 10:
+            # not a phone after all: whatever else is inside it is still a candidate
+            spans.extend(_span_from_match(m2) for m2 in _ENTITY_NO_PHONE_RE.finditer(text, m.start(), m.end()))
+            continue
+        spans.append(_span_from_match(m))
+    return spans
+
+
+def _spans_of(text: str, spans: Optional[List[EntitySpan]], kind: str) -> List[EntitySpan]:
+    if spans is None:
+        spans = scan_entities(text)
+    return [s for s in spans if s.kind == kind]
 
 
 def _dedupe(items: List[str]) -> List[str]:
     return list(dict.fromkeys([i for i in items if i is not None]))
 
 
-def extract_urls(text: str) -> List[str]:
+def extract_urls(text: str, spans: Optional[List[EntitySpan]] = None) -> List[str]:
     if not text:
         return []
-    return _dedupe(URL_RE.findall(text))
+    return _dedupe([s.text for s in _spans_of(text, spans, "url")])
 
 
-def extract_phones(text: str) -> List[str]:
+def extract_phones(text: str, spans: Optional[List[EntitySpan]] = None) -> List[str]:
     if not text:
         return []
-    candidates = [c.strip() for c in PHONE_RE.findall(text)]
-    cleaned: List[str] = []
-    for c in candidates:
-        digits = re.sub(r"\D", "", c)
-        if len(digits) >= 10:
-            cleaned.append(c)
-    return _dedupe(cleaned)
+    return _dedupe([s.text.strip() for s in _spans_of(text, spans, "phone")])
+
 
+def _currencies(text: str, spans: Optional[List[EntitySpan]]) -> List[str]:
+    if spans is None:
+        spans = scan_entities(text)
+    return [s.currency for s in spans if s.kind in ("amount", "currency") and s.currency]
 
-def detect_currency(text: str) -> Optional[str]:
+
+def detect_currency(text: str, spans: Optional[List[EntitySpan]] = None) -> Optional[str]:
     if not text:
         return None
-    for code, signs in CURRENCY_SIGNS.items():
-        if any(sig in text for sig in signs):
+    found = set(_currencies(text, spans))
+    for code in _CURRENCY_ORDER:
+        if code in found:
             return code
     return None
 
 
-def parse_amount(text: str) -> Optional[float]:
+def _best_amount(text: str, spans: Optional[List[EntitySpan]]) -> Optional[EntitySpan]:
+    amounts = _spans_of(text, spans, "amount")
+    if not amounts:
+        return None
+    return min(amounts, key=lambda s: (s.rank, s.start))
+
+
+def parse_amount(text: str, spans: Optional[List[EntitySpan]] = None) -> Optional[float]:
     """
     Convert:
       "3万円" => 30000
@@ -197,66 +414,56 @@ def parse_amount(text: str) -> Optional[float]:
       "1,200円" => 1200
       "¥1,200" => 1200
       "$120" => 120
+    (fullwidth forms like "１，２００円" / "￥1,200" are matched too)
     """
     if not text:
         return None
+    best = _best_amount(text, spans)
+    return best.value if best else None
 
-    m = re.search(r"(\d+(?:\.\d+)?)\s*万\s*円", text)
-    if m:
-        return float(m.group(1)) * 10000
 
-    m = re.search(r"(\d+(?:\.\d+)?)\s*万\b", text)
-    if m:
-        return float(m.group(1)) * 10000
-
-    m = re.search(r"(\d{1,3}(?:,\d{3})+|\d+)\s*円", text)
-    if m:
-        return float(m.group(1).replace(",", ""))
-
-    m = re.search(r"¥\s*(\d{1,3}(?:,\d{3})+|\d+)", text)
-    if m:
-        return float(m.group(1).replace(",", ""))
-
-    m = re.search(r"\$\s*(\d+(?:\.\d+)?)", text)
-    if m:
-        return float(m.group(1))
+def parse_amount_with_currency(text: str, spans: Optional[List[EntitySpan]] = None) -> Tuple[Optional[float], Optional[str]]:
+    """
+    Amount + the currency attached to that amount ("$120" -> USD).
+    Falls back to detect_currency when the amount carries no sign ("3万").
+    """
+    if not text:
+        return None, None
+    if spans is None:
+        spans = scan_entities(text)
+    best = _best_amount(text, spans)
+    if best is not None and best.currency:
+        return best.value, best.currency
+    return (best.value if best else None), detect_currency(text, spans)
 
-    m = re.search(r"\bUSD\s*(\d+(?:\.\d+)?)\b", text, re.IGNORECASE)
-    if m:
-        return float(m.group(1))
 
-    return None
+def _date_spans(text: str, spans: Optional[List[EntitySpan]]) -> List[EntitySpan]:
+    # old ordering: by pattern, then by position
+    return sorted(_spans_of(text, spans, "date"), key=lambda s: (s.rank, s.start))
 
 
-def extract_date_candidates(text: str) -> List[str]:
+def extract_date_candidates(text: str, spans: Optional[List[EntitySpan]] = None) -> List[str]:
     if not text:
         return []
-    found: List[str] = []
-    for pat in DATE_PATTERNS:
-        for m in re.finditer(pat, text):
-            found.append(m.group(0))
-    return _dedupe(found)
+    return _dedupe([s.text for s in _date_spans(text, spans)])
 
 
-def extract_time_candidates(text: str) -> List[str]:
+def extract_time_candidates(text: str, spans: Optional[List[EntitySpan]] = None) -> List[str]:
     if not text:
         return []
-    found: List[str] = []
-    for pat in TIME_PATTERNS:
-        for m in re.finditer(pat, text):
-            found.append(m.group(0))
-    return _dedupe(found)
+    times = sorted(_spans_of(text, spans, "time"), key=lambda s: (s.rank, s.start))
+    return _dedupe([s.text for s in times])
 
 
 # -----------------------------
 # Choosing the single best task (multi-task messages)
 # -----------------------------
 
-def _score_date_candidate(text: str, cand: str) -> int:
+def _score_date_candidate(text: str, span: EntitySpan) -> int:
     score = 0
     window = 40
-    idx = text.find(cand)
-    near = text[max(0, idx - window): idx + len(cand) + window] if idx != -1 else text
+    cand = span.text
+    near = text[max(0, span.start - window): span.end + window]
 
     # deadline signals
     if any(k in near for k in ["期限", "締切", "due", "支払い期限"]):
@@ -278,38 +485,200 @@ def _score_date_candidate(text: str, cand: str) -> int:
     if "来週" in cand or "今週" in cand:
         score += 2
 
-    if re.match(r"(?:[0-9０-９]{4})[\/／-](?:[0-9０-９]{1,2})[\/／-](?:[0-9０-９]{1,2})", cand):
+    if span.rank == 0:  # YYYY/MM/DD
         score += 2
 
     return score
 
 
-def choose_due_at(text: str) -> Optional[str]:
-    cands = extract_date_candidates(text)
+def choose_due_at(text: str, spans: Optional[List[EntitySpan]] = None) -> Optional[str]:
+    cands = _date_spans(text, spans) if text else []
     if not cands:
         return None
-    scored = sorted(((_score_date_candidate(text, c), c) for c in cands), key=lambda x: x[0], reverse=True)
+    # stable sort: ties keep the old candidate order
+    scored = sorted(((_score_date_candidate(text, s), s.text) for s in cands), key=lambda x: x[0], reverse=True)
     return scored[0][1]
 
 
 # -----------------------------
-# Title generation (more actionable + domain aware)
+# Due date resolution (raw due_at string -> absolute timestamp)
 # -----------------------------
 
-def _contains_any(text: str, words: List[str]) -> bool:
-    t = text.lower()
-    return any(w.lower() in t for w in words)
+# 没有时区信息时按 locale 推断（日本 / 中国都没有夏令时，固定偏移即可）
+_LOCALE_TZ = {
+    "ja": timezone(timedelta(hours=9)),
+    "zh": timezone(timedelta(hours=8)),
+}
+
+# M/D, D-only: pick the first occurrence not older than this many days (so "12/25" read on 12/28 stays overdue)
+_PAST_GRACE_DAYS = 7
+
+_WEEKDAYS = "月火水木金土日"
+
+_DUE_YMD_RE = re.compile(r"(\d{4})[/／\-－](\d{1,2})[/／\-－](\d{1,2})")
+_DUE_MD_RE = re.compile(r"(\d{1,2})[/／\-－](\d{1,2})")
+_DUE_JMD_RE = re.compile(r"(\d{1,2})月(\d{1,2})日")
+_DUE_D_RE = re.compile(r"(\d{1,2})日")
+_DUE_WEEK_RE = re.compile(r"(来週|今週)([月火水木金土日])曜")
+_DUE_HM_RE = re.compile(r"(\d{1,2})[:：](\d{2})")
+_DUE_JI_RE = re.compile(r"(午前|午後)?(\d{1,2})時(?:(\d{1,2})分)?")
 
 
-def infer_title(text: str, due_at: Optional[str], amount: Optional[float], currency: Optional[str]) -> str:
+class ResolvedDue(NamedTuple):
+    at: datetime
+    precision: str  # "day" | "minute"
+
+
+def locale_tz(locale: Optional[str]) -> timezone:
+    lang = (locale or "").split("-")[0].split("_")[0].lower()
+    return _LOCALE_TZ.get(lang, timezone.utc)
+
+
+def _parse_now(now: Optional[Any], tz: timezone) -> datetime:
+    if isinstance(now, datetime):
+        dt = now
+    elif isinstance(now, str) and now.strip():
+        try:
+            dt = datetime.fromisoformat(now.strip())
+        except ValueError:
+            dt = datetime.now(tz)
+    else:
+        dt = datetime.now(tz)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=tz)
+    return dt
+
+
+def _safe_date(y: int, m: int, d: int) -> Optional[date]:
+    try:
+        return date(y, m, d)
+    except ValueError:
+        return None
+
+
+def _first_not_older(cands: List[Optional[date]], today: date) -> Optional[date]:
+    floor = today - timedelta(days=_PAST_GRACE_DAYS)
+    valid = [c for c in cands if c is not None]
+    for c in valid:
+        if c >= floor:
+            return c
+    return valid[-1] if valid else None
+
+
+def _resolve_time(s: str) -> Optional[Tuple[int, int]]:
+    m = _DUE_HM_RE.search(s)
+    if m:
+        h, mi = int(m.group(1)), int(m.group(2))
+    else:
+        m = _DUE_JI_RE.search(s)
+        if not m:
+            return None
+        h, mi = int(m.group(2)), int(m.group(3) or 0)
+        if m.group(1) == "午後" and h < 12:
+            h += 12
+    if h > 23 or mi > 59:
+        return None
+    return h, mi
+
+
+def resolve_due_at(due_at: Optional[str], *, now: Optional[Any] = None, locale: Optional[str] = None) -> Optional[ResolvedDue]:
+    """
+    Turn a raw due_at expression ("明日", "1/20まで", "来週月曜", "2025-01-20", ISO datetime ...)
+    into an absolute timestamp, relative to `now` (ISO string or datetime; default: current time
+    in the locale's timezone).
+    - precision="day": local midnight of that day
+    - precision="minute": a time was present ("明日 10:00", "1/20 午後3時", ISO datetime)
+    Returns None when the expression cannot be resolved.
+    """
+    if not due_at or not due_at.strip():
+        return None
+    s = due_at.strip()
+    tz = locale_tz(locale)
+    now_dt = _parse_now(now, tz)
+    tz = now_dt.tzinfo or tz
+    today = now_dt.date()
+
+    # client 已经给了 ISO（"2025-01-20" / "2025-01-20T10:00:00+09:00"）
+    try:
+        iso = datetime.fromisoformat(s)
+        if iso.tzinfo is None:
+            iso = iso.replace(tzinfo=tz)
+        has_time = "T" in s or " " in s
+        return ResolvedDue(iso, "minute" if has_time else "day")
+    except ValueError:
+        pass
+
+    d: Optional[date] = None
+    m = _DUE_YMD_RE.search(s)
+    if m:
+        d = _safe_date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    elif "明後日" in s:
+        d = today + timedelta(days=2)
+    elif "明日" in s:
+        d = today + timedelta(days=1)
+    elif "今日" in s or "本日" in s:
+        d = today
+    else:
+        m = _DUE_WEEK_RE.search(s)
+        if m:
+            monday = today - timedelta(days=today.weekday())
+            if m.group(1) == "来週":
+                monday += timedelta(days=7)
+            d = monday + timedelta(days=_WEEKDAYS.index(m.group(2)))
+        else:
+            m = _DUE_JMD_RE.search(s) or _DUE_MD_RE.search(s)
+            if m:
+                mo, dd = int(m.group(1)), int(m.group(2))
+                d = _first_not_older(
+                    [_safe_date(today.year - 1, mo, dd), _safe_date(today.year, mo, dd), _safe_date(today.year + 1, mo, dd)],
+                    today,
+                )
+            else:
+                m = _DUE_D_RE.search(s)
+                if m:
+                    dd = int(m.group(1))
+                    prev_month = (today.replace(day=1) - timedelta(days=1))
+                    next_month = (today.replace(day=28) + timedelta(days=4))
+                    d = _first_not_older(
+                        [
+                            _safe_date(prev_month.year, prev_month.month, dd),
+                            _safe_date(today.year, today.month, dd),
+                            _safe_date(next_month.year, next_month.month, dd),
+                        ],
+                        today,
+                    )
+
+    if d is None:
+        return None
+
+    hm = _resolve_time(s)
+    if hm is None:
+        return ResolvedDue(datetime(d.year, d.month, d.day, tzinfo=tz), "day")
+    return ResolvedDue(datetime(d.year, d.month, d.day, hm[0], hm[1], tzinfo=tz), "minute")
+
+
+# -----------------------------
+# Title generation (more actionable + domain aware)
+# -----------------------------
+
+def infer_title(
+    text: str,
+    due_at: Optional[str],
+    amount: Optional[float],
+    currency: Optional[str],
+    hits: Optional[KeywordHits] = None,
+) -> str:
     if not text or not text.strip():
         return "内容確認が必要"
 
     t = text.strip()
-    is_payment = _contains_any(t, PAYMENT_HINTS)
-    is_appointment = _contains_any(t, APPOINTMENT_HINTS)
-    is_school = _contains_any(t, SCHOOL_HINTS)
-    is_work = _contains_any(t, WORK_HINTS)
+    if hits is None:
+        hits = classify_keywords(t)
+    is_payment = "payment" in hits
+    is_appointment = "appointment" in hits
+    is_school = "school" in hits
+    is_work = "work" in hits
+    is_reply = "reply" in hits
 
     if is_payment:
         if due_at:
@@ -335,7 +704,7 @@ def infer_title(text: str, due_at: Optional[str], amount: Optional[float], curre
     if is_work:
         if "提出" in t:
             return "資料を準備して提出する"
-        if _contains_any(t, REPLY_HINTS):
+        if is_reply:
             return "内容を確認して返信する"
         if due_at:
             return "期限を確認して対応する"
@@ -343,7 +712,7 @@ def infer_title(text: str, due_at: Optional[str], amount: Optional[float], curre
 
     if "提出" in t:
         return "提出する"
-    if _contains_any(t, REPLY_HINTS):
+    if is_reply:
         return "内容を確認して返信する"
     if due_at:
         return "期限を確認して対応する"
@@ -354,12 +723,13 @@ def infer_title(text: str, due_at: Optional[str], amount: Optional[float], curre
 # Risk / suggested actions / notes
 # -----------------------------
 
-def infer_risk(text: str, due_at: Optional[str]) -> str:
+def infer_risk(text: str, due_at: Optional[str], hits: Optional[KeywordHits] = None) -> str:
     if not text or not text.strip():
         return "low"
-    t = text.lower()
+    if hits is None:
+        hits = classify_keywords(text)
 
-    if any(w.lower() in t for w in HIGH_RISK_WORDS):
+    if "high_risk" in hits:
         return "high"
 
     if due_at in ("今日", "本日", "今日中"):
@@ -367,19 +737,26 @@ def infer_risk(text: str, due_at: Optional[str]) -> str:
     if due_at == "明日":
         return "mid"
 
-    if any(w.lower() in t for w in MID_RISK_WORDS):
+    if "mid_risk" in hits:
         return "mid"
 
     return "low"
 
 
-def infer_suggested_actions(text: str, due_at: Optional[str], urls: List[str]) -> List[str]:
+def infer_suggested_actions(
+    text: str,
+    due_at: Optional[str],
+    urls: List[str],
+    hits: Optional[KeywordHits] = None,
+) -> List[str]:
     actions: List[str] = []
     if due_at:
         actions.append("calendar")
     if urls:
         actions.append("open_link")
-    if text and _contains_any(text, REPLY_HINTS):
+    if hits is None:
+        hits = classify_keywords(text)
+    if text and "reply" in hits:
         actions.append("reply")
     out: List[str] = []
     for a in actions:
@@ -435,6 +812,34 @@ def extract_json_object(raw: str) -> Optional[Dict[str, Any]]:
     return None
 
 
+_PARTIAL_STR_FIELD_RE = {
+    k: re.compile(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)"' % k)
+    for k in ("title", "risk", "notes")
+}
+
+
+def extract_partial_fields(raw: str) -> Dict[str, str]:
+    """
+    Pull already-complete string fields (title / risk / notes) out of a JSON object
+    that is still being generated. A field is returned only once its closing quote arrived.
+    """
+    out: Dict[str, str] = {}
+    if not raw:
+        return out
+    for k, pat in _PARTIAL_STR_FIELD_RE.items():
+        m = pat.search(raw)
+        if not m:
+            continue
+        try:
+            v = json.loads('"' + m.group(1) + '"')
+        except Exception:
+            continue
+        if k == "risk" and v not in ("high", "mid", "low"):
+            continue
+        out[k] = v
+    return out
+
+
 def _coerce_source(parsed_source: Any, source_hint: Optional[str]) -> Optional[str]:
     if isinstance(parsed_source, str) and parsed_source.strip():
         return parsed_source.strip()
@@ -486,6 +891,43 @@ def _coerce_confidence(v: Any, fallback: float) -> float:
     return f
 
 
+def heuristic_confidence(
+    text: str,
+    due_at: Optional[str],
+    amount: Optional[float],
+    hits: Optional[KeywordHits] = None,
+) -> float:
+    readable = bool((text or "").strip())
+    if hits is None:
+        hits = classify_keywords(text)
+    if readable and due_at and (amount is not None):
+        return 0.9
+    if readable and due_at:
+        return 0.8
+    if readable and "mid_risk" in hits:
+        return 0.7
+    if readable:
+        return 0.6
+    return 0.2
+
+
+def quick_fields(text: str) -> Dict[str, Any]:
+    """
+    Fields that regex heuristics can compute immediately, without the model.
+    (same values normalize_to_schema will use for these keys when due_at is found in the text)
+    """
+    text = text or ""
+    spans = scan_entities(text)
+    amount, currency = parse_amount_with_currency(text, spans)
+    return {
+        "due_at": choose_due_at(text, spans),
+        "amount": float(amount) if amount is not None else None,
+        "currency": currency,
+        "phones": extract_phones(text, spans),
+        "urls": extract_urls(text, spans),
+    }
+
+
 def normalize_to_schema(
     *,
     model_output_text: str,
@@ -498,10 +940,12 @@ def normalize_to_schema(
     text = input_text or ""
     readable = bool(text.strip())
 
-    urls = extract_urls(text)
-    phones = extract_phones(text)
+    spans = scan_entities(text)
+    urls = extract_urls(text, spans)
+    phones = extract_phones(text, spans)
+    hits = classify_keywords(text)
 
-    due_at = choose_due_at(text)
+    due_at = choose_due_at(text, spans)
 
     # ✅ Fallback: if due_at not found in raw text, try notes/title from model output
     # (notes/title are supposed to be copied from original text, so still safe)
@@ -520,15 +964,14 @@ def normalize_to_schema(
                 due_at = c2
                 break
 
-    currency = detect_currency(text)
-    amount = parse_amount(text)
+    amount, currency = parse_amount_with_currency(text, spans)
 
     if amount is not None and currency is None:
         currency = None
 
     title = parsed.get("title")
     if not isinstance(title, str) or not title.strip():
-        title = infer_title(text, due_at, amount, currency)
+        title = infer_title(text, due_at, amount, currency, hits=hits)
 
     notes = parsed.get("notes")
     if not isinstance(notes, str) or not notes.strip():
@@ -543,25 +986,15 @@ def normalize_to_schema(
     risk_fallback = "mid"
     if readable:
         # reuse inference
-        risk_fallback = infer_risk(text, due_at)
+        risk_fallback = infer_risk(text, due_at, hits=hits)
     risk = _coerce_risk(parsed.get("risk"), risk_fallback)
 
     status = _coerce_status(parsed.get("status"))
 
-    suggested_fallback = infer_suggested_actions(text, due_at, urls)
+    suggested_fallback = infer_suggested_actions(text, due_at, urls, hits=hits)
     suggested_actions = _coerce_actions(parsed.get("suggested_actions"), suggested_fallback)
 
-    # confidence heuristic
-    if readable and due_at and (amount is not None):
-        conf_fallback = 0.9
-    elif readable and due_at:
-        conf_fallback = 0.8
-    elif readable and _contains_any(text, MID_RISK_WORDS):
-        conf_fallback = 0.7
-    elif readable:
-        conf_fallback = 0.6
-    else:
-        conf_fallback = 0.2
+    conf_fallback = heuristic_confidence(text, due_at, amount, hits=hits)
 
     confidence = _coerce_confidence(parsed.get("confidence"), conf_fallback)
 
@@ -586,3 +1019,17 @@ def normalize_to_schema(
         "confidence": confidence,
         "notes": notes,
     }
+
+
+def analyze_heuristic(*, input_text: str, source_hint: Optional[str], locale: str) -> Dict[str, Any]:
+    """
+    Regex/keyword-only analyze (no model call).
+    Same output shape as normalize_to_schema; every field comes from the fallback path
+    (infer_title / infer_risk / infer_suggested_actions / choose_due_at / heuristic_confidence).
+    """
+    return normalize_to_schema(
+        model_output_text="",
+        input_text=input_text,
+        source_hint=source_hint,
+        locale=locale,
+    )
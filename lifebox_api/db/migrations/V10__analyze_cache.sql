@@ -0,0 +1,12 @@
+-- analyze 结果缓存（L2，多 worker 共享）
+-- UNLOGGED：不写 WAL，崩溃后清空也无所谓（只是缓存）
+create unlogged table if not exists analyze_cache (
+  key text primary key,                     -- sha256(text, locale, source_hint, model, prompt_version)
+  prompt_version text not null,
+  result text not null,                     -- normalize_to_schema 的 JSON
+  created_at timestamptz not null default now(),
+  expires_at timestamptz not null
+);
+
+create index if not exists idx_analyze_cache_expires_at on analyze_cache(expires_at);
+create index if not exists idx_analyze_cache_prompt_version on analyze_cache(prompt_version);
@@ -0,0 +1,15 @@
+-- due_at 原样保存（"明日" / "1/20まで"），due_ts 是按保存时的 now/locale 解析出来的绝对时间
+alter table inbox_records
+  add column if not exists due_ts timestamptz;
+
+alter table inbox_records
+  add column if not exists due_precision text;   -- day / minute
+
+-- 日历按月查询：个人 / group 各一个范围索引
+create index if not exists idx_inbox_records_owner_due_ts
+on inbox_records (owner_user_id, due_ts)
+where group_id is null and due_ts is not null;
+
+create index if not exists idx_inbox_records_group_due_ts
+on inbox_records (group_id, due_ts)
+where due_ts is not null;
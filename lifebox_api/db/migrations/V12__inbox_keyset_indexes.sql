@@ -0,0 +1,10 @@
+-- keyset 分页：order by created_at desc, id desc + (created_at, id) < cursor
+create index if not exists idx_inbox_records_owner_created
+on inbox_records (owner_user_id, created_at, id);
+
+create index if not exists idx_inbox_records_group_created
+on inbox_records (group_id, created_at, id);
+
+-- 上面两个复合索引的前缀已覆盖单列索引（包括外键 on delete set null 的查找），去掉冗余的写放大
+drop index if exists idx_inbox_records_owner_user_id;
+drop index if exists idx_inbox_records_group_id;
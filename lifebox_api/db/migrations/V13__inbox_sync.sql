@@ -0,0 +1,59 @@
+-- Delta sync：每条记录带上最后一次写入它的事务 id（xid8，单调递增）
+-- sync 只返回 xid < 当前快照 xmin 的变更：比 xmin 小的事务都已结束，不会有“晚提交、序号更小”的变更被漏掉
+alter table inbox_records
+  add column if not exists change_xid xid8 not null default pg_current_xact_id();
+
+create index if not exists idx_inbox_records_owner_change
+on inbox_records (owner_user_id, change_xid, id)
+where group_id is null;
+
+create index if not exists idx_inbox_records_group_change
+on inbox_records (group_id, change_xid, id);
+
+create or replace function inbox_records_touch() returns trigger as $$
+begin
+  new.change_xid := pg_current_xact_id();
+  new.updated_at := now();
+  return new;
+end;
+$$ language plpgsql;
+
+drop trigger if exists trg_inbox_records_touch on inbox_records;
+create trigger trg_inbox_records_touch
+before update on inbox_records
+for each row execute function inbox_records_touch();
+
+
+-- 删除留墓碑，让 delete_record 的删除同步到其它设备 / 成员
+create table if not exists inbox_tombstones (
+  record_id uuid primary key,
+  owner_user_id uuid,
+  group_id uuid,
+  deleted_xid xid8 not null default pg_current_xact_id(),
+  deleted_at timestamptz not null default now()
+);
+
+create index if not exists idx_inbox_tombstones_owner
+on inbox_tombstones (owner_user_id, deleted_xid, record_id)
+where group_id is null;
+
+create index if not exists idx_inbox_tombstones_group
+on inbox_tombstones (group_id, deleted_xid, record_id);
+
+create or replace function inbox_records_tombstone() returns trigger as $$
+begin
+  insert into inbox_tombstones (record_id, owner_user_id, group_id)
+  values (old.id, old.owner_user_id, old.group_id)
+  on conflict (record_id) do update set
+    owner_user_id = excluded.owner_user_id,
+    group_id = excluded.group_id,
+    deleted_xid = pg_current_xact_id(),
+    deleted_at = now();
+  return old;
+end;
+$$ language plpgsql;
+
+drop trigger if exists trg_inbox_records_tombstone on inbox_records;
+create trigger trg_inbox_records_tombstone
+after delete on inbox_records
+for each row execute function inbox_records_tombstone();
@@ -0,0 +1,13 @@
+-- (owner_user_id, client_id) 唯一：save_record / records/bulk 用 on conflict 做幂等
+-- client_id 为 null 的记录不受影响（null 之间不冲突）
+
+-- 先清掉历史上并发重试产生的重复行（保留最早的一条）
+delete from inbox_records r
+using inbox_records keep
+where r.client_id is not null
+  and keep.owner_user_id = r.owner_user_id
+  and keep.client_id = r.client_id
+  and (keep.created_at, keep.id) < (r.created_at, r.id);
+
+create unique index if not exists uq_inbox_records_owner_client
+on inbox_records (owner_user_id, client_id);
@@ -0,0 +1,12 @@
+-- PATCH /records/{id} 的乐观锁：每次 update 自动 version + 1
+alter table inbox_records
+  add column if not exists version bigint not null default 1;
+
+create or replace function inbox_records_touch() returns trigger as $$
+begin
+  new.change_xid := pg_current_xact_id();
+  new.updated_at := now();
+  new.version := old.version + 1;
+  return new;
+end;
+$$ language plpgsql;
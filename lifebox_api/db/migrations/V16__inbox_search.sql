@@ -0,0 +1,15 @@
+-- 全文搜索（/records/search）：title + normalized.notes + raw_text 的 trigram 索引
+-- pg_trgm 不依赖分词，日文 / 中文也能用 like '%…%' 走索引
+create extension if not exists pg_trgm;
+
+create or replace function inbox_search_text(title text, normalized jsonb, raw_text text)
+returns text
+language sql
+immutable
+parallel safe
+as $$
+  select lower(coalesce(title, '') || ' ' || coalesce(normalized->>'notes', '') || ' ' || coalesce(raw_text, ''))
+$$;
+
+create index if not exists idx_inbox_records_search_trgm
+on inbox_records using gin (inbox_search_text(title, normalized, raw_text) gin_trgm_ops);
@@ -0,0 +1,115 @@
+-- /api/cloud/summary 用的计数表：按 scope（个人 = owner_user_id / group = group_id）× risk × status × currency
+-- 由 inbox_records 上的语句级触发器增量维护（save / bulk / patch / 批量改状态 / delete 全部覆盖）
+create table if not exists inbox_summary (
+  is_group boolean not null,
+  scope_id uuid not null,
+  risk text not null,
+  status text not null,
+  currency text not null default '',
+  n bigint not null default 0,
+  amount_sum numeric not null default 0,
+  primary key (scope_id, is_group, risk, status, currency)
+);
+
+-- 初始数据
+insert into inbox_summary (is_group, scope_id, risk, status, currency, n, amount_sum)
+select group_id is not null,
+       coalesce(group_id, owner_user_id),
+       risk,
+       status,
+       coalesce(currency, ''),
+       count(*),
+       coalesce(sum(amount), 0)
+from inbox_records
+where coalesce(group_id, owner_user_id) is not null
+group by 1, 2, 3, 4, 5
+on conflict (scope_id, is_group, risk, status, currency) do update set
+  n = excluded.n,
+  amount_sum = excluded.amount_sum;
+
+
+-- 增量：旧行 -1、新行 +1，按 key 合并后 upsert（按主键排序加锁，避免并发事务互相死锁）
+create or replace function inbox_summary_on_insert() returns trigger as $$
+begin
+  insert into inbox_summary (is_group, scope_id, risk, status, currency, n, amount_sum)
+  select group_id is not null, coalesce(group_id, owner_user_id), risk, status, coalesce(currency, ''),
+         count(*), coalesce(sum(amount), 0)
+  from new_rows
+  where coalesce(group_id, owner_user_id) is not null
+  group by 1, 2, 3, 4, 5
+  order by 2, 1, 3, 4, 5
+  on conflict (scope_id, is_group, risk, status, currency) do update set
+    n = inbox_summary.n + excluded.n,
+    amount_sum = inbox_summary.amount_sum + excluded.amount_sum;
+  return null;
+end;
+$$ language plpgsql;
+
+create or replace function inbox_summary_on_delete() returns trigger as $$
+begin
+  insert into inbox_summary (is_group, scope_id, risk, status, currency, n, amount_sum)
+  select group_id is not null, coalesce(group_id, owner_user_id), risk, status, coalesce(currency, ''),
+         -count(*), -coalesce(sum(amount), 0)
+  from old_rows
+  where coalesce(group_id, owner_user_id) is not null
+  group by 1, 2, 3, 4, 5
+  order by 2, 1, 3, 4, 5
+  on conflict (scope_id, is_group, risk, status, currency) do update set
+    n = inbox_summary.n + excluded.n,
+    amount_sum = inbox_summary.amount_sum + excluded.amount_sum;
+  return null;
+end;
+$$ language plpgsql;
+
+-- update：只改 title / normalized 等不影响计数的列时，差值为 0，不写 inbox_summary
+create or replace function inbox_summary_on_update() returns trigger as $$
+begin
+  insert into inbox_summary (is_group, scope_id, risk, status, currency, n, amount_sum)
+  select is_group, scope_id, risk, status, currency, sum(dn), sum(da)
+  from (
+    select group_id is not null as is_group, coalesce(group_id, owner_user_id) as scope_id,
+           risk, status, coalesce(currency, '') as currency, -1 as dn, -coalesce(amount, 0)::numeric as da
+    from old_rows
+    union all
+    select group_id is not null, coalesce(group_id, owner_user_id),
+           risk, status, coalesce(currency, ''), 1, coalesce(amount, 0)::numeric
+    from new_rows
+  ) d
+  where scope_id is not null
+  group by 1, 2, 3, 4, 5
+  having sum(dn) <> 0 or sum(da) <> 0
+  order by 2, 1, 3, 4, 5
+  on conflict (scope_id, is_group, risk, status, currency) do update set
+    n = inbox_summary.n + excluded.n,
+    amount_sum = inbox_summary.amount_sum + excluded.amount_sum;
+  return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists trg_inbox_summary_insert on inbox_records;
+create trigger trg_inbox_summary_insert
+after insert on inbox_records
+referencing new table as new_rows
+for each statement execute function inbox_summary_on_insert();
+
+drop trigger if exists trg_inbox_summary_delete on inbox_records;
+create trigger trg_inbox_summary_delete
+after delete on inbox_records
+referencing old table as old_rows
+for each statement execute function inbox_summary_on_delete();
+
+drop trigger if exists trg_inbox_summary_update on inbox_records;
+create trigger trg_inbox_summary_update
+after update on inbox_records
+referencing old table as old_rows new table as new_rows
+for each statement execute function inbox_summary_on_update();
+
+
+-- overdue / 7 天内到期：随时间变化，无法预先计数；只统计 pending，用部分索引做范围 count
+create index if not exists idx_inbox_records_owner_pending_due
+on inbox_records (owner_user_id, due_ts)
+where group_id is null and status = 'pending' and due_ts is not null;
+
+create index if not exists idx_inbox_records_group_pending_due
+on inbox_records (group_id, due_ts)
+where status = 'pending' and due_ts is not null;
@@ -0,0 +1,67 @@
+-- 每个 scope（个人 = owner_user_id / group = group_id）一个变更版本号
+-- inbox_records 任意写入都会 +1；列表 / 详情的 ETag 由它计算，304 不需要查 inbox_records
+create table if not exists inbox_scope_versions (
+  is_group boolean not null,
+  scope_id uuid not null,
+  version bigint not null default 0,
+  primary key (scope_id, is_group)
+);
+
+create or replace function inbox_scope_versions_bump_new() returns trigger as $$
+begin
+  insert into inbox_scope_versions (is_group, scope_id, version)
+  select distinct group_id is not null, coalesce(group_id, owner_user_id), 1
+  from new_rows
+  where coalesce(group_id, owner_user_id) is not null
+  order by 2, 1
+  on conflict (scope_id, is_group) do update set version = inbox_scope_versions.version + 1;
+  return null;
+end;
+$$ language plpgsql;
+
+create or replace function inbox_scope_versions_bump_old() returns trigger as $$
+begin
+  insert into inbox_scope_versions (is_group, scope_id, version)
+  select distinct group_id is not null, coalesce(group_id, owner_user_id), 1
+  from old_rows
+  where coalesce(group_id, owner_user_id) is not null
+  order by 2, 1
+  on conflict (scope_id, is_group) do update set version = inbox_scope_versions.version + 1;
+  return null;
+end;
+$$ language plpgsql;
+
+-- update 时新旧 scope 都要 bump（例如 owner 被删除后 owner_user_id 置 null）
+create or replace function inbox_scope_versions_bump_both() returns trigger as $$
+begin
+  insert into inbox_scope_versions (is_group, scope_id, version)
+  select distinct is_group, scope_id, 1
+  from (
+    select group_id is not null as is_group, coalesce(group_id, owner_user_id) as scope_id from old_rows
+    union
+    select group_id is not null, coalesce(group_id, owner_user_id) from new_rows
+  ) s
+  where scope_id is not null
+  order by 2, 1
+  on conflict (scope_id, is_group) do update set version = inbox_scope_versions.version + 1;
+  return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists trg_inbox_scope_versions_insert on inbox_records;
+create trigger trg_inbox_scope_versions_insert
+after insert on inbox_records
+referencing new table as new_rows
+for each statement execute function inbox_scope_versions_bump_new();
+
+drop trigger if exists trg_inbox_scope_versions_delete on inbox_records;
+create trigger trg_inbox_scope_versions_delete
+after delete on inbox_records
+referencing old table as old_rows
+for each statement execute function inbox_scope_versions_bump_old();
+
+drop trigger if exists trg_inbox_scope_versions_update on inbox_records;
+create trigger trg_inbox_scope_versions_update
+after update on inbox_records
+referencing old table as old_rows new table as new_rows
+for each statement execute function inbox_scope_versions_bump_both();
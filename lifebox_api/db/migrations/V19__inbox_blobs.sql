@@ -0,0 +1,69 @@
+-- raw_text / model_raw 移出 inbox_records：按内容 sha256 去重存到 inbox_blobs，行里只留 32 字节 hash
+-- 同一封邮件存进多个 group 只占一份；列表扫描不再拖着大字段
+create table if not exists inbox_blobs (
+  hash bytea primary key,                   -- sha256(utf8(body))
+  body text not null,
+  created_at timestamptz not null default now(),
+  last_used_at timestamptz not null default now()
+);
+
+-- 大文本由 TOAST 用 lz4 压缩（比默认 pglz 快、压缩率接近）
+alter table inbox_blobs alter column body set compression lz4;
+
+-- raw_text 搜索（/records/search）
+create index if not exists idx_inbox_blobs_body_trgm
+on inbox_blobs using gin (lower(body) gin_trgm_ops);
+
+alter table inbox_records
+  add column if not exists raw_text_hash bytea references inbox_blobs(hash),
+  add column if not exists model_raw_hash bytea references inbox_blobs(hash);
+
+create index if not exists idx_inbox_records_raw_text_hash on inbox_records (raw_text_hash);
+create index if not exists idx_inbox_records_model_raw_hash on inbox_records (model_raw_hash);
+
+
+-- 迁移已有数据（不触发 touch：内容没变，不应让所有客户端重新同步）
+insert into inbox_blobs (hash, body)
+select sha256(convert_to(raw_text, 'UTF8')), raw_text from inbox_records where raw_text is not null
+union
+select sha256(convert_to(model_raw, 'UTF8')), model_raw from inbox_records where model_raw is not null
+on conflict (hash) do nothing;
+
+alter table inbox_records alter column raw_text drop not null;
+
+alter table inbox_records disable trigger trg_inbox_records_touch;
+
+update inbox_records
+set raw_text_hash = case when raw_text is not null then sha256(convert_to(raw_text, 'UTF8')) end,
+    model_raw_hash = case when model_raw is not null then sha256(convert_to(model_raw, 'UTF8')) end,
+    raw_text = null,
+    model_raw = null
+where raw_text is not null or model_raw is not null;
+
+alter table inbox_records enable trigger trg_inbox_records_touch;
+
+alter table inbox_records
+  add constraint ck_inbox_records_raw_text check (raw_text is not null or raw_text_hash is not null);
+
+
+-- 搜索索引只保留 title + notes（raw_text 走 idx_inbox_blobs_body_trgm）
+drop index if exists idx_inbox_records_search_trgm;
+
+create index if not exists idx_inbox_records_search_head_trgm
+on inbox_records using gin (inbox_search_text(title, normalized, null) gin_trgm_ops);
+
+
+-- 清理没有记录引用的 blob；last_used_at 保护正在写入中的 blob（写入时 upsert 会刷新它）
+create or replace function inbox_blobs_gc(min_age interval default interval '1 day')
+returns bigint
+language sql
+as $$
+  with d as (
+    delete from inbox_blobs b
+    where b.last_used_at < now() - min_age
+      and not exists (select 1 from inbox_records r where r.raw_text_hash = b.hash)
+      and not exists (select 1 from inbox_records r where r.model_raw_hash = b.hash)
+    returning 1
+  )
+  select count(*) from d
+$$;
@@ -0,0 +1,119 @@
+-- 冷数据归档：很久以前已完成（done）的记录整行移到 inbox_records_archive
+-- 热表只留近期 / 未完成的记录，列表查询和 autovacuum 都不再随历史数据增长
+-- 归档行就是 stub：get_record / delete / patch 碰到时会把它原样搬回 inbox_records
+create table if not exists inbox_records_archive (
+  id uuid primary key,
+  owner_user_id uuid,
+  group_id uuid,
+  client_id text,
+  created_at timestamptz not null,
+  raw_text_hash bytea references inbox_blobs(hash),
+  model_raw_hash bytea references inbox_blobs(hash),
+  payload jsonb not null,                   -- to_jsonb(inbox_records 整行)
+  archived_at timestamptz not null default now()
+);
+
+alter table inbox_records_archive alter column payload set compression lz4;
+
+create index if not exists idx_inbox_records_archive_raw_text_hash on inbox_records_archive (raw_text_hash);
+create index if not exists idx_inbox_records_archive_model_raw_hash on inbox_records_archive (model_raw_hash);
+
+-- 归档候选扫描
+create index if not exists idx_inbox_records_done_updated
+on inbox_records (updated_at)
+where status = 'done';
+
+
+-- 归档时的 delete 不写墓碑：客户端本地仍保留这条记录
+create or replace function inbox_records_tombstone() returns trigger as $$
+begin
+  if current_setting('lifebox.archiving', true) = 'on' then
+    return old;
+  end if;
+  insert into inbox_tombstones (record_id, owner_user_id, group_id)
+  values (old.id, old.owner_user_id, old.group_id)
+  on conflict (record_id) do update set
+    owner_user_id = excluded.owner_user_id,
+    group_id = excluded.group_id,
+    deleted_xid = pg_current_xact_id(),
+    deleted_at = now();
+  return old;
+end;
+$$ language plpgsql;
+
+
+-- 一批：updated_at < cutoff 的 done 记录移到归档表，返回移动条数
+create or replace function inbox_archive_batch(cutoff timestamptz, batch_size int)
+returns int
+language plpgsql
+as $$
+declare
+  n int;
+begin
+  perform set_config('lifebox.archiving', 'on', true);
+
+  with moved as (
+    delete from inbox_records r
+    where r.id in (
+      select id
+      from inbox_records
+      where status = 'done' and updated_at < cutoff
+      order by updated_at
+      limit batch_size
+      for update skip locked
+    )
+    returning r.*
+  )
+  insert into inbox_records_archive (id, owner_user_id, group_id, client_id, created_at, raw_text_hash, model_raw_hash, payload)
+  select id, owner_user_id, group_id, client_id, created_at, raw_text_hash, model_raw_hash, to_jsonb(moved)
+  from moved;
+  get diagnostics n = row_count;
+
+  perform set_config('lifebox.archiving', 'off', true);
+  return n;
+end;
+$$;
+
+
+-- 搬回热表（change_xid 取当前事务，sync 会把它当作一次更新下发）
+-- client_id 已被新记录占用时插入不了：归档行保留，返回 false
+create or replace function inbox_rehydrate(record_id uuid)
+returns boolean
+language sql
+as $$
+  with a as (
+    select payload from inbox_records_archive where id = record_id for update
+  ),
+  ins as (
+    insert into inbox_records
+    select (jsonb_populate_record(
+      null::inbox_records,
+      payload || jsonb_build_object('change_xid', pg_current_xact_id()::text)
+    )).*
+    from a
+    on conflict do nothing
+    returning id
+  ),
+  del as (
+    delete from inbox_records_archive where id in (select id from ins)
+  )
+  select exists (select 1 from ins)
+$$;
+
+
+-- blob GC 也要算上归档表里的引用
+create or replace function inbox_blobs_gc(min_age interval default interval '1 day')
+returns bigint
+language sql
+as $$
+  with d as (
+    delete from inbox_blobs b
+    where b.last_used_at < now() - min_age
+      and not exists (select 1 from inbox_records r where r.raw_text_hash = b.hash)
+      and not exists (select 1 from inbox_records r where r.model_raw_hash = b.hash)
+      and not exists (select 1 from inbox_records_archive a where a.raw_text_hash = b.hash)
+      and not exists (select 1 from inbox_records_archive a where a.model_raw_hash = b.hash)
+    returning 1
+  )
+  select count(*) from d
+$$;
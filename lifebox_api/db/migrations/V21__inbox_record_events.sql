@@ -0,0 +1,84 @@
+-- inbox_records 的增删改通过 pg_notify 推给各 worker（/api/cloud/stream 用）
+-- 放在触发器里：save / bulk / patch / status / delete 以及归档回迁都会触发，不用每个接口各自 notify
+-- notify 随事务提交才送达，回滚的写入不会推送
+-- 单条语句在同一 scope 里改了很多行（bulk 上传 / 批量改状态）时只发一条 resync，避免刷屏
+
+create or replace function inbox_records_notify_emit(p_op text, p_rows jsonb) returns void as $$
+declare
+  s record;
+begin
+  if p_rows is null or current_setting('lifebox.archiving', true) = 'on' then
+    return;
+  end if;
+
+  for s in
+    select x->>'group_id' as group_id,
+           case when x->>'group_id' is null then x->>'owner_user_id' end as owner_user_id,
+           jsonb_agg(x) as items
+    from jsonb_array_elements(p_rows) x
+    group by 1, 2
+  loop
+    if s.group_id is null and s.owner_user_id is null then
+      continue;
+    end if;
+
+    if jsonb_array_length(s.items) > 50 then
+      perform pg_notify(
+        'inbox_record_changed',
+        jsonb_build_object('op', 'resync', 'group_id', s.group_id, 'owner_user_id', s.owner_user_id)::text
+      );
+    else
+      perform pg_notify('inbox_record_changed', (x || jsonb_build_object('op', p_op))::text)
+      from jsonb_array_elements(s.items) x;
+    end if;
+  end loop;
+end;
+$$ language plpgsql;
+
+create or replace function inbox_records_notify_new() returns trigger as $$
+begin
+  perform inbox_records_notify_emit(
+    lower(tg_op),
+    (
+      select jsonb_agg(jsonb_build_object(
+        'id', id, 'group_id', group_id, 'owner_user_id', owner_user_id, 'version', version
+      ))
+      from new_rows
+    )
+  );
+  return null;
+end;
+$$ language plpgsql;
+
+create or replace function inbox_records_notify_old() returns trigger as $$
+begin
+  perform inbox_records_notify_emit(
+    'delete',
+    (
+      select jsonb_agg(jsonb_build_object(
+        'id', id, 'group_id', group_id, 'owner_user_id', owner_user_id, 'version', version
+      ))
+      from old_rows
+    )
+  );
+  return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists trg_inbox_records_notify_insert on inbox_records;
+create trigger trg_inbox_records_notify_insert
+after insert on inbox_records
+referencing new table as new_rows
+for each statement execute function inbox_records_notify_new();
+
+drop trigger if exists trg_inbox_records_notify_update on inbox_records;
+create trigger trg_inbox_records_notify_update
+after update on inbox_records
+referencing new table as new_rows
+for each statement execute function inbox_records_notify_new();
+
+drop trigger if exists trg_inbox_records_notify_delete on inbox_records;
+create trigger trg_inbox_records_notify_delete
+after delete on inbox_records
+referencing old table as old_rows
+for each statement execute function inbox_records_notify_old();
@@ -0,0 +1,19 @@
+-- 每次 Ollama 调用的 token 数 / 耗时（app/llm_telemetry.py 批量 COPY 写入）
+-- 用来估算推理硬件、判断 num_ctx 是否截断输入；只是统计数据，所以 UNLOGGED
+create unlogged table if not exists ollama_calls (
+  created_at timestamptz not null default now(),
+  model text not null,
+  locale text,
+  mode text,                                -- analyze 的 mode：llm / hybrid
+  stream boolean not null default false,
+  input_chars integer,                      -- 原文长度（不含 prompt 模板）
+  num_ctx integer,
+  prompt_eval_count integer,
+  eval_count integer,
+  load_duration_ns bigint,
+  prompt_eval_duration_ns bigint,
+  eval_duration_ns bigint,
+  total_duration_ns bigint
+);
+
+create index if not exists idx_ollama_calls_created_at on ollama_calls(created_at);
@@ -0,0 +1,93 @@
+-- 归档修正（V20）
+-- 1) (owner_user_id, client_id) 唯一性要跨 inbox_records / inbox_records_archive：
+--    归档行仍留在客户端（没有墓碑），重新上传同一 client_id 不能在热表里再建一条
+-- 2) 有 record_shares 的记录不归档（delete 会级联删掉共享授权）
+-- 3) 搬回时 touch updated_at，不会在下一轮又被归档
+
+create index if not exists idx_inbox_records_archive_owner_client
+on inbox_records_archive (owner_user_id, client_id)
+where client_id is not null;
+
+-- 写入方（save / bulk）拿 shared 锁，归档拿 exclusive（try，拿不到就跳过这个用户）：
+-- 锁到手后再查归档表，查询用的是新快照，不会错过刚提交的归档
+create or replace function inbox_records_client_id_guard() returns trigger as $$
+begin
+  if new.client_id is null or new.owner_user_id is null then
+    return new;
+  end if;
+  perform pg_advisory_xact_lock_shared(301838534, hashtext(new.owner_user_id::text));
+  if exists (
+    select 1 from inbox_records_archive a
+    where a.owner_user_id = new.owner_user_id
+      and a.client_id = new.client_id
+      and a.id <> new.id                    -- inbox_rehydrate 搬回的就是这一行
+  ) then
+    return null;                            -- 跳过：调用方按“已存在”处理
+  end if;
+  return new;
+end;
+$$ language plpgsql;
+
+drop trigger if exists trg_inbox_records_client_id_guard on inbox_records;
+create trigger trg_inbox_records_client_id_guard
+before insert on inbox_records
+for each row execute function inbox_records_client_id_guard();
+
+
+create or replace function inbox_archive_batch(cutoff timestamptz, batch_size int)
+returns int
+language plpgsql
+as $$
+declare
+  n int;
+begin
+  perform set_config('lifebox.archiving', 'on', true);
+
+  with moved as (
+    delete from inbox_records r
+    where r.id in (
+      select c.id
+      from inbox_records c
+      where c.status = 'done' and c.updated_at < cutoff
+        and not exists (select 1 from record_shares s where s.record_id = c.id)
+        and pg_try_advisory_xact_lock(301838534, hashtext(coalesce(c.owner_user_id::text, '')))
+      order by c.updated_at
+      limit batch_size
+      for update skip locked
+    )
+    returning r.*
+  )
+  insert into inbox_records_archive (id, owner_user_id, group_id, client_id, created_at, raw_text_hash, model_raw_hash, payload)
+  select id, owner_user_id, group_id, client_id, created_at, raw_text_hash, model_raw_hash, to_jsonb(moved)
+  from moved;
+  get diagnostics n = row_count;
+
+  perform set_config('lifebox.archiving', 'off', true);
+  return n;
+end;
+$$;
+
+
+-- 搬回热表：change_xid 取当前事务（归档期间首次同步的设备没有这条），updated_at = now()（重新计算归档期限）
+create or replace function inbox_rehydrate(record_id uuid)
+returns boolean
+language sql
+as $$
+  with a as (
+    select payload from inbox_records_archive where id = record_id for update
+  ),
+  ins as (
+    insert into inbox_records
+    select (jsonb_populate_record(
+      null::inbox_records,
+      payload || jsonb_build_object('change_xid', pg_current_xact_id()::text, 'updated_at', now())
+    )).*
+    from a
+    on conflict do nothing
+    returning id
+  ),
+  del as (
+    delete from inbox_records_archive where id in (select id from ins)
+  )
+  select exists (select 1 from ins)
+$$;
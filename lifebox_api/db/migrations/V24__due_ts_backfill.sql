@@ -0,0 +1,45 @@
+-- V11 之前保存的记录只有 due_at 没有 due_ts：由 app/due_backfill.py 分批补上（按 created_at / locale 解析）
+-- 1) 待补行的部分索引：按 id keyset 分批扫描
+-- 2) 回填不是用户编辑：不动 updated_at / version（客户端乐观锁不会 409，也不影响归档判断），
+--    只刷新 change_xid，让 delta sync 把 due_ts 下发
+
+create index if not exists idx_inbox_records_due_ts_missing
+on inbox_records (id)
+where due_at is not null and due_ts is null;
+
+create or replace function inbox_records_touch() returns trigger as $$
+begin
+  new.change_xid := pg_current_xact_id();
+  if current_setting('lifebox.backfill', true) = 'on' then
+    return new;
+  end if;
+  new.updated_at := now();
+  new.version := old.version + 1;
+  return new;
+end;
+$$ language plpgsql;
+
+
+-- 一批：due_at 仍是解析时的值、且 due_ts 还是空的行才写（期间被 PATCH 过的跳过），返回更新条数
+create or replace function inbox_due_backfill(ids uuid[], due_ats text[], due_tss timestamptz[], precisions text[])
+returns int
+language plpgsql
+as $$
+declare
+  n int;
+begin
+  perform set_config('lifebox.backfill', 'on', true);
+
+  update inbox_records r
+  set due_ts = u.due_ts,
+      due_precision = u.due_precision
+  from unnest(ids, due_ats, due_tss, precisions) as u(id, due_at, due_ts, due_precision)
+  where r.id = u.id
+    and r.due_at = u.due_at
+    and r.due_ts is null;
+  get diagnostics n = row_count;
+
+  perform set_config('lifebox.backfill', 'off', true);
+  return n;
+end;
+$$;
@@ -0,0 +1,7 @@
+-- prompt_eval_count 不含 Ollama 复用的 prompt 前缀缓存，不能用来判断是否占满 num_ctx
+-- 改为记录整个 prompt（system + user）的估算 token 数和 num_predict，与缓存无关
+alter table ollama_calls
+  add column if not exists prompt_tokens_est integer;
+
+alter table ollama_calls
+  add column if not exists num_predict integer;
@@ -0,0 +1,41 @@
+-- V23 的 inbox_archive_batch 在候选查询的 where 里 pg_try_advisory_xact_lock：
+-- 带 order by / limit 时 planner 可能对远多于 batch_size 的行求值，每次成功都持锁到事务结束，
+-- 一批会锁住很多并不归档的用户（这些用户的 save / bulk 在此期间被阻塞）
+-- 改为先取至多 batch_size 个候选（materialized），只对这些行尝试加锁
+create or replace function inbox_archive_batch(cutoff timestamptz, batch_size int)
+returns int
+language plpgsql
+as $$
+declare
+  n int;
+begin
+  perform set_config('lifebox.archiving', 'on', true);
+
+  with cand as materialized (
+    select c.id, c.owner_user_id
+    from inbox_records c
+    where c.status = 'done' and c.updated_at < cutoff
+      and not exists (select 1 from record_shares s where s.record_id = c.id)
+    order by c.updated_at
+    limit batch_size
+    for update skip locked
+  ),
+  locked as materialized (
+    select cand.id
+    from cand
+    where pg_try_advisory_xact_lock(301838534, hashtext(coalesce(cand.owner_user_id::text, '')))
+  ),
+  moved as (
+    delete from inbox_records r
+    where r.id in (select id from locked)
+    returning r.*
+  )
+  insert into inbox_records_archive (id, owner_user_id, group_id, client_id, created_at, raw_text_hash, model_raw_hash, payload)
+  select id, owner_user_id, group_id, client_id, created_at, raw_text_hash, model_raw_hash, to_jsonb(moved)
+  from moved;
+  get diagnostics n = row_count;
+
+  perform set_config('lifebox.archiving', 'off', true);
+  return n;
+end;
+$$;
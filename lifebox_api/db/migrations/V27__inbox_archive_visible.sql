@@ -0,0 +1,216 @@
+-- 归档对客户端透明（V20 起归档行从热表删掉且不留 stub：列表 / 搜索 / 日历 / 首次 sync / summary 都看不到它）
+-- 1) inbox_records_archived：与 inbox_records 同名列的视图，读接口把它 union 进来（app/cloud_routes.py）
+-- 2) 归档表补上 change_xid / due_ts 实列 + 与热表对应的索引（keyset / sync / 日历 / 搜索都能走索引）
+-- 3) 归档 / 搬回只是换表：不再改 inbox_summary，也不推送事件（lifebox.archiving）；
+--    V20 以来被归档扣掉的计数这里一次补回
+
+-- 迁移期间挡住归档 job：summary 补数和换函数要看到同一份归档表
+lock table inbox_records_archive in share row exclusive mode;
+
+alter table inbox_records_archive
+  add column if not exists change_xid xid8;
+
+alter table inbox_records_archive
+  add column if not exists due_ts timestamptz;
+
+update inbox_records_archive
+set change_xid = (payload->>'change_xid')::xid8,
+    due_ts = (payload->>'due_ts')::timestamptz
+where change_xid is null;
+
+alter table inbox_records_archive alter column change_xid set not null;
+
+
+create or replace view inbox_records_archived as
+select a.id,
+       a.created_at,
+       (a.payload->>'updated_at')::timestamptz as updated_at,
+       a.client_id,
+       a.payload->>'locale' as locale,
+       a.payload->>'source_hint' as source_hint,
+       a.payload->>'raw_text' as raw_text,
+       a.payload->>'model' as model,
+       a.payload->>'title' as title,
+       a.payload->>'source' as source,
+       a.payload->>'assignee' as assignee,
+       a.payload->>'due_at' as due_at,
+       (a.payload->>'amount')::double precision as amount,
+       a.payload->>'currency' as currency,
+       a.payload->>'risk' as risk,
+       a.payload->>'status' as status,
+       a.payload->'normalized' as normalized,
+       (a.payload->>'color_value')::bigint as color_value,
+       a.owner_user_id,
+       a.group_id,
+       a.due_ts,
+       a.payload->>'due_precision' as due_precision,
+       a.change_xid,
+       (a.payload->>'version')::bigint as version,
+       a.raw_text_hash,
+       a.model_raw_hash,
+       a.archived_at
+from inbox_records_archive a;
+
+
+-- 与热表的 keyset / sync / 日历索引一一对应
+create index if not exists idx_inbox_records_archive_owner_created
+on inbox_records_archive (owner_user_id, created_at, id)
+where group_id is null;
+
+create index if not exists idx_inbox_records_archive_group_created
+on inbox_records_archive (group_id, created_at, id)
+where group_id is not null;
+
+create index if not exists idx_inbox_records_archive_owner_change
+on inbox_records_archive (owner_user_id, change_xid, id)
+where group_id is null;
+
+create index if not exists idx_inbox_records_archive_group_change
+on inbox_records_archive (group_id, change_xid, id)
+where group_id is not null;
+
+create index if not exists idx_inbox_records_archive_owner_due_ts
+on inbox_records_archive (owner_user_id, due_ts)
+where group_id is null and due_ts is not null;
+
+create index if not exists idx_inbox_records_archive_group_due_ts
+on inbox_records_archive (group_id, due_ts)
+where due_ts is not null;
+
+-- 与视图里 inbox_search_text(title, normalized, null) 展开后的表达式一致
+create index if not exists idx_inbox_records_archive_search_head_trgm
+on inbox_records_archive using gin (inbox_search_text(payload->>'title', payload->'normalized', null) gin_trgm_ops);
+
+
+-- 归档 / 搬回时 insert、delete 不改计数（记录一直都在，只是换了表）
+create or replace function inbox_summary_on_insert() returns trigger as $$
+begin
+  if current_setting('lifebox.archiving', true) = 'on' then
+    return null;
+  end if;
+  insert into inbox_summary (is_group, scope_id, risk, status, currency, n, amount_sum)
+  select group_id is not null, coalesce(group_id, owner_user_id), risk, status, coalesce(currency, ''),
+         count(*), coalesce(sum(amount), 0)
+  from new_rows
+  where coalesce(group_id, owner_user_id) is not null
+  group by 1, 2, 3, 4, 5
+  order by 2, 1, 3, 4, 5
+  on conflict (scope_id, is_group, risk, status, currency) do update set
+    n = inbox_summary.n + excluded.n,
+    amount_sum = inbox_summary.amount_sum + excluded.amount_sum;
+  return null;
+end;
+$$ language plpgsql;
+
+create or replace function inbox_summary_on_delete() returns trigger as $$
+begin
+  if current_setting('lifebox.archiving', true) = 'on' then
+    return null;
+  end if;
+  insert into inbox_summary (is_group, scope_id, risk, status, currency, n, amount_sum)
+  select group_id is not null, coalesce(group_id, owner_user_id), risk, status, coalesce(currency, ''),
+         -count(*), -coalesce(sum(amount), 0)
+  from old_rows
+  where coalesce(group_id, owner_user_id) is not null
+  group by 1, 2, 3, 4, 5
+  order by 2, 1, 3, 4, 5
+  on conflict (scope_id, is_group, risk, status, currency) do update set
+    n = inbox_summary.n + excluded.n,
+    amount_sum = inbox_summary.amount_sum + excluded.amount_sum;
+  return null;
+end;
+$$ language plpgsql;
+
+-- 补回 V20 以来归档时扣掉的计数
+insert into inbox_summary (is_group, scope_id, risk, status, currency, n, amount_sum)
+select group_id is not null,
+       coalesce(group_id, owner_user_id),
+       payload->>'risk',
+       payload->>'status',
+       coalesce(payload->>'currency', ''),
+       count(*),
+       coalesce(sum((payload->>'amount')::numeric), 0)
+from inbox_records_archive
+where coalesce(group_id, owner_user_id) is not null
+group by 1, 2, 3, 4, 5
+order by 2, 1, 3, 4, 5
+on conflict (scope_id, is_group, risk, status, currency) do update set
+  n = inbox_summary.n + excluded.n,
+  amount_sum = inbox_summary.amount_sum + excluded.amount_sum;
+
+
+-- 归档一批（V26）：同时写 change_xid / due_ts 实列
+create or replace function inbox_archive_batch(cutoff timestamptz, batch_size int)
+returns int
+language plpgsql
+as $$
+declare
+  n int;
+begin
+  perform set_config('lifebox.archiving', 'on', true);
+
+  with cand as materialized (
+    select c.id, c.owner_user_id
+    from inbox_records c
+    where c.status = 'done' and c.updated_at < cutoff
+      and not exists (select 1 from record_shares s where s.record_id = c.id)
+    order by c.updated_at
+    limit batch_size
+    for update skip locked
+  ),
+  locked as materialized (
+    select cand.id
+    from cand
+    where pg_try_advisory_xact_lock(301838534, hashtext(coalesce(cand.owner_user_id::text, '')))
+  ),
+  moved as (
+    delete from inbox_records r
+    where r.id in (select id from locked)
+    returning r.*
+  )
+  insert into inbox_records_archive (
+    id, owner_user_id, group_id, client_id, created_at, raw_text_hash, model_raw_hash, change_xid, due_ts, payload
+  )
+  select id, owner_user_id, group_id, client_id, created_at, raw_text_hash, model_raw_hash, change_xid, due_ts, to_jsonb(moved)
+  from moved;
+  get diagnostics n = row_count;
+
+  perform set_config('lifebox.archiving', 'off', true);
+  return n;
+end;
+$$;
+
+
+-- 搬回热表（V23）：记录一直对客户端可见，搬回不推送事件、不改计数；
+-- change_xid 取当前事务、updated_at = now()，sync 会把它当作一次更新下发，也不会立刻又被归档
+create or replace function inbox_rehydrate(record_id uuid)
+returns boolean
+language plpgsql
+as $$
+declare
+  ok boolean;
+begin
+  perform set_config('lifebox.archiving', 'on', true);
+
+  with a as (
+    select payload from inbox_records_archive where id = record_id for update
+  ),
+  ins as (
+    insert into inbox_records
+    select (jsonb_populate_record(
+      null::inbox_records,
+      payload || jsonb_build_object('change_xid', pg_current_xact_id()::text, 'updated_at', now())
+    )).*
+    from a
+    on conflict do nothing
+    returning id
+  ),
+  del as (
+    delete from inbox_records_archive where id in (select id from ins)
+  )
+  select exists (select 1 from ins) into ok;
+
+  perform set_config('lifebox.archiving', 'off', true);
+  return ok;
+end;
+$$;
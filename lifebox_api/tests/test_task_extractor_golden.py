@@ -0,0 +1,61 @@
+"""
+Golden corpus for the one-pass entity scanner (task_extractor.scan_entities).
+
+tests/golden/entities.json holds real-looking messages with the current outputs of the
+extract_* helpers. Where the scanner intentionally differs from the old per-entity regexes,
+the case also records the old output under "legacy" and the reason under "why":
+
+- no_fragment_dates: phone numbers / years are no longer re-read as dates
+  ("03-1234-5678" gave "03-12", "34-56"; "2025/02/28" also gave "25/02"; "3月3日" also gave "3日").
+  choose_due_at therefore no longer picks such a fragment as the due date.
+- fullwidth: fullwidth digits and separators are matched as-is
+  ("１，２００円" is 1200, not 200; "１２：３０", "￥3,000", "ＵＳＤ 45" are now found).
+- overlap_leftmost: one span per character, leftmost match wins. In "¥4時" the "4" belongs to
+  the amount "¥4", so the time "4時" is no longer a candidate.
+- adjacent_currency: parse_amount_with_currency takes the currency attached to the chosen
+  amount ("USD 20 を 円 で払う" -> USD); detect_currency keeps the old precedence (JPY).
+"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+
+from app import task_extractor as te
+
+CORPUS = json.loads((Path(__file__).parent / "golden" / "entities.json").read_text(encoding="utf-8"))
+
+INTENTIONAL = {"no_fragment_dates", "fullwidth", "overlap_leftmost", "adjacent_currency"}
+
+
+def _outputs(text: str, spans=None):
+    return {
+        "urls": te.extract_urls(text, spans),
+        "phones": te.extract_phones(text, spans),
+        "currency": te.detect_currency(text, spans),
+        "amount": te.parse_amount(text, spans),
+        "dates": te.extract_date_candidates(text, spans),
+        "times": te.extract_time_candidates(text, spans),
+        "due_at": te.choose_due_at(text, spans),
+        "amount_currency": list(te.parse_amount_with_currency(text, spans)),
+    }
+
+
+@pytest.mark.parametrize("case", CORPUS, ids=lambda c: c["text"][:24] or "<empty>")
+def test_golden(case):
+    assert _outputs(case["text"]) == case["expected"]
+
+
+@pytest.mark.parametrize("case", CORPUS, ids=lambda c: c["text"][:24] or "<empty>")
+def test_precomputed_spans_match(case):
+    # scan once, pass spans= everywhere: same answers as scanning per call
+    assert _outputs(case["text"], te.scan_entities(case["text"])) == case["expected"]
+
+
+def test_differences_are_documented():
+    for case in CORPUS:
+        if "legacy" in case:
+            assert case.get("why"), case["text"]
+        for why in filter(None, case.get("why", "").split(",")):
+            assert why in INTENTIONAL, (case["text"], why)